@@ -0,0 +1,62 @@
+"""Python client for the sparkproxy HTTP API.
+
+    from sparkproxy import SparkProxy
+
+    with SparkProxy("https://sparkproxy.example.com") as client:
+        wallet = client.initialize()
+        print(client.balance(wallet.mnemonic).balance)
+"""
+from .aio import AsyncSparkProxy
+from .client import SparkProxy
+from .errors import APIError, NotFoundError, SparkProxyError, TransportError
+from .models import (
+    Balance,
+    BatchResult,
+    CallInfo,
+    CoopExit,
+    DepositUtxo,
+    Invoice,
+    InvoiceStatus,
+    LightningInvoice,
+    LightningPayment,
+    Offer,
+    RetryPolicy,
+    StaticDepositAddress,
+    StaticDepositClaim,
+    StaticDepositClaims,
+    TokenBalance,
+    TokenInfo,
+    TransferResult,
+    WalletBatch,
+    WalletBatchItem,
+    WalletInfo,
+)
+
+__all__ = [
+    "APIError",
+    "AsyncSparkProxy",
+    "Balance",
+    "BatchResult",
+    "CallInfo",
+    "CoopExit",
+    "DepositUtxo",
+    "Invoice",
+    "InvoiceStatus",
+    "LightningInvoice",
+    "LightningPayment",
+    "NotFoundError",
+    "Offer",
+    "RetryPolicy",
+    "SparkProxy",
+    "SparkProxyError",
+    "StaticDepositAddress",
+    "StaticDepositClaim",
+    "StaticDepositClaims",
+    "TokenBalance",
+    "TokenInfo",
+    "TransferResult",
+    "TransportError",
+    "WalletBatch",
+    "WalletBatchItem",
+    "WalletInfo",
+]
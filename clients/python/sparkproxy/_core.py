@@ -0,0 +1,293 @@
+"""Transport-independent pieces shared by the sync and async clients.
+
+Each route is described once as a ``Call`` (method, path, headers, body and
+a parser for the 200 response); the clients only differ in how they send it.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+from . import models
+from .errors import APIError, NotFoundError
+from .models import CallInfo, Environment, ExitSpeed, Network, Offer, RetryPolicy
+
+logger = logging.getLogger("sparkproxy")
+
+Hook = Callable[[CallInfo], None]
+
+
+@dataclass(frozen=True)
+class Call:
+    operation: str
+    method: str
+    path: str
+    headers: Dict[str, str]
+    parse: Callable[[Any], Any]
+    json: Any = None
+    params: Optional[Dict[str, str]] = None
+    # Safe to send again after the server may have seen it.
+    idempotent: bool = True
+    # Overrides the client timeout for long-running calls.
+    timeout: Optional[float] = None
+
+    def request_kwargs(self) -> Dict[str, Any]:
+        kwargs: Dict[str, Any] = {"headers": self.headers, "json": self.json, "params": self.params}
+        if self.timeout is not None:
+            kwargs["timeout"] = self.timeout
+        return kwargs
+
+
+def new_idempotency_key() -> str:
+    return str(uuid.uuid4())
+
+
+class Calls:
+    """Builds a ``Call`` for every route in the wallet and payment routers."""
+
+    def __init__(self, network: Network, environment: Environment):
+        self.network = network
+        self.environment = environment
+
+    def _network_headers(self) -> Dict[str, str]:
+        return {"spark-network": self.network, "spark-environment": self.environment}
+
+    def _wallet_headers(self, mnemonic: str, idempotency_key: Optional[str] = None) -> Dict[str, str]:
+        headers = {**self._network_headers(), "spark-mnemonic": mnemonic}
+        if idempotency_key is not None:
+            headers["idempotency-key"] = idempotency_key
+        return headers
+
+    # Wallet
+
+    def initialize(self) -> Call:
+        return Call("initialize", "GET", "/wallet/initialize", self._network_headers(), models.WalletInfo.from_json)
+
+    def batch_initialize(self, count: int) -> Call:
+        return Call(
+            "batch_initialize", "GET", "/wallet/batch-initialize", self._network_headers(),
+            lambda data: [models.WalletInfo.from_json(w) for w in data],
+            params={"count": str(count)},
+        )
+
+    def balance(self, mnemonic: str, fresh: bool = False) -> Call:
+        headers = self._wallet_headers(mnemonic)
+        if fresh:
+            headers["cache-control"] = "no-cache"
+        return Call("balance", "GET", "/wallet/balance", headers, models.Balance.from_json)
+
+    def transfer(self, mnemonic: str, receiver_spark_address: str, amount_sats: int, idempotency_key: Optional[str]) -> Call:
+        return Call(
+            "transfer", "POST", "/wallet/transfer",
+            self._wallet_headers(mnemonic, idempotency_key or new_idempotency_key()),
+            models.TransferResult.from_json,
+            json={"amountSats": amount_sats, "receiverSparkAddress": receiver_spark_address},
+        )
+
+    def token_transfer(
+        self, mnemonic: str, receiver_spark_address: str, token_identifier: str, token_amount: int,
+        idempotency_key: Optional[str],
+    ) -> Call:
+        return Call(
+            "token_transfer", "POST", "/wallet/token-transfer",
+            self._wallet_headers(mnemonic, idempotency_key or new_idempotency_key()),
+            models.TransferResult.from_json,
+            json={
+                "tokenAmount": token_amount,
+                "tokenIdentifier": token_identifier,
+                "receiverSparkAddress": receiver_spark_address,
+            },
+        )
+
+    def pay_lightning_invoice(self, mnemonic: str, invoice: str, max_fee_sats: int, idempotency_key: Optional[str]) -> Call:
+        return Call(
+            "pay_lightning_invoice", "POST", "/wallet/lightning/pay",
+            self._wallet_headers(mnemonic, idempotency_key or new_idempotency_key()),
+            models.LightningPayment.from_json,
+            json={"invoice": invoice, "maxFeeSats": max_fee_sats},
+        )
+
+    def create_lightning_invoice(
+        self, mnemonic: str, amount_sats: int, memo: str, expiry_seconds: Optional[int], idempotency_key: Optional[str],
+    ) -> Call:
+        body: Dict[str, Any] = {"amount": amount_sats, "memo": memo}
+        if expiry_seconds is not None:
+            body["expirySeconds"] = expiry_seconds
+        return Call(
+            "create_lightning_invoice", "POST", "/wallet/lightning/create",
+            self._wallet_headers(mnemonic, idempotency_key or new_idempotency_key()),
+            models.LightningInvoice.from_json,
+            json=body,
+        )
+
+    def create_lightning_invoice_for_user(
+        self, receiver_identity_pubkey: str, amount_sats: int, memo: str, expiry_seconds: Optional[int],
+    ) -> Call:
+        body: Dict[str, Any] = {"receiverIdentityPubkey": receiver_identity_pubkey, "amount": amount_sats, "memo": memo}
+        if expiry_seconds is not None:
+            body["expirySeconds"] = expiry_seconds
+        # This route takes no idempotency key, so only connection failures are retried.
+        return Call(
+            "create_lightning_invoice_for_user", "POST", "/wallet/lightning/create-for-user",
+            self._network_headers(), models.LightningInvoice.from_json, json=body, idempotent=False,
+        )
+
+    def static_deposit_address(self, mnemonic: str) -> Call:
+        return Call(
+            "static_deposit_address", "GET", "/wallet/static-deposit-address",
+            self._wallet_headers(mnemonic), models.StaticDepositAddress.from_json,
+        )
+
+    def deposit_utxos(self, mnemonic: str, deposit_address: str, include_claimed: bool) -> Call:
+        return Call(
+            "deposit_utxos", "GET", "/wallet/deposit-utxos", self._wallet_headers(mnemonic),
+            lambda data: [models.DepositUtxo.from_json(u) for u in data["utxos"]],
+            params={"depositAddress": deposit_address, "includeClaimed": "true" if include_claimed else "false"},
+        )
+
+    def claim_static_deposit(self, mnemonic: str, tx_hash: str, vout: int, idempotency_key: Optional[str]) -> Call:
+        return Call(
+            "claim_static_deposit", "POST", "/wallet/claim-static-deposit",
+            self._wallet_headers(mnemonic, idempotency_key or new_idempotency_key()),
+            models.StaticDepositClaim.from_json,
+            json={"txHash": tx_hash, "vout": vout},
+        )
+
+    def claim_all_static_deposits(self, mnemonic: str, idempotency_key: Optional[str]) -> Call:
+        return Call(
+            "claim_all_static_deposits", "POST", "/wallet/claim-all-static-deposits",
+            self._wallet_headers(mnemonic, idempotency_key or new_idempotency_key()),
+            models.StaticDepositClaims.from_json,
+        )
+
+    def coop_exit(
+        self, mnemonic: str, onchain_address: str, amount_sats: int, exit_speed: Optional[ExitSpeed],
+        deduct_fee_from_withdrawal_amount: Optional[bool], idempotency_key: Optional[str],
+    ) -> Call:
+        body: Dict[str, Any] = {"onchainAddress": onchain_address, "amountSats": amount_sats}
+        if exit_speed is not None:
+            body["exitSpeed"] = exit_speed
+        if deduct_fee_from_withdrawal_amount is not None:
+            body["deductFeeFromWithdrawalAmount"] = deduct_fee_from_withdrawal_amount
+        return Call(
+            "coop_exit", "POST", "/wallet/coop-exit",
+            self._wallet_headers(mnemonic, idempotency_key or new_idempotency_key()),
+            models.CoopExit.from_json,
+            json=body,
+        )
+
+    def wallet_batch(self, mnemonic: str, items: Sequence[Dict[str, Any]], stop_on_error: bool) -> Call:
+        # Every item gets a key so that retrying the whole batch never repeats a payment.
+        body_items = [{**item, "idempotencyKey": item.get("idempotencyKey") or new_idempotency_key()} for item in items]
+        return Call(
+            "wallet_batch", "POST", "/wallet/batch", self._wallet_headers(mnemonic),
+            models.WalletBatch.from_json,
+            json={"items": body_items, "stopOnError": stop_on_error},
+            # The server allows 30s plus 15s per item.
+            timeout=30.0 + 15.0 * len(body_items),
+        )
+
+    # Payment
+
+    def create_invoice(
+        self, offers: Sequence[Offer], spark_address: str, webhook_url: str, idempotency_key: Optional[str],
+    ) -> Call:
+        return Call(
+            "create_invoice", "POST", "/payment",
+            {"idempotency-key": idempotency_key or new_idempotency_key()},
+            models.Invoice.from_json,
+            json={
+                "network": self.network,
+                "webhook_url": webhook_url,
+                "spark_address": spark_address,
+                "offers": [offer.to_json() for offer in offers],
+            },
+        )
+
+    def check_invoice(self, invoice_id: str, wait: Optional[int] = None) -> Call:
+        if not wait:
+            return Call("check_invoice", "GET", f"/payment/{invoice_id}", {}, models.InvoiceStatus.from_json)
+        # Long-poll: the server holds the request for up to ``wait`` seconds.
+        return Call(
+            "check_invoice", "GET", f"/payment/{invoice_id}", {}, models.InvoiceStatus.from_json,
+            params={"wait": str(wait)}, timeout=wait + 15.0,
+        )
+
+
+def parse_server_timing(value: Optional[str]) -> Dict[str, float]:
+    """``"getBalance;dur=12.5, total;dur=30"`` -> ``{"getBalance": 12.5, "total": 30.0}``."""
+    timings: Dict[str, float] = {}
+    for entry in (value or "").split(","):
+        name, _, params = entry.strip().partition(";")
+        for param in params.split(";"):
+            key, _, raw = param.strip().partition("=")
+            if name and key == "dur":
+                try:
+                    timings[name] = float(raw)
+                except ValueError:
+                    pass
+    return timings
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+def raise_for_response(status_code: int, body: bytes) -> Any:
+    """Decodes a response body, raising APIError for non-2xx statuses."""
+    try:
+        data = json.loads(body) if body else None
+    except ValueError:
+        data = None
+    if 200 <= status_code < 300:
+        if data is None:
+            raise APIError(status_code, "Response body is not JSON", body)
+        return data
+    message = data.get("error") if isinstance(data, dict) else None
+    if not isinstance(message, str):
+        message = body.decode("utf-8", "replace")[:200] or f"HTTP {status_code}"
+    error_cls = NotFoundError if status_code == 404 else APIError
+    raise error_cls(status_code, message, data if data is not None else body)
+
+
+def retry_delay(
+    policy: RetryPolicy, call: Call, attempt: int, *, status_code: Optional[int] = None,
+    retry_after: Optional[str] = None, connect_error: bool = False,
+) -> Optional[float]:
+    """Seconds to wait before the next attempt, or None to give up."""
+    if attempt >= policy.max_attempts:
+        return None
+    if connect_error:
+        return policy.delay(attempt)
+    if not call.idempotent:
+        return None
+    if status_code is None or status_code in policy.statuses:
+        return policy.delay(attempt, parse_retry_after(retry_after))
+    return None
+
+
+def emit(hooks: Iterable[Hook], info: CallInfo) -> None:
+    for hook in hooks:
+        try:
+            hook(info)
+        except Exception:
+            logger.exception("sparkproxy timing hook failed")
+
+
+def chunked(total: int, size: int) -> List[int]:
+    return [min(size, total - start) for start in range(0, total, size)]
@@ -0,0 +1,242 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, TypeVar
+
+import httpx
+
+from . import _core
+from .client import DEFAULT_BASE_URL
+from .errors import APIError, TransportError
+from .models import (
+    Balance, BatchResult, CallInfo, CoopExit, DepositUtxo, Environment, ExitSpeed, Invoice, InvoiceStatus,
+    LightningInvoice, LightningPayment, Network, Offer, RetryPolicy, StaticDepositAddress, StaticDepositClaim,
+    StaticDepositClaims, TransferResult, WalletBatch, WalletInfo,
+)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+class AsyncSparkProxy:
+    """asyncio counterpart of ``SparkProxy`` with the same methods and semantics.
+
+    Create one per event loop and ``await client.aclose()`` (or use
+    ``async with``) when done.
+    """
+
+    def __init__(
+        self,
+        base_url: str = DEFAULT_BASE_URL,
+        *,
+        network: Network = "MAINNET",
+        environment: Environment = "prod",
+        timeout: float = 60.0,
+        max_connections: int = 100,
+        retry: RetryPolicy = RetryPolicy(),
+        hooks: Iterable[_core.Hook] = (),
+        http2: bool = False,
+        http_client: Optional[httpx.AsyncClient] = None,
+    ):
+        self.calls = _core.Calls(network, environment)
+        self.retry = retry
+        self.hooks = list(hooks)
+        self._owns_client = http_client is None
+        self._http = http_client or httpx.AsyncClient(
+            base_url=base_url.rstrip("/"),
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            headers={"accept": "application/json"},
+            http2=http2,
+        )
+
+    async def aclose(self) -> None:
+        if self._owns_client:
+            await self._http.aclose()
+
+    async def __aenter__(self) -> "AsyncSparkProxy":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.aclose()
+
+    async def send(self, call: _core.Call) -> Any:
+        start = time.perf_counter()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                response = await self._http.request(
+                    call.method, call.path, **call.request_kwargs(),
+                )
+            except httpx.TransportError as exc:
+                delay = _core.retry_delay(self.retry, call, attempt, connect_error=isinstance(exc, httpx.ConnectError))
+                if delay is None:
+                    error = TransportError(f"{call.operation} failed: {exc!r}", exc)
+                    self._emit(call, None, attempt, start, error)
+                    raise error from exc
+                await asyncio.sleep(delay)
+                continue
+            try:
+                result = call.parse(_core.raise_for_response(response.status_code, response.content))
+            except APIError as exc:
+                delay = _core.retry_delay(
+                    self.retry, call, attempt, status_code=response.status_code,
+                    retry_after=response.headers.get("retry-after"),
+                )
+                if delay is None:
+                    self._emit(call, response, attempt, start, exc)
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            self._emit(call, response, attempt, start, None)
+            return result
+
+    def _emit(
+        self, call: _core.Call, response: Optional[httpx.Response], attempt: int, start: float, error: Optional[BaseException],
+    ) -> None:
+        if self.hooks:
+            _core.emit(self.hooks, CallInfo(
+                operation=call.operation,
+                method=call.method,
+                path=call.path,
+                status_code=response.status_code if response is not None else None,
+                attempts=attempt,
+                elapsed_ms=(time.perf_counter() - start) * 1000,
+                error=error,
+                request_id=response.headers.get("x-request-id") if response is not None else None,
+                server_timing=_core.parse_server_timing(response.headers.get("server-timing")) if response is not None else {},
+            ))
+
+    # Wallet
+
+    async def initialize(self) -> WalletInfo:
+        return await self.send(self.calls.initialize())
+
+    async def batch_initialize(self, count: int) -> List[WalletInfo]:
+        return await self.send(self.calls.batch_initialize(count))
+
+    async def balance(self, mnemonic: str, *, fresh: bool = False) -> Balance:
+        """``fresh=True`` skips the server's balance cache (BALANCE_CACHE_TTL_MS)."""
+        return await self.send(self.calls.balance(mnemonic, fresh))
+
+    async def transfer(
+        self, mnemonic: str, receiver_spark_address: str, amount_sats: int, *, idempotency_key: Optional[str] = None,
+    ) -> TransferResult:
+        return await self.send(self.calls.transfer(mnemonic, receiver_spark_address, amount_sats, idempotency_key))
+
+    async def token_transfer(
+        self, mnemonic: str, receiver_spark_address: str, token_identifier: str, token_amount: int,
+        *, idempotency_key: Optional[str] = None,
+    ) -> TransferResult:
+        return await self.send(self.calls.token_transfer(
+            mnemonic, receiver_spark_address, token_identifier, token_amount, idempotency_key,
+        ))
+
+    async def pay_lightning_invoice(
+        self, mnemonic: str, invoice: str, max_fee_sats: int, *, idempotency_key: Optional[str] = None,
+    ) -> LightningPayment:
+        return await self.send(self.calls.pay_lightning_invoice(mnemonic, invoice, max_fee_sats, idempotency_key))
+
+    async def create_lightning_invoice(
+        self, mnemonic: str, amount_sats: int, *, memo: str = "", expiry_seconds: Optional[int] = None,
+        idempotency_key: Optional[str] = None,
+    ) -> LightningInvoice:
+        return await self.send(self.calls.create_lightning_invoice(mnemonic, amount_sats, memo, expiry_seconds, idempotency_key))
+
+    async def create_lightning_invoice_for_user(
+        self, receiver_identity_pubkey: str, amount_sats: int, *, memo: str = "", expiry_seconds: Optional[int] = None,
+    ) -> LightningInvoice:
+        return await self.send(self.calls.create_lightning_invoice_for_user(receiver_identity_pubkey, amount_sats, memo, expiry_seconds))
+
+    async def static_deposit_address(self, mnemonic: str) -> StaticDepositAddress:
+        return await self.send(self.calls.static_deposit_address(mnemonic))
+
+    async def deposit_utxos(self, mnemonic: str, deposit_address: str, *, include_claimed: bool = True) -> List[DepositUtxo]:
+        return await self.send(self.calls.deposit_utxos(mnemonic, deposit_address, include_claimed))
+
+    async def claim_static_deposit(
+        self, mnemonic: str, tx_hash: str, vout: int, *, idempotency_key: Optional[str] = None,
+    ) -> StaticDepositClaim:
+        return await self.send(self.calls.claim_static_deposit(mnemonic, tx_hash, vout, idempotency_key))
+
+    async def claim_all_static_deposits(self, mnemonic: str, *, idempotency_key: Optional[str] = None) -> StaticDepositClaims:
+        return await self.send(self.calls.claim_all_static_deposits(mnemonic, idempotency_key))
+
+    async def coop_exit(
+        self, mnemonic: str, onchain_address: str, amount_sats: int, *, exit_speed: Optional[ExitSpeed] = None,
+        deduct_fee_from_withdrawal_amount: Optional[bool] = None, idempotency_key: Optional[str] = None,
+    ) -> CoopExit:
+        return await self.send(self.calls.coop_exit(
+            mnemonic, onchain_address, amount_sats, exit_speed, deduct_fee_from_withdrawal_amount, idempotency_key,
+        ))
+
+    async def wallet_batch(
+        self, mnemonic: str, items: Sequence[Dict[str, Any]], *, stop_on_error: bool = False,
+    ) -> WalletBatch:
+        """Runs up to 500 operations in order from one wallet session.
+
+        Items use the JSON bodies of the single routes plus a ``type`` of
+        ``transfer``, ``tokenTransfer``, ``payLightningInvoice`` or
+        ``createLightningInvoice`` and an optional ``idempotencyKey``.
+        """
+        return await self.send(self.calls.wallet_batch(mnemonic, items, stop_on_error))
+
+    # Payment
+
+    async def create_invoice(
+        self, offers: Sequence[Offer], spark_address: str, *, webhook_url: str = "",
+        idempotency_key: Optional[str] = None,
+    ) -> Invoice:
+        return await self.send(self.calls.create_invoice(offers, spark_address, webhook_url, idempotency_key))
+
+    async def check_invoice(self, invoice_id: str, *, wait: Optional[int] = None) -> InvoiceStatus:
+        """Current status; with ``wait`` (1-60 s), returns as soon as the invoice is paid."""
+        return await self.send(self.calls.check_invoice(invoice_id, wait))
+
+    # Batch helpers
+
+    async def map(
+        self, fn: Callable[[T], Awaitable[R]], items: Iterable[T], *, concurrency: int = 8,
+    ) -> List[BatchResult[T, R]]:
+        """Runs ``fn`` over ``items`` with at most ``concurrency`` calls in flight.
+
+        Results come back in input order; a failing item does not stop the others.
+        """
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def run(item: T) -> BatchResult[T, R]:
+            async with semaphore:
+                try:
+                    return BatchResult(item=item, result=await fn(item))
+                except Exception as exc:
+                    return BatchResult(item=item, error=exc)
+
+        return list(await asyncio.gather(*(run(item) for item in items)))
+
+    async def initialize_many(self, count: int, *, concurrency: int = 4) -> List[WalletInfo]:
+        results = await self.map(self.batch_initialize, _core.chunked(count, 100), concurrency=concurrency)
+        wallets: List[WalletInfo] = []
+        for batch in results:
+            if batch.error is not None:
+                raise batch.error
+            wallets.extend(batch.result or [])
+        return wallets
+
+    async def pay_invoices(
+        self, mnemonic: str, invoices: Iterable[str], max_fee_sats: int, *, concurrency: int = 4,
+    ) -> List[BatchResult[str, LightningPayment]]:
+        return await self.map(
+            lambda invoice: self.pay_lightning_invoice(mnemonic, invoice, max_fee_sats), invoices, concurrency=concurrency,
+        )
+
+    async def transfer_many(
+        self, mnemonic: str, transfers: Iterable[Tuple[str, int]], *, concurrency: int = 4,
+    ) -> List[BatchResult[Tuple[str, int], TransferResult]]:
+        """Sends ``(receiver_spark_address, amount_sats)`` transfers from one wallet."""
+        return await self.map(lambda t: self.transfer(mnemonic, t[0], t[1]), transfers, concurrency=concurrency)
+
+    async def check_invoices(
+        self, invoice_ids: Iterable[str], *, concurrency: int = 16,
+    ) -> List[BatchResult[str, InvoiceStatus]]:
+        return await self.map(self.check_invoice, invoice_ids, concurrency=concurrency)
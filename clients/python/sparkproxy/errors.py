@@ -0,0 +1,33 @@
+from __future__ import annotations
+
+from typing import Any, Optional
+
+
+class SparkProxyError(Exception):
+    """Base class for every error raised by the client."""
+
+
+class APIError(SparkProxyError):
+    """The server answered with a non-2xx status."""
+
+    def __init__(self, status_code: int, message: str, body: Any = None):
+        self.status_code = status_code
+        self.message = message
+        self.body = body
+        super().__init__(f"HTTP {status_code}: {message}")
+
+    @property
+    def retryable(self) -> bool:
+        return self.status_code in (409, 429) or self.status_code >= 500
+
+
+class NotFoundError(APIError):
+    """The requested invoice (or other resource) does not exist."""
+
+
+class TransportError(SparkProxyError):
+    """The request could not be completed (connection refused, timeout, ...)."""
+
+    def __init__(self, message: str, original: Optional[BaseException] = None):
+        self.original = original
+        super().__init__(message)
@@ -0,0 +1,312 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Any, Dict, Generic, List, Literal, Optional, TypeVar
+
+Network = Literal["MAINNET", "REGTEST"]
+Environment = Literal["dev", "prod"]
+ExitSpeed = Literal["fast", "medium", "slow"]
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+@dataclass(frozen=True)
+class WalletInfo:
+    mnemonic: str
+    address: str
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "WalletInfo":
+        return cls(mnemonic=data["mnemonic"], address=data["address"])
+
+
+@dataclass(frozen=True)
+class TokenInfo:
+    token_identifier: str
+    token_public_key: str
+    token_name: str
+    token_symbol: str
+    token_decimals: int
+    max_supply: int
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "TokenInfo":
+        return cls(
+            token_identifier=data["tokenIdentifier"],
+            token_public_key=data["tokenPublicKey"],
+            token_name=data["tokenName"],
+            token_symbol=data["tokenSymbol"],
+            token_decimals=data["tokenDecimals"],
+            max_supply=data["maxSupply"],
+        )
+
+
+@dataclass(frozen=True)
+class TokenBalance:
+    balance: int
+    token_info: TokenInfo
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "TokenBalance":
+        return cls(balance=data["balance"], token_info=TokenInfo.from_json(data["tokenInfo"]))
+
+
+@dataclass(frozen=True)
+class Balance:
+    address: str
+    balance: int
+    token_balances: List[TokenBalance]
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "Balance":
+        return cls(
+            address=data["address"],
+            balance=data["balance"],
+            token_balances=[TokenBalance.from_json(t) for t in data.get("tokenBalances", [])],
+        )
+
+
+@dataclass(frozen=True)
+class TransferResult:
+    id: str
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "TransferResult":
+        return cls(id=data["id"])
+
+
+@dataclass(frozen=True)
+class LightningInvoice:
+    invoice: str
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "LightningInvoice":
+        return cls(invoice=data["invoice"])
+
+
+@dataclass(frozen=True)
+class LightningPayment:
+    id: str
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "LightningPayment":
+        return cls(id=data["id"])
+
+
+@dataclass(frozen=True)
+class StaticDepositAddress:
+    deposit_address: str
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "StaticDepositAddress":
+        return cls(deposit_address=data["depositAddress"])
+
+
+@dataclass(frozen=True)
+class DepositUtxo:
+    tx_hash: str
+    vout: int
+    amount_sats: int
+    confirmations: int
+    claimed: bool
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "DepositUtxo":
+        return cls(
+            tx_hash=data["txHash"],
+            vout=data["vout"],
+            amount_sats=data["amountSats"],
+            confirmations=data["confirmations"],
+            claimed=data["claimed"],
+        )
+
+
+@dataclass(frozen=True)
+class StaticDepositClaim:
+    deposit_amount_sats: int
+    fee_sats: int
+    claimed_amount_sats: int
+    tx_hash: Optional[str] = None
+    vout: Optional[int] = None
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "StaticDepositClaim":
+        return cls(
+            deposit_amount_sats=data["depositAmountSats"],
+            fee_sats=data["feeSats"],
+            claimed_amount_sats=data["claimedAmountSats"],
+            tx_hash=data.get("txHash"),
+            vout=data.get("vout"),
+        )
+
+
+@dataclass(frozen=True)
+class StaticDepositClaims:
+    """``complete`` is false if a claim failed or the server ran out of time;
+    calling ``claim_all_static_deposits`` again picks up what is left."""
+
+    claims: List[StaticDepositClaim]
+    total_claimed_sats: int
+    failed: List[Dict[str, Any]] = field(default_factory=list)
+    remaining: int = 0
+    complete: bool = True
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "StaticDepositClaims":
+        return cls(
+            claims=[StaticDepositClaim.from_json(c) for c in data["claims"]],
+            total_claimed_sats=data["totalClaimedSats"],
+            failed=data.get("failed", []),
+            remaining=data.get("remaining", 0),
+            complete=data.get("complete", True),
+        )
+
+
+@dataclass(frozen=True)
+class CoopExit:
+    id: str
+    onchain_address: str
+    amount_sats: int
+    fee_sats: int
+    exit_speed: ExitSpeed
+    status: str
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "CoopExit":
+        return cls(
+            id=data["id"],
+            onchain_address=data["onchainAddress"],
+            amount_sats=data["amountSats"],
+            fee_sats=data["feeSats"],
+            exit_speed=data["exitSpeed"],
+            status=data["status"],
+        )
+
+
+@dataclass(frozen=True)
+class Offer:
+    """One asset/amount an invoice accepts."""
+
+    amount: int
+    asset: Literal["BITCOIN", "TOKEN"] = "BITCOIN"
+    token_identifier: str = ""
+
+    def to_json(self) -> Dict[str, Any]:
+        return {"asset": self.asset, "amount": self.amount, "tokenIdentifier": self.token_identifier}
+
+
+@dataclass(frozen=True)
+class Invoice:
+    invoice_id: str
+    spark_address: str
+    lightning_invoice: str
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "Invoice":
+        return cls(
+            invoice_id=data["invoice_id"],
+            spark_address=data["spark_address"],
+            lightning_invoice=data["lightning_invoice"],
+        )
+
+
+@dataclass(frozen=True)
+class InvoiceStatus:
+    invoice_id: str
+    paid: bool
+    sending_address: Optional[str]
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "InvoiceStatus":
+        return cls(invoice_id=data["invoice_id"], paid=data["paid"], sending_address=data.get("sending_address"))
+
+
+@dataclass(frozen=True)
+class WalletBatchItem:
+    """Outcome of one item of ``POST /wallet/batch``.
+
+    ``status`` is ``done``, ``failed``, ``skipped`` (after an earlier failure
+    with ``stop_on_error``) or ``cached`` (answered from its idempotency key).
+    """
+
+    index: int
+    type: str
+    ok: bool
+    status: str
+    duration_ms: float
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "WalletBatchItem":
+        return cls(
+            index=data["index"],
+            type=data["type"],
+            ok=data["ok"],
+            status=data["status"],
+            duration_ms=data["durationMs"],
+            result=data.get("result"),
+            error=data.get("error"),
+        )
+
+
+@dataclass(frozen=True)
+class WalletBatch:
+    results: List[WalletBatchItem]
+    duration_ms: float
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "WalletBatch":
+        return cls(results=[WalletBatchItem.from_json(r) for r in data["results"]], duration_ms=data["durationMs"])
+
+
+@dataclass(frozen=True)
+class CallInfo:
+    """Passed to every timing hook once a call has finished (successfully or not)."""
+
+    operation: str
+    method: str
+    path: str
+    status_code: Optional[int]
+    attempts: int
+    elapsed_ms: float
+    error: Optional[BaseException] = None
+    # From the last response: its x-request-id and Server-Timing durations (ms) by name.
+    request_id: Optional[str] = None
+    server_timing: Dict[str, float] = field(default_factory=dict)
+
+
+@dataclass(frozen=True)
+class BatchResult(Generic[T, R]):
+    """Outcome of one item of a batch helper; exactly one of result/error is set."""
+
+    item: T
+    result: Optional[R] = None
+    error: Optional[BaseException] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """Retries transient failures with capped exponential backoff.
+
+    Connection errors are always retried because the request never reached
+    the server. 5xx/429 responses, 409s (the same idempotency key is still
+    being processed) and read timeouts are only retried for
+    calls that are safe to repeat: reads, and writes carrying an
+    idempotency key.
+    """
+
+    max_attempts: int = 3
+    backoff_s: float = 0.25
+    max_backoff_s: float = 4.0
+    statuses: frozenset = field(default_factory=lambda: frozenset({409, 429, 500, 502, 503, 504}))
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff_s)
+        return min(self.max_backoff_s, self.backoff_s * 2 ** (attempt - 1))
@@ -0,0 +1,346 @@
+"""Receiving signed invoice webhooks.
+
+sparkproxy POSTs ``{"payload": "<json>", "signature": "<base64>"}`` where the
+signature is RSA PKCS#1 v1.5 over SHA-256 of ``payload``, verifiable with
+the server's ``/.well-known/webhook-public-key.pem``. ``WebhookReceiver``
+does the verification off the event loop, keeps the key fresh, and drops
+repeated deliveries of the same invoice::
+
+    receiver = WebhookReceiver("https://sparkproxy.example.com")
+    await receiver.start()
+    ...
+    status = await receiver.process(body, on_paid)   # in your POST handler
+
+Requires the ``webhooks`` extra (``pip install 'sparkproxy[webhooks]'``).
+"""
+from __future__ import annotations
+
+import asyncio
+import base64
+import binascii
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Literal, Optional, Union
+
+import httpx
+
+from .client import DEFAULT_BASE_URL
+from .errors import SparkProxyError
+
+try:
+    from cryptography.exceptions import InvalidSignature as _CryptoInvalidSignature
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import padding
+    from cryptography.hazmat.primitives.serialization import load_pem_public_key
+except ImportError:  # pragma: no cover
+    load_pem_public_key = None  # type: ignore[assignment]
+
+logger = logging.getLogger("sparkproxy.webhooks")
+
+PUBLIC_KEY_PATH = "/.well-known/webhook-public-key.pem"
+
+
+class InvalidSignature(SparkProxyError):
+    """The webhook body is malformed or not signed by a known key."""
+
+
+@dataclass(frozen=True)
+class WebhookEvent:
+    invoice_id: str
+    paid: bool
+    data: Dict[str, Any]
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "WebhookEvent":
+        return cls(invoice_id=data["invoice_id"], paid=bool(data.get("paid")), data=data)
+
+
+@dataclass(frozen=True)
+class ReceiverStats:
+    """Counters since the receiver started; latencies are in milliseconds."""
+
+    uptime_s: float
+    received: int
+    accepted: int
+    duplicates: int
+    rejected: int
+    handler_errors: int
+    key_refreshes: int
+    key_refresh_failures: int
+    verify_ms_avg: float
+    verify_ms_max: float
+    total_ms_avg: float
+    total_ms_max: float
+
+    @property
+    def throughput_per_s(self) -> float:
+        return self.received / self.uptime_s if self.uptime_s > 0 else 0.0
+
+
+class PublicKeyCache:
+    """Fetches the signing key and refreshes it every ``refresh_interval_s``.
+
+    The previous key stays valid after a rotation so deliveries signed just
+    before the switch still verify. ``refresh_now`` is rate limited to one
+    fetch per ``min_refresh_interval_s`` so that bad signatures cannot be
+    used to hammer the key endpoint.
+    """
+
+    def __init__(
+        self, url: str, *, refresh_interval_s: float = 3600.0, min_refresh_interval_s: float = 30.0,
+        http: Optional[httpx.AsyncClient] = None,
+    ):
+        if load_pem_public_key is None:
+            raise ImportError("sparkproxy.webhooks needs 'cryptography'; install sparkproxy[webhooks]")
+        self.url = url
+        self.refresh_interval_s = refresh_interval_s
+        self.min_refresh_interval_s = min_refresh_interval_s
+        self._http = http or httpx.AsyncClient(timeout=10.0)
+        self._owns_http = http is None
+        self._pem: Optional[bytes] = None
+        self._keys: List[Any] = []
+        self._fetched_at = 0.0
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.refreshes = 0
+        self.failures = 0
+
+    @property
+    def keys(self) -> List[Any]:
+        """Current key first, then the one it replaced (if any)."""
+        return list(self._keys)
+
+    async def start(self) -> None:
+        await self.refresh_now(force=True)
+        if self._task is None:
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._owns_http:
+            await self._http.aclose()
+
+    async def refresh_now(self, force: bool = False) -> bool:
+        """Fetches the key unless it was fetched very recently; True if it changed."""
+        async with self._lock:
+            if not force and time.monotonic() - self._fetched_at < self.min_refresh_interval_s:
+                return False
+            self._fetched_at = time.monotonic()
+            try:
+                response = await self._http.get(self.url)
+                response.raise_for_status()
+                pem = response.content
+                key = load_pem_public_key(pem)
+            except Exception as exc:
+                self.failures += 1
+                logger.warning("Failed to fetch webhook public key from %s: %s", self.url, exc)
+                if not self._keys:
+                    raise
+                return False
+            self.refreshes += 1
+            if pem == self._pem:
+                return False
+            self._keys = [key] + self._keys[:1]
+            self._pem = pem
+            return True
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.refresh_interval_s)
+            try:
+                await self.refresh_now(force=True)
+            except Exception:
+                pass
+
+
+class DedupeCache:
+    """Bounded, thread-safe set of recently seen ids that expire after ``ttl_s``."""
+
+    def __init__(self, max_size: int = 100_000, ttl_s: float = 24 * 3600.0):
+        self.max_size = max_size
+        self.ttl_s = ttl_s
+        self._entries: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            expires_at = self._entries.get(key)
+            if expires_at is None:
+                return False
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return False
+            return True
+
+    def add(self, key: str) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._entries[key] = now + self.ttl_s
+            self._entries.move_to_end(key)
+            while self._entries:
+                oldest, expires_at = next(iter(self._entries.items()))
+                if len(self._entries) <= self.max_size and expires_at > now:
+                    break
+                del self._entries[oldest]
+
+    def discard(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+Handler = Callable[[WebhookEvent], Union[Awaitable[None], None]]
+Outcome = Literal["accepted", "duplicate"]
+
+
+class WebhookReceiver:
+    """Verifies, deduplicates and dispatches sparkproxy webhooks.
+
+    Signatures are checked on a thread pool of ``max_workers`` threads so
+    bursts do not block the event loop. An ``invoice_id`` counts as
+    delivered only once its handler has returned; until then concurrent
+    duplicates are dropped, and if the handler raises, the next delivery
+    is processed again. Create one receiver per process and ``await
+    start()`` before the first request (or use ``async with``).
+    """
+
+    def __init__(
+        self,
+        base_url: str = DEFAULT_BASE_URL,
+        *,
+        public_key_url: Optional[str] = None,
+        max_workers: int = 4,
+        dedupe_size: int = 100_000,
+        dedupe_ttl_s: float = 24 * 3600.0,
+        refresh_interval_s: float = 3600.0,
+        http: Optional[httpx.AsyncClient] = None,
+    ):
+        self.key_cache = PublicKeyCache(
+            public_key_url or base_url.rstrip("/") + PUBLIC_KEY_PATH,
+            refresh_interval_s=refresh_interval_s,
+            http=http,
+        )
+        self.delivered = DedupeCache(dedupe_size, dedupe_ttl_s)
+        self._in_flight: set = set()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sparkproxy-webhook")
+        self._started_at = time.monotonic()
+        self._counts = {"received": 0, "accepted": 0, "duplicates": 0, "rejected": 0, "handler_errors": 0}
+        self._verify_ms = [0.0, 0.0, 0]  # total, max, count
+        self._total_ms = [0.0, 0.0, 0]
+
+    async def __aenter__(self) -> "WebhookReceiver":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.close()
+
+    async def start(self) -> None:
+        self._started_at = time.monotonic()
+        await self.key_cache.start()
+
+    async def close(self) -> None:
+        await self.key_cache.close()
+        self._executor.shutdown(wait=False)
+
+    async def verify(self, body: Union[bytes, str, Dict[str, Any]]) -> WebhookEvent:
+        """Checks the signature and returns the decoded event, or raises InvalidSignature."""
+        try:
+            envelope = json.loads(body) if isinstance(body, (bytes, str)) else body
+            payload, signature = envelope["payload"], base64.b64decode(envelope["signature"], validate=True)
+            payload_bytes = payload.encode("utf-8")
+        except (ValueError, KeyError, TypeError, AttributeError, binascii.Error) as exc:
+            raise InvalidSignature(f"Malformed webhook body: {exc}") from exc
+
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        valid = await loop.run_in_executor(self._executor, _verify_any, self.key_cache.keys, payload_bytes, signature)
+        if not valid and await self.key_cache.refresh_now():
+            # The server may have rotated its key since the last refresh.
+            valid = await loop.run_in_executor(self._executor, _verify_any, self.key_cache.keys, payload_bytes, signature)
+        _record(self._verify_ms, (time.perf_counter() - start) * 1000)
+        if not valid:
+            raise InvalidSignature("Webhook signature does not match any known key")
+        try:
+            return WebhookEvent.from_json(json.loads(payload))
+        except (ValueError, KeyError, TypeError) as exc:
+            raise InvalidSignature(f"Malformed webhook payload: {exc}") from exc
+
+    async def process(self, body: Union[bytes, str, Dict[str, Any]], handler: Handler) -> Outcome:
+        """Verifies ``body`` and calls ``handler`` once per invoice.
+
+        Returns ``"duplicate"`` for deliveries already handled (or being
+        handled); raises InvalidSignature for bad ones and re-raises
+        handler errors so the webhook is retried.
+        """
+        start = time.perf_counter()
+        self._counts["received"] += 1
+        try:
+            event = await self.verify(body)
+        except InvalidSignature:
+            self._counts["rejected"] += 1
+            raise
+        try:
+            if event.invoice_id in self._in_flight or event.invoice_id in self.delivered:
+                self._counts["duplicates"] += 1
+                return "duplicate"
+            self._in_flight.add(event.invoice_id)
+            try:
+                result = handler(event)
+                if asyncio.iscoroutine(result) or isinstance(result, asyncio.Future):
+                    await result
+            except Exception:
+                self._counts["handler_errors"] += 1
+                raise
+            finally:
+                self._in_flight.discard(event.invoice_id)
+            self.delivered.add(event.invoice_id)
+            self._counts["accepted"] += 1
+            return "accepted"
+        finally:
+            _record(self._total_ms, (time.perf_counter() - start) * 1000)
+
+    def stats(self) -> ReceiverStats:
+        return ReceiverStats(
+            uptime_s=time.monotonic() - self._started_at,
+            received=self._counts["received"],
+            accepted=self._counts["accepted"],
+            duplicates=self._counts["duplicates"],
+            rejected=self._counts["rejected"],
+            handler_errors=self._counts["handler_errors"],
+            key_refreshes=self.key_cache.refreshes,
+            key_refresh_failures=self.key_cache.failures,
+            verify_ms_avg=self._verify_ms[0] / self._verify_ms[2] if self._verify_ms[2] else 0.0,
+            verify_ms_max=self._verify_ms[1],
+            total_ms_avg=self._total_ms[0] / self._total_ms[2] if self._total_ms[2] else 0.0,
+            total_ms_max=self._total_ms[1],
+        )
+
+
+def _verify_any(keys: List[Any], payload: bytes, signature: bytes) -> bool:
+    for key in keys:
+        try:
+            key.verify(signature, payload, padding.PKCS1v15(), hashes.SHA256())
+            return True
+        except _CryptoInvalidSignature:
+            continue
+    return False
+
+
+def _record(series: List[float], value_ms: float) -> None:
+    series[0] += value_ms
+    series[1] = max(series[1], value_ms)
+    series[2] += 1
@@ -1,45 +1,55 @@
 import logging
-import json
+import os
+import sys
+from contextlib import asynccontextmanager
+
 import uvicorn
-import requests
-import base64
-from fastapi import FastAPI
-from pydantic import BaseModel
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.asymmetric import padding
-from cryptography.hazmat.primitives.serialization import load_pem_public_key
-
-app = FastAPI()
+from dataclasses import asdict
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "clients", "python"))
+from sparkproxy.webhooks import InvalidSignature, WebhookEvent, WebhookReceiver  # noqa: E402
+
 logger = logging.getLogger(__name__)
 
-public_key = load_pem_public_key(
-    requests.get(
-        "https://sparkproxy.kevz.dev/.well-known/webhook-public-key.pem"
-    ).text.encode()
+# Verifies on a thread pool, refreshes the signing key in the background and
+# drops replayed deliveries, so this can sit behind a busy sparkproxy.
+receiver = WebhookReceiver(
+    os.environ.get("SPARKPROXY_URL", "https://sparkproxy.kevz.dev"),
+    max_workers=int(os.environ.get("WEBHOOK_VERIFY_THREADS", "4")),
 )
 
 
-def verify_asymmetric(payload, signature):
-    public_key.verify(
-        base64.b64decode(signature),
-        payload.encode("utf-8"),
-        padding.PKCS1v15(),
-        hashes.SHA256(),
-    )
-    return True
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await receiver.start()
+    try:
+        yield
+    finally:
+        await receiver.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 
-class WebhookPayload(BaseModel):
-    payload: str
-    signature: str
+async def on_invoice(event: WebhookEvent) -> None:
+    logger.info("Invoice %s paid=%s", event.invoice_id, event.paid)
 
 
 @app.post("/webhook")
-def webhook(payload: WebhookPayload):
-    if not verify_asymmetric(payload.payload, payload.signature):
-        return {"message": "Invalid signature"}
-    payload = json.loads(payload.payload)
-    logger.info(payload)
+async def webhook(request: Request):
+    try:
+        outcome = await receiver.process(await request.body(), on_invoice)
+    except InvalidSignature as exc:
+        return JSONResponse({"message": str(exc)}, status_code=401)
+    return {"message": outcome}
+
+
+@app.get("/stats")
+def stats():
+    stats = receiver.stats()
+    return {**asdict(stats), "throughput_per_s": stats.throughput_per_s}
 
 
 if __name__ == "__main__":
@@ -0,0 +1,554 @@
+#!/usr/bin/env -S uv run
+# /// script
+# requires-python = ">=3.10"
+# dependencies = [
+#   "breez_sdk_spark>=0.9.0",
+#   "httpx>=0.25",
+#   "python-dotenv>=1.0.0",
+# ]
+# ///
+"""Lightning receive/pay latency benchmark: sparkproxy vs the Breez SDK.
+
+Runs the same two scenarios through each implementation, --runs times,
+interleaving implementations within each run so that network conditions
+affect them alike:
+
+- receive: create an invoice, have the counterparty pay it, and wait until
+  the receiver sees it settled.
+- pay: have the counterparty issue an invoice, pay it, and wait until the
+  payment is final.
+
+Settlement is detected from events where the implementation has them and
+by polling with a backoff (50 ms doubling up to 1 s) otherwise, never by
+fixed sleeps:
+
+- sparkproxy receive uses POST /payment and long-polls
+  GET /payment/{id}?wait=..., which returns as soon as the invoice is
+  marked paid.
+- sparkproxy pay polls the wallet balance (bypassing the server cache)
+  until the payment is debited. The fee is the debit minus the amount, so
+  nothing else should move funds in that wallet during a run. Paid
+  receive invoices are swept to ADDRESS2 (or --sweep-address) when set;
+  otherwise into the benchmark wallet, and receive then waits for that
+  sweep to land so that it cannot show up during the next pay sample.
+- Breez uses SDK payment events, with get_payment/list_payments polling as
+  a fallback.
+
+Latency percentiles, fees and failure rates are printed per implementation
+and scenario, and the run, with every sample, is appended to
+lightning_bench.jsonl.
+
+    # real network: Blink as the counterparty
+    uv run examples/lightning_bench.py --runs 20
+
+    # offline: sparkproxy only, server started with SPARK_BACKEND=simulated
+    uv run examples/lightning_bench.py --local --impl sparkproxy --fund-sats 100000
+
+Needs BLINK_API_KEY for Blink, MNEMONIC1/ADDRESS1 (or --init-wallet) for
+sparkproxy, and BREEZ_MNEMONIC/BREEZ_API_KEY for Breez. With
+--counterparty stub, invoices to pay come from the Blink stub in stubs.py
+and sparkproxy invoices are paid through the simulator's
+/sim/lightning/pay. The stub cannot pay a real wallet, so Breez needs
+Blink.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import sys
+import time
+import uuid
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+
+import httpx
+from dotenv import load_dotenv
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "clients" / "python"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from sparkproxy import AsyncSparkProxy, Offer, RetryPolicy, WalletInfo  # noqa: E402
+from loadtest import percentile  # noqa: E402
+from stubs import start_stubs  # noqa: E402
+
+try:
+    from breez_sdk_spark import (
+        ConnectRequest,
+        EventListener,
+        GetPaymentRequest,
+        ListPaymentsRequest,
+        Network,
+        PaymentStatus,
+        PrepareSendPaymentRequest,
+        ReceivePaymentMethod,
+        ReceivePaymentRequest,
+        SdkError,
+        Seed,
+        SendPaymentOptions,
+        SendPaymentRequest,
+        connect,
+        default_config,
+    )
+    from breez_sdk_spark.breez_sdk_spark import uniffi_set_event_loop
+except ImportError:  # only needed for --impl breez
+    connect = None
+    EventListener = object
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+IMPLEMENTATIONS = ("sparkproxy", "breez")
+SCENARIOS = ("receive", "pay")
+DEFAULT_BLINK_WALLET_ID = "c4a7c8f6-1ed6-4246-9715-e92222e9a87f"
+
+
+class SettlementTimeout(Exception):
+    pass
+
+
+async def poll_until(check, timeout_s, initial_s=0.05, max_s=1.0):
+    """Awaits ``check()`` until it returns something other than None, sleeping
+    ``initial_s`` doubling up to ``max_s`` in between. Fast settlements are seen
+    within tens of milliseconds and slow ones are not polled hard."""
+    deadline = time.monotonic() + timeout_s
+    delay = initial_s
+    while True:
+        result = await check()
+        if result is not None:
+            return result
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise SettlementTimeout(f"Not settled within {timeout_s:.0f}s")
+        await asyncio.sleep(min(delay, remaining))
+        delay = min(delay * 2, max_s)
+
+
+@dataclass
+class Sample:
+    implementation: str
+    scenario: str
+    run: int
+    amount_sats: int
+    ok: bool = False
+    # receive: until the invoice exists; pay: until the payment call returns.
+    request_ms: Optional[float] = None
+    # From the invoice being available until the settlement is observed.
+    settle_ms: Optional[float] = None
+    fee_sats: Optional[int] = None
+    error: Optional[str] = None
+
+
+class BlinkCounterparty:
+    """The external Lightning wallet on the other side of every payment."""
+
+    def __init__(self, http: httpx.AsyncClient, url: str, api_key: str, wallet_id: str):
+        self.http = http
+        self.url = url
+        self.api_key = api_key
+        self.wallet_id = wallet_id
+
+    async def _graphql(self, query: str, variables: dict) -> dict:
+        response = await self.http.post(
+            self.url, json={"query": query, "variables": {"input": variables}}, headers={"X-API-KEY": self.api_key},
+        )
+        response.raise_for_status()
+        return response.json()["data"]
+
+    async def create_invoice(self, amount_sats: int) -> str:
+        data = await self._graphql(
+            "mutation LnInvoiceCreate($input: LnInvoiceCreateInput!) { lnInvoiceCreate(input: $input) { invoice { paymentRequest } errors { message } } }",
+            {"amount": amount_sats, "walletId": self.wallet_id},
+        )
+        result = data["lnInvoiceCreate"]
+        if result.get("errors"):
+            raise RuntimeError(f"Blink could not create an invoice: {result['errors']}")
+        return result["invoice"]["paymentRequest"]
+
+    async def pay_invoice(self, invoice: str) -> None:
+        data = await self._graphql(
+            "mutation LnInvoicePaymentSend($input: LnInvoicePaymentInput!) { lnInvoicePaymentSend(input: $input) { status errors { message } } }",
+            {"paymentRequest": invoice, "walletId": self.wallet_id},
+        )
+        result = data["lnInvoicePaymentSend"]
+        if result.get("errors") or result.get("status") not in ("SUCCESS", "PENDING"):
+            raise RuntimeError(f"Blink could not pay the invoice: {result}")
+
+
+class StubCounterparty(BlinkCounterparty):
+    """Invoices from the Blink stub; sparkproxy invoices are paid by the simulator."""
+
+    def __init__(self, http: httpx.AsyncClient, blink_url: str, base_url: str):
+        super().__init__(http, blink_url, "", "stub")
+        self.base_url = base_url
+
+    async def pay_invoice(self, invoice: str) -> None:
+        response = await self.http.post(f"{self.base_url}/sim/lightning/pay", json={"invoice": invoice})
+        if response.status_code == 404:
+            raise RuntimeError("The stub counterparty needs a server running with SPARK_BACKEND=simulated")
+        response.raise_for_status()
+
+
+class SparkProxyRunner:
+    name = "sparkproxy"
+
+    def __init__(self, client: AsyncSparkProxy, wallet: WalletInfo, args):
+        self.client = client
+        self.wallet = wallet
+        self.args = args
+
+    async def receive(self, counterparty, sample: Sample) -> None:
+        sweep_address = self.args.sweep_address or self.wallet.address
+        sweeps_to_self = sweep_address == self.wallet.address
+        if sweeps_to_self:
+            before = (await self.client.balance(self.wallet.mnemonic, fresh=True)).balance
+        start = time.perf_counter()
+        invoice = await self.client.create_invoice([Offer(amount=sample.amount_sats)], spark_address=sweep_address)
+        issued = time.perf_counter()
+        sample.request_ms = (issued - start) * 1000
+        await counterparty.pay_invoice(invoice.lightning_invoice)
+        deadline = time.monotonic() + self.args.timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise SettlementTimeout(f"Invoice {invoice.invoice_id} not paid within {self.args.timeout:.0f}s")
+            status = await self.client.check_invoice(invoice.invoice_id, wait=max(1, min(60, math.ceil(remaining))))
+            if status.paid:
+                break
+        sample.settle_ms = (time.perf_counter() - issued) * 1000
+
+        if sweeps_to_self:
+            # The server reports the invoice paid before it sweeps it.
+            async def swept():
+                balance = (await self.client.balance(self.wallet.mnemonic, fresh=True)).balance
+                return balance if balance - before >= sample.amount_sats else None
+
+            try:
+                await poll_until(swept, self.args.timeout)
+            except SettlementTimeout:
+                raise SettlementTimeout(f"Invoice {invoice.invoice_id} not swept into the benchmark wallet within {self.args.timeout:.0f}s")
+
+    async def pay(self, counterparty, sample: Sample) -> None:
+        invoice = await counterparty.create_invoice(sample.amount_sats)
+        before = (await self.client.balance(self.wallet.mnemonic, fresh=True)).balance
+        start = time.perf_counter()
+        await self.client.pay_lightning_invoice(self.wallet.mnemonic, invoice, self.args.max_fee_sats)
+        sample.request_ms = (time.perf_counter() - start) * 1000
+
+        async def debited():
+            balance = (await self.client.balance(self.wallet.mnemonic, fresh=True)).balance
+            return balance if before - balance >= sample.amount_sats else None
+
+        after = await poll_until(debited, self.args.timeout)
+        sample.settle_ms = (time.perf_counter() - start) * 1000
+        sample.fee_sats = before - after - sample.amount_sats
+
+
+class _BreezListener(EventListener):
+    def __init__(self, runner: "BreezRunner"):
+        self.runner = runner
+
+    async def on_event(self, event) -> None:
+        payment = getattr(event, "payment", None)
+        if payment is not None:
+            self.runner.on_payment(payment)
+
+
+def _invoice_of(payment) -> Optional[str]:
+    return getattr(payment.details, "invoice", None)
+
+
+def _is_final(payment) -> bool:
+    return payment.status in (PaymentStatus.COMPLETED, PaymentStatus.FAILED)
+
+
+class BreezRunner:
+    name = "breez"
+
+    def __init__(self, sdk, args):
+        self.sdk = sdk
+        self.args = args
+        # Invoice -> future resolved by the first final payment event for it.
+        self.waiters = {}
+
+    @classmethod
+    async def connect(cls, args) -> "BreezRunner":
+        if connect is None:
+            raise SystemExit("--impl breez needs breez_sdk_spark; run this script with `uv run`")
+        uniffi_set_event_loop(asyncio.get_running_loop())
+        config = default_config(network=Network.MAINNET)
+        config.api_key = os.environ["BREEZ_API_KEY"]
+        seed = Seed.MNEMONIC(mnemonic=os.environ["BREEZ_MNEMONIC"], passphrase=None)
+        sdk = await connect(request=ConnectRequest(config=config, seed=seed, storage_dir=args.breez_storage_dir))
+        runner = cls(sdk, args)
+        await sdk.add_event_listener(listener=_BreezListener(runner))
+        return runner
+
+    async def close(self) -> None:
+        await self.sdk.disconnect()
+
+    def on_payment(self, payment) -> None:
+        waiter = self.waiters.get(_invoice_of(payment))
+        if waiter is not None and not waiter.done() and _is_final(payment):
+            waiter.set_result(payment)
+
+    async def _settled(self, invoice: str, waiter: asyncio.Future, poll):
+        """Whichever comes first: the payment event, or polling finding it final."""
+        polling = asyncio.ensure_future(poll_until(poll, self.args.timeout, initial_s=0.25, max_s=2.0))
+        try:
+            done, _ = await asyncio.wait({waiter, polling}, timeout=self.args.timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                raise SettlementTimeout(f"Not settled within {self.args.timeout:.0f}s")
+            payment = next(iter(done)).result()
+        finally:
+            polling.cancel()
+            self.waiters.pop(invoice, None)
+        if payment.status != PaymentStatus.COMPLETED:
+            raise RuntimeError(f"Payment ended as {payment.status}")
+        return payment
+
+    async def receive(self, counterparty, sample: Sample) -> None:
+        start = time.perf_counter()
+        response = await self.sdk.receive_payment(request=ReceivePaymentRequest(
+            payment_method=ReceivePaymentMethod.BOLT11_INVOICE(
+                description="lightning_bench", amount_sats=sample.amount_sats, expiry_secs=3600, payment_hash=None,
+            ),
+        ))
+        invoice = response.payment_request
+        issued = time.perf_counter()
+        sample.request_ms = (issued - start) * 1000
+        waiter = self.waiters[invoice] = asyncio.get_running_loop().create_future()
+
+        async def find():
+            payments = (await self.sdk.list_payments(request=ListPaymentsRequest(limit=20))).payments
+            return next((p for p in payments if _invoice_of(p) == invoice and _is_final(p)), None)
+
+        await counterparty.pay_invoice(invoice)
+        payment = await self._settled(invoice, waiter, find)
+        sample.settle_ms = (time.perf_counter() - issued) * 1000
+        sample.fee_sats = int(payment.fees)
+
+    async def pay(self, counterparty, sample: Sample) -> None:
+        invoice = await counterparty.create_invoice(sample.amount_sats)
+        waiter = self.waiters[invoice] = asyncio.get_running_loop().create_future()
+        start = time.perf_counter()
+        prepared = await self.sdk.prepare_send_payment(
+            request=PrepareSendPaymentRequest(payment_request=invoice, amount=sample.amount_sats),
+        )
+        sent = await self.sdk.send_payment(request=SendPaymentRequest(
+            prepare_response=prepared,
+            # Return at once; completion comes from the event or polling below.
+            options=SendPaymentOptions.BOLT11_INVOICE(prefer_spark=False, completion_timeout_secs=0),
+        ))
+        sample.request_ms = (time.perf_counter() - start) * 1000
+        payment_id = sent.payment.id
+
+        async def fetch():
+            try:
+                payment = (await self.sdk.get_payment(request=GetPaymentRequest(payment_id=payment_id))).payment
+            except SdkError.StorageError:
+                # Not persisted yet.
+                return None
+            return payment if _is_final(payment) else None
+
+        payment = sent.payment if _is_final(sent.payment) else await self._settled(invoice, waiter, fetch)
+        self.waiters.pop(invoice, None)
+        if payment.status != PaymentStatus.COMPLETED:
+            raise RuntimeError(f"Payment ended as {payment.status}")
+        sample.settle_ms = (time.perf_counter() - start) * 1000
+        sample.fee_sats = int(payment.fees)
+
+
+def summarize(samples):
+    groups = {}
+    for sample in samples:
+        groups.setdefault(f"{sample.implementation}:{sample.scenario}", []).append(sample)
+    out = {}
+    for name, group in sorted(groups.items()):
+        ok = [s for s in group if s.ok]
+        settle = sorted(s.settle_ms for s in ok)
+        request = sorted(s.request_ms for s in ok)
+        fees = [s.fee_sats for s in ok if s.fee_sats is not None]
+        errors = [s.error for s in group if s.error]
+        out[name] = {
+            "runs": len(group),
+            "failures": len(group) - len(ok),
+            "failure_rate": (len(group) - len(ok)) / len(group),
+            "request_p50_ms": percentile(request, 0.5),
+            "settle_mean_ms": sum(settle) / len(settle) if settle else 0.0,
+            "settle_p50_ms": percentile(settle, 0.5),
+            "settle_p90_ms": percentile(settle, 0.9),
+            "settle_p99_ms": percentile(settle, 0.99),
+            "settle_max_ms": settle[-1] if settle else 0.0,
+            "fee_mean_sats": sum(fees) / len(fees) if fees else None,
+            "fee_max_sats": max(fees) if fees else None,
+            "fee_total_sats": sum(fees) if fees else None,
+        }
+        if errors:
+            out[name]["error_sample"] = errors[0]
+    return out
+
+
+def print_report(summary):
+    print(
+        f"\n{'implementation:scenario':<24} {'runs':>5} {'fail%':>6} {'req p50':>8} "
+        f"{'p50':>8} {'p90':>8} {'p99':>8} {'max':>8} {'fee avg':>8} {'fee max':>8}"
+    )
+    for name, row in summary.items():
+        fee_mean = "-" if row["fee_mean_sats"] is None else f"{row['fee_mean_sats']:.1f}"
+        fee_max = "-" if row["fee_max_sats"] is None else str(row["fee_max_sats"])
+        print(
+            f"{name:<24} {row['runs']:>5} {row['failure_rate'] * 100:>5.1f}% {row['request_p50_ms']:>8.0f} "
+            f"{row['settle_p50_ms']:>8.0f} {row['settle_p90_ms']:>8.0f} {row['settle_p99_ms']:>8.0f} "
+            f"{row['settle_max_ms']:>8.0f} {fee_mean:>8} {fee_max:>8}"
+        )
+    print("\nLatencies in ms; settlement is measured from the invoice being available (receive) or the payment starting (pay).")
+
+
+async def load_wallet(client, args) -> WalletInfo:
+    if args.init_wallet:
+        return await client.initialize()
+    mnemonic, address = os.environ.get("MNEMONIC1"), os.environ.get("ADDRESS1")
+    if not (mnemonic and address):
+        raise SystemExit("No sparkproxy wallet: set MNEMONIC1/ADDRESS1 or pass --init-wallet")
+    return WalletInfo(mnemonic=mnemonic, address=address)
+
+
+async def main(args):
+    stubs = []
+    if args.counterparty == "stub":
+        if "breez" in args.impl:
+            raise SystemExit("The stub counterparty cannot pay a Breez wallet; use --impl sparkproxy or --counterparty blink")
+        blink_url, sparkscan_url, stubs = start_stubs(args.blink_port, args.sparkscan_port)
+        logger.info(f"Blink stub at {blink_url}; start the server with SPARKSCAN_API_URL={sparkscan_url}")
+
+    runners = []
+    async with AsyncSparkProxy(
+        args.base_url,
+        network="MAINNET",
+        timeout=args.timeout + 15,
+        retry=RetryPolicy(max_attempts=1),
+    ) as client, httpx.AsyncClient(timeout=30.0) as http:
+        if args.counterparty == "stub":
+            counterparty = StubCounterparty(http, blink_url, args.base_url)
+        else:
+            counterparty = BlinkCounterparty(http, args.blink_url, os.environ["BLINK_API_KEY"], args.blink_wallet_id)
+        wallet = None
+        if "sparkproxy" in args.impl:
+            wallet = await load_wallet(client, args)
+            if args.fund_sats:
+                response = await http.post(f"{args.base_url}/sim/faucet", json={"address": wallet.address, "amountSats": args.fund_sats})
+                if response.status_code == 404:
+                    logger.warning("Server is not running the simulated backend; --fund-sats ignored")
+                else:
+                    response.raise_for_status()
+            runners.append(SparkProxyRunner(client, wallet, args))
+        if "breez" in args.impl:
+            runners.append(await BreezRunner.connect(args))
+
+        samples = []
+        started_at = datetime.now(timezone.utc)
+        try:
+            for run in range(args.runs):
+                for runner in runners:
+                    for scenario in args.scenarios:
+                        sample = Sample(runner.name, scenario, run, args.amount_sats)
+                        try:
+                            await getattr(runner, scenario)(counterparty, sample)
+                            sample.ok = True
+                        except Exception as exc:
+                            sample.error = f"{type(exc).__name__}: {exc}"[:300]
+                            logger.warning(f"run {run} {runner.name}:{scenario} failed: {sample.error}")
+                        samples.append(sample)
+                        logger.info(
+                            f"run {run} {runner.name}:{scenario} ok={sample.ok} "
+                            f"settle_ms={sample.settle_ms if sample.settle_ms is None else round(sample.settle_ms)} fee={sample.fee_sats}"
+                        )
+                        if args.pause:
+                            await asyncio.sleep(args.pause)
+        finally:
+            for runner in runners:
+                if isinstance(runner, BreezRunner):
+                    await runner.close()
+
+    for server in stubs:
+        server.shutdown()
+
+    summary = summarize(samples)
+    print_report(summary)
+    result = {
+        "run_id": str(uuid.uuid4()),
+        "label": args.label,
+        "started_at": started_at.isoformat(),
+        "config": {
+            "base_url": args.base_url,
+            "implementations": args.impl,
+            "scenarios": args.scenarios,
+            "runs": args.runs,
+            "amount_sats": args.amount_sats,
+            "counterparty": args.counterparty,
+        },
+        "results": summary,
+        "samples": [asdict(sample) for sample in samples],
+    }
+    with open(args.out, "a") as f:
+        f.write(json.dumps(result) + "\n")
+    logger.info(f"Appended run {result['run_id']} to {args.out}")
+
+
+def parse_choices(choices):
+    def parse(value):
+        names = [name.strip() for name in value.split(",") if name.strip()]
+        unknown = [name for name in names if name not in choices]
+        if unknown or not names:
+            raise argparse.ArgumentTypeError(f"Choose from {', '.join(choices)}")
+        return names
+    return parse
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--base-url",
+        default=os.environ.get("SPARKPROXY_URL", "https://sparkproxy.kevz.dev"),
+        help="Base URL for SparkProxy (e.g. http://localhost:3000)",
+    )
+    parser.add_argument(
+        "--local",
+        action="store_true",
+        help="Shortcut for --base-url http://localhost:3000 --counterparty stub",
+    )
+    parser.add_argument("--impl", type=parse_choices(IMPLEMENTATIONS), default=list(IMPLEMENTATIONS), help="e.g. sparkproxy,breez")
+    parser.add_argument("--scenarios", type=parse_choices(SCENARIOS), default=list(SCENARIOS), help="e.g. receive,pay")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--amount-sats", type=int, default=100)
+    parser.add_argument("--max-fee-sats", type=int, default=15)
+    parser.add_argument("--timeout", type=float, default=120.0, help="Seconds to wait for one settlement")
+    parser.add_argument("--pause", type=float, default=0.0, help="Seconds between samples")
+    parser.add_argument("--counterparty", choices=["blink", "stub"], default="blink")
+    parser.add_argument("--blink-url", default=os.environ.get("BLINK_API_URL", "https://api.blink.sv/graphql"))
+    parser.add_argument("--blink-wallet-id", default=os.environ.get("BLINK_WALLET_ID", DEFAULT_BLINK_WALLET_ID))
+    parser.add_argument("--blink-port", type=int, default=3101)
+    parser.add_argument("--sparkscan-port", type=int, default=3102)
+    parser.add_argument("--init-wallet", action="store_true", help="Use a fresh sparkproxy wallet instead of MNEMONIC1")
+    parser.add_argument("--fund-sats", type=int, default=0, help="Credit the sparkproxy wallet via /sim/faucet (simulated backend)")
+    parser.add_argument(
+        "--sweep-address",
+        default=os.environ.get("ADDRESS2", ""),
+        help="Where paid sparkproxy invoices are swept; defaults to ADDRESS2, else the benchmark wallet itself (receive then waits for the sweep)",
+    )
+    parser.add_argument("--breez-storage-dir", default="./.data")
+    parser.add_argument("--label", default="", help="Free-form tag stored with the run")
+    parser.add_argument("--out", default="lightning_bench.jsonl")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.local:
+        args.base_url = "http://localhost:3000"
+        args.counterparty = "stub"
+    args.base_url = args.base_url.rstrip("/")
+    logger.info(f"Using SparkProxy base URL: {args.base_url}")
+    asyncio.run(main(args))
@@ -0,0 +1,371 @@
+#!/usr/bin/env -S uv run
+# /// script
+# requires-python = ">=3.10"
+# dependencies = [
+#   "httpx>=0.25",
+#   "python-dotenv>=1.0.0",
+# ]
+# ///
+"""Load generator and latency benchmark for a sparkproxy deployment.
+
+Drives a weighted mix of scenarios either closed-loop (N workers issuing
+requests back to back) or open-loop (arrivals at a target rate, with at most
+--concurrency in flight). It reports per-endpoint latency percentiles and
+error rates, plus the change in the server's own /metrics over the run, and
+appends a summary line to a JSONL file so runs can be compared.
+
+    # offline: stub Blink/SparkScan, fresh wallets from the server
+    uv run examples/loadtest.py --local --init-wallets 4 --mode open --rps 20 --duration 60
+
+Start the server with SPARKSCAN_API_URL pointing at the SparkScan stub (the
+URL is logged on startup) so the invoice scanner stays offline as well.
+Wallets come from MNEMONIC1/ADDRESS1 and MNEMONIC2/ADDRESS2, or from
+--init-wallets N; unfunded wallets make transfers and payments fail, which
+shows up as errors rather than aborting the run.
+
+Against a server running with SPARK_BACKEND=simulated, --fund-sats N credits
+each wallet through the simulator faucet, so the whole run is network-free and
+reproducible for a given SPARK_SIM_SEED.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import time
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+from dotenv import load_dotenv
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "clients" / "python"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from sparkproxy import AsyncSparkProxy, CallInfo, Offer, RetryPolicy, WalletInfo  # noqa: E402
+from stubs import start_stubs  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+SCENARIOS = ("balance", "transfer", "lightning_create", "lightning_pay", "payment")
+DEFAULT_MIX = "balance=4,transfer=2,lightning_create=2,lightning_pay=1,payment=1"
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+@dataclass
+class Recorder:
+    latencies: dict = field(default_factory=lambda: defaultdict(list))
+    errors: dict = field(default_factory=lambda: defaultdict(int))
+    error_samples: dict = field(default_factory=dict)
+    dropped: int = 0
+
+    def on_call(self, info: CallInfo):
+        self.latencies[info.operation].append(info.elapsed_ms)
+        if info.error is not None:
+            self.errors[info.operation] += 1
+            self.error_samples.setdefault(info.operation, str(info.error)[:200])
+
+    def record(self, name, elapsed_ms, error=None):
+        self.latencies[name].append(elapsed_ms)
+        if error is not None:
+            self.errors[name] += 1
+            self.error_samples.setdefault(name, str(error)[:200])
+
+    def summary(self, duration_s):
+        out = {}
+        for name, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            out[name] = {
+                "count": len(values),
+                "errors": self.errors.get(name, 0),
+                "error_rate": self.errors.get(name, 0) / len(values),
+                "throughput_rps": len(values) / duration_s,
+                "mean_ms": sum(values) / len(values),
+                "p50_ms": percentile(values, 0.5),
+                "p90_ms": percentile(values, 0.9),
+                "p99_ms": percentile(values, 0.99),
+                "max_ms": values[-1],
+            }
+            if name in self.error_samples:
+                out[name]["error_sample"] = self.error_samples[name]
+        return out
+
+
+class Scenarios:
+    def __init__(self, client: AsyncSparkProxy, http: httpx.AsyncClient, args, wallets):
+        self.client = client
+        self.http = http
+        self.args = args
+        self.wallets = wallets
+
+    def _pair(self):
+        sender = random.choice(self.wallets)
+        others = [w for w in self.wallets if w is not sender] or [sender]
+        return sender, random.choice(others)
+
+    async def balance(self):
+        sender, _ = self._pair()
+        await self.client.balance(sender.mnemonic)
+
+    async def transfer(self):
+        sender, receiver = self._pair()
+        await self.client.transfer(sender.mnemonic, receiver.address, self.args.amount_sats)
+
+    async def lightning_create(self):
+        sender, _ = self._pair()
+        await self.client.create_lightning_invoice(sender.mnemonic, self.args.amount_sats, memo="loadtest")
+
+    async def lightning_pay(self):
+        sender, _ = self._pair()
+        response = await self.http.post(self.args.blink_url, json={
+            "query": "mutation LnInvoiceCreate($input: LnInvoiceCreateInput!) { lnInvoiceCreate(input: $input) { invoice { paymentRequest } errors { message } } }",
+            "variables": {"input": {"amount": self.args.amount_sats, "walletId": os.environ.get("BLINK_WALLET_ID", "loadtest")}},
+        }, headers={"X-API-KEY": os.environ.get("BLINK_API_KEY", "")})
+        response.raise_for_status()
+        invoice = response.json()["data"]["lnInvoiceCreate"]["invoice"]["paymentRequest"]
+        await self.client.pay_lightning_invoice(sender.mnemonic, invoice, self.args.max_fee_sats)
+
+    async def payment(self):
+        _, receiver = self._pair()
+        invoice = await self.client.create_invoice(
+            [Offer(amount=self.args.amount_sats)], spark_address=receiver.address,
+        )
+        for _ in range(self.args.checks):
+            await self.client.check_invoice(invoice.invoice_id)
+
+
+def parse_mix(value):
+    weights = {}
+    for entry in value.split(","):
+        if not entry.strip():
+            continue
+        name, _, weight = entry.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"Unknown scenario {name!r}; choose from {', '.join(SCENARIOS)}")
+        weights[name] = float(weight or 1)
+    if not weights:
+        raise argparse.ArgumentTypeError("Empty scenario mix")
+    return weights
+
+
+async def run_scenario(scenarios, recorder, mix, scheduled_at):
+    name = random.choices(list(mix), weights=list(mix.values()))[0]
+    error = None
+    try:
+        await getattr(scenarios, name)()
+    except Exception as exc:
+        error = exc
+    # Measured from the scheduled start so queueing in the generator counts
+    # against latency (no coordinated omission in open-loop runs).
+    recorder.record(f"scenario:{name}", (time.perf_counter() - scheduled_at) * 1000, error)
+
+
+async def closed_loop(scenarios, recorder, args):
+    deadline = time.perf_counter() + args.duration
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            await run_scenario(scenarios, recorder, args.mix, time.perf_counter())
+
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+
+
+async def open_loop(scenarios, recorder, args):
+    start = time.perf_counter()
+    deadline = start + args.duration
+    in_flight = set()
+    next_at = start
+    while next_at < deadline:
+        now = time.perf_counter()
+        if next_at > now:
+            await asyncio.sleep(next_at - now)
+        if len(in_flight) >= args.concurrency:
+            recorder.dropped += 1
+        else:
+            task = asyncio.create_task(run_scenario(scenarios, recorder, args.mix, next_at))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+        next_at += random.expovariate(args.rps) if args.poisson else 1 / args.rps
+    if in_flight:
+        await asyncio.gather(*in_flight)
+
+
+async def fetch_metrics(http, base_url):
+    try:
+        response = await http.get(f"{base_url}/metrics", params={"format": "json"})
+        response.raise_for_status()
+        return response.json()
+    except (httpx.HTTPError, ValueError) as exc:
+        logger.warning(f"Could not read server metrics: {exc}")
+        return None
+
+
+def metrics_delta(before, after):
+    """Counter deltas, and histogram count deltas with the end-of-run quantiles
+    (server histograms are cumulative, so quantiles cannot be subtracted)."""
+    if before is None or after is None:
+        return None
+    delta = {}
+    for name, series in after.items():
+        for labels, value in series.items():
+            previous = before.get(name, {}).get(labels)
+            if isinstance(value, dict):
+                count = value.get("count", 0) - (previous or {}).get("count", 0)
+                if count > 0:
+                    delta.setdefault(name, {})[labels] = {**value, "count": count}
+            elif name.endswith("_total"):
+                change = value - (previous or 0)
+                if change:
+                    delta.setdefault(name, {})[labels] = change
+            else:
+                delta.setdefault(name, {})[labels] = value
+    return delta
+
+
+async def load_wallets(client, args):
+    if args.init_wallets:
+        return await client.initialize_many(args.init_wallets)
+    wallets = []
+    for i in (1, 2):
+        mnemonic, address = os.environ.get(f"MNEMONIC{i}"), os.environ.get(f"ADDRESS{i}")
+        if mnemonic and address:
+            wallets.append(WalletInfo(mnemonic=mnemonic, address=address))
+    if not wallets:
+        raise SystemExit("No wallets: set MNEMONIC1/ADDRESS1 (and MNEMONIC2/ADDRESS2) or pass --init-wallets N")
+    return wallets
+
+
+async def fund_wallets(http, base_url, wallets, amount_sats):
+    for wallet in wallets:
+        response = await http.post(f"{base_url}/sim/faucet", json={"address": wallet.address, "amountSats": amount_sats})
+        if response.status_code == 404:
+            logger.warning("Server is not running the simulated backend; --fund-sats ignored")
+            return
+        response.raise_for_status()
+
+
+def print_report(summary, dropped, duration_s):
+    print(f"\n{'endpoint':<36} {'count':>7} {'err%':>6} {'rps':>7} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}")
+    for name, row in summary.items():
+        print(
+            f"{name:<36} {row['count']:>7} {row['error_rate'] * 100:>5.1f}% {row['throughput_rps']:>7.2f} "
+            f"{row['p50_ms']:>8.1f} {row['p90_ms']:>8.1f} {row['p99_ms']:>8.1f} {row['max_ms']:>8.1f}"
+        )
+    if dropped:
+        print(f"\n{dropped} arrivals dropped at the concurrency cap ({dropped / duration_s:.2f}/s)")
+
+
+async def main(args):
+    stubs = []
+    if args.local and not args.no_stubs:
+        args.blink_url, sparkscan_url, stubs = start_stubs(args.blink_port, args.sparkscan_port, args.stub_latency_ms / 1000)
+        logger.info(f"Blink stub at {args.blink_url}; start the server with SPARKSCAN_API_URL={sparkscan_url}")
+
+    recorder = Recorder()
+    async with AsyncSparkProxy(
+        args.base_url,
+        network=args.network,
+        environment="dev" if args.dev else "prod",
+        timeout=args.timeout,
+        max_connections=max(args.concurrency, 10),
+        retry=RetryPolicy(max_attempts=1),
+        hooks=[recorder.on_call],
+    ) as client, httpx.AsyncClient(timeout=args.timeout) as http:
+        wallets = await load_wallets(client, args)
+        if args.fund_sats:
+            await fund_wallets(http, args.base_url, wallets, args.fund_sats)
+        # Wallet setup is not part of the measured run.
+        recorder.latencies.clear()
+        recorder.errors.clear()
+        recorder.error_samples.clear()
+
+        scenarios = Scenarios(client, http, args, wallets)
+        before = await fetch_metrics(http, args.base_url)
+        started_at = datetime.now(timezone.utc)
+        start = time.perf_counter()
+        if args.mode == "closed":
+            await closed_loop(scenarios, recorder, args)
+        else:
+            await open_loop(scenarios, recorder, args)
+        duration_s = time.perf_counter() - start
+        after = await fetch_metrics(http, args.base_url)
+
+    for server in stubs:
+        server.shutdown()
+
+    summary = recorder.summary(duration_s)
+    print_report(summary, recorder.dropped, duration_s)
+    result = {
+        "run_id": str(uuid.uuid4()),
+        "label": args.label,
+        "started_at": started_at.isoformat(),
+        "duration_s": duration_s,
+        "config": {
+            "base_url": args.base_url,
+            "mode": args.mode,
+            "rps": args.rps if args.mode == "open" else None,
+            "concurrency": args.concurrency,
+            "mix": args.mix,
+            "wallets": len(wallets),
+        },
+        "dropped": recorder.dropped,
+        "endpoints": summary,
+        "server_metrics_delta": metrics_delta(before, after),
+    }
+    with open(args.out, "a") as f:
+        f.write(json.dumps(result) + "\n")
+    logger.info(f"Appended run {result['run_id']} to {args.out}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dev", action="store_true", default=False)
+    parser.add_argument(
+        "--base-url",
+        default=os.environ.get("SPARKPROXY_URL", "https://sparkproxy.kevz.dev"),
+        help="Base URL for SparkProxy (e.g. http://localhost:3000)",
+    )
+    parser.add_argument(
+        "--local",
+        action="store_true",
+        help="Shortcut for --base-url http://localhost:3000, with local Blink/SparkScan stubs",
+    )
+    parser.add_argument("--no-stubs", action="store_true", help="With --local, do not start the stubs")
+    parser.add_argument("--network", default="MAINNET", choices=["MAINNET", "REGTEST"])
+    parser.add_argument("--mode", default="closed", choices=["closed", "open"])
+    parser.add_argument("--rps", type=float, default=10.0, help="Arrival rate for --mode open")
+    parser.add_argument("--poisson", action="store_true", help="Exponential inter-arrival times in open mode")
+    parser.add_argument("--concurrency", type=int, default=8, help="Workers (closed) or in-flight cap (open)")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f"Scenario weights, e.g. {DEFAULT_MIX}")
+    parser.add_argument("--checks", type=int, default=3, help="GET /payment/{id} calls after each POST /payment")
+    parser.add_argument("--amount-sats", type=int, default=10)
+    parser.add_argument("--max-fee-sats", type=int, default=15)
+    parser.add_argument("--init-wallets", type=int, default=0, help="Create N fresh wallets instead of MNEMONIC1/2")
+    parser.add_argument("--fund-sats", type=int, default=0, help="Credit each wallet via /sim/faucet (simulated backend)")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--blink-url", default=os.environ.get("BLINK_API_URL", "https://api.blink.sv/graphql"))
+    parser.add_argument("--blink-port", type=int, default=3101)
+    parser.add_argument("--sparkscan-port", type=int, default=3102)
+    parser.add_argument("--stub-latency-ms", type=float, default=0.0)
+    parser.add_argument("--label", default="", help="Free-form tag stored with the run")
+    parser.add_argument("--out", default="loadtest.jsonl")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    args.base_url = ("http://localhost:3000" if args.local else args.base_url).rstrip("/")
+    logger.info(f"Using SparkProxy base URL: {args.base_url}")
+    asyncio.run(main(args))
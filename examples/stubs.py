@@ -0,0 +1,140 @@
+#!/usr/bin/env -S uv run
+# /// script
+# requires-python = ">=3.10"
+# dependencies = []
+# ///
+"""Local stand-ins for the third-party APIs used by sparkproxy and its examples.
+
+- Blink GraphQL (`lnInvoiceCreate`, `lnInvoicePaymentSend`) for examples that
+  move sats between Spark and an external Lightning wallet.
+- SparkScan `GET /v1/address/{address}` for the invoice scanner; point the
+  server at it with `SPARKSCAN_API_URL=http://127.0.0.1:<port>`.
+
+Neither stub moves real funds: Blink invoices are syntactically plausible
+but unpayable, and payments to Blink always report SUCCESS.
+
+    uv run examples/stubs.py --blink-port 3101 --sparkscan-port 3102
+"""
+import argparse
+import json
+import logging
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+
+class _JsonHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logger.debug("%s %s", self.address_string(), format % args)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length == 0:
+            return None
+        try:
+            return json.loads(self.rfile.read(length))
+        except ValueError:
+            return None
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class BlinkStub(_JsonHandler):
+    """Answers the two Blink GraphQL mutations used by the examples."""
+
+    latency_s = 0.0
+
+    def do_POST(self):
+        body = self._read_json() or {}
+        query = body.get("query", "")
+        variables = (body.get("variables") or {}).get("input") or {}
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        if "lnInvoiceCreate" in query:
+            amount = int(variables.get("amount") or 0)
+            payment_hash = secrets.token_hex(32)
+            self._send_json(200, {"data": {"lnInvoiceCreate": {
+                "invoice": {
+                    "paymentRequest": f"lnbc{amount * 10}n1stub{payment_hash}",
+                    "paymentHash": payment_hash,
+                    "paymentSecret": secrets.token_hex(32),
+                    "satoshis": amount,
+                },
+                "errors": [],
+            }}})
+        elif "lnInvoicePaymentSend" in query:
+            self._send_json(200, {"data": {"lnInvoicePaymentSend": {"status": "SUCCESS", "errors": []}}})
+        else:
+            self._send_json(400, {"errors": [{"message": "Unsupported operation in Blink stub"}]})
+
+
+class SparkScanStub(_JsonHandler):
+    """Reports every address as having one transaction, so the scanner always
+    goes on to ask the wallet whether the invoice's offers are met."""
+
+    latency_s = 0.0
+    transaction_count = 1
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        prefix = "/v1/address/"
+        if not path.startswith(prefix):
+            self._send_json(404, {"error": "Not found"})
+            return
+        self._send_json(200, {
+            "address": path[len(prefix):],
+            "transactionCount": self.transaction_count,
+            "balance": {"btcSoftBalanceSats": 0, "btcHardBalanceSats": 0},
+        })
+
+
+def serve(handler, port, host="127.0.0.1"):
+    """Starts a stub in a daemon thread and returns the server."""
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_stubs(blink_port, sparkscan_port, latency_s=0.0):
+    BlinkStub.latency_s = latency_s
+    SparkScanStub.latency_s = latency_s
+    blink = serve(BlinkStub, blink_port)
+    sparkscan = serve(SparkScanStub, sparkscan_port)
+    return (
+        f"http://127.0.0.1:{blink.server_address[1]}/graphql",
+        f"http://127.0.0.1:{sparkscan.server_address[1]}",
+        [blink, sparkscan],
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--blink-port", type=int, default=3101)
+    parser.add_argument("--sparkscan-port", type=int, default=3102)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Added to every stub response")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    blink_url, sparkscan_url, servers = start_stubs(args.blink_port, args.sparkscan_port, args.latency_ms / 1000)
+    logger.info(f"Blink stub:     BLINK_API_URL={blink_url}")
+    logger.info(f"SparkScan stub: SPARKSCAN_API_URL={sparkscan_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        for server in servers:
+            server.shutdown()
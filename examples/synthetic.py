@@ -20,6 +20,8 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+BLINK_API_URL = os.environ.get("BLINK_API_URL", "https://api.blink.sv/graphql")
+
 
 class SyntheticTestError(Exception):
     def __init__(
@@ -149,7 +151,7 @@ def check_blink_lightning(environment, amount_sats: int, base_url: str):
     # Have Blink pay the Spark invoice
     logger.info("Having Blink pay the Spark invoice")
     blink_pay_response = requests.post(
-        "https://api.blink.sv/graphql",
+        BLINK_API_URL,
         headers={
             "content-type": "application/json",
             "X-API-KEY": os.environ["BLINK_API_KEY"],
@@ -183,7 +185,7 @@ def check_blink_lightning(environment, amount_sats: int, base_url: str):
     # Create Blink invoice
     logger.info("Creating Blink lightning invoice")
     blink_invoice_response = requests.post(
-        "https://api.blink.sv/graphql",
+        BLINK_API_URL,
         headers={
             "content-type": "application/json",
             "X-API-KEY": os.environ["BLINK_API_KEY"],
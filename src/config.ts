@@ -0,0 +1,24 @@
+export type OpRates = {
+  defaultValue: number
+  byOp: Map<string, number>
+}
+
+/**
+ * Parses "50" or "transfer=200,payLightningInvoice=800,*=20" into a default
+ * and per-operation overrides. `setting` names the variable in errors.
+ */
+export function parseRates(value: string | undefined, fallback: number, setting: string): OpRates {
+  const rates: OpRates = { defaultValue: fallback, byOp: new Map() }
+  for (const entry of (value ?? '').split(',').map((e) => e.trim()).filter(Boolean)) {
+    const [name, raw] = entry.includes('=') ? entry.split('=', 2) : ['*', entry]
+    const parsed = Number(raw)
+    if (!name || !raw || !Number.isFinite(parsed)) throw new Error(`Invalid ${setting} entry: ${entry}`)
+    if (name === '*') rates.defaultValue = parsed
+    else rates.byOp.set(name, parsed)
+  }
+  return rates
+}
+
+export function rateFor(rates: OpRates, op: string): number {
+  return rates.byOp.get(op) ?? rates.defaultValue
+}
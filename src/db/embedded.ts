@@ -0,0 +1,418 @@
+import * as crypto from 'crypto'
+import * as fs from 'node:fs/promises'
+import * as path from 'node:path'
+import type { CreateInvoiceInput, InvoiceRecord, InvoiceStore } from './store.js'
+
+/**
+ * Binary min-heap ordered by `at`. Entries are never updated in place;
+ * callers push a new entry and skip stale ones when they are popped.
+ */
+export class MinHeap<T extends { at: number }> {
+  private items: T[] = []
+
+  get size(): number {
+    return this.items.length
+  }
+
+  peek(): T | undefined {
+    return this.items[0]
+  }
+
+  push(item: T) {
+    const items = this.items
+    items.push(item)
+    let i = items.length - 1
+    while (i > 0) {
+      const parent = (i - 1) >> 1
+      if (items[parent].at <= item.at) break
+      items[i] = items[parent]
+      i = parent
+    }
+    items[i] = item
+  }
+
+  pop(): T | undefined {
+    const items = this.items
+    const top = items[0]
+    const last = items.pop()
+    if (items.length === 0 || last === undefined) return top
+    let i = 0
+    for (;;) {
+      const left = 2 * i + 1
+      if (left >= items.length) break
+      const right = left + 1
+      const child = right < items.length && items[right].at < items[left].at ? right : left
+      if (items[child].at >= last.at) break
+      items[i] = items[child]
+      i = child
+    }
+    items[i] = last
+    return top
+  }
+
+  // Pops every entry due at or before `now`, at most `limit` of them.
+  popDue(now: number, limit = Infinity): T[] {
+    const due: T[] = []
+    while (due.length < limit && this.items.length > 0 && this.items[0].at <= now) {
+      due.push(this.pop()!)
+    }
+    return due
+  }
+}
+
+type LogEntry =
+  | { op: 'create'; rec: InvoiceRecord }
+  | { op: 'paid'; id: string; sending_address: string | null; updated_at: number }
+  | { op: 'cursor'; id: string; cursor: string }
+  | { op: 'notified'; id: string }
+  | { op: 'swept'; id: string }
+  | { op: 'evict'; id: string }
+
+type Snapshot = { version: 1; records: InvoiceRecord[] }
+
+const SNAPSHOT_FILE = 'invoices.snapshot.json'
+const LOG_FILE = 'invoices.log'
+
+/**
+ * Append-only JSON-lines log with group commit: entries are buffered and
+ * written with a single write + fsync every `fsyncIntervalMs`, and the
+ * promise returned by append() resolves once the entry is on disk.
+ * compact() replaces the log with a snapshot of the current state.
+ */
+class InvoiceLog {
+  private handle: fs.FileHandle | null = null
+  private buffer: string[] = []
+  private waiters: Array<{ resolve: () => void; reject: (e: unknown) => void }> = []
+  private timer: NodeJS.Timeout | null = null
+  private flushing: Promise<void> = Promise.resolve()
+  entriesSinceSnapshot = 0
+
+  constructor(private readonly dir: string, private readonly fsyncIntervalMs: number) {}
+
+  private get logPath() {
+    return path.join(this.dir, LOG_FILE)
+  }
+
+  private get snapshotPath() {
+    return path.join(this.dir, SNAPSHOT_FILE)
+  }
+
+  // Reads the snapshot and replays the log into `apply`.
+  async load(apply: (entry: LogEntry) => void): Promise<void> {
+    await fs.mkdir(this.dir, { recursive: true, mode: 0o700 })
+    try {
+      const snapshot = JSON.parse(await fs.readFile(this.snapshotPath, 'utf8')) as Snapshot
+      for (const rec of snapshot.records) apply({ op: 'create', rec })
+    } catch (err) {
+      if ((err as NodeJS.ErrnoException).code !== 'ENOENT') throw err
+    }
+    let lines: string[] = []
+    try {
+      lines = (await fs.readFile(this.logPath, 'utf8')).split('\n')
+    } catch (err) {
+      if ((err as NodeJS.ErrnoException).code !== 'ENOENT') throw err
+    }
+    for (const [i, line] of lines.entries()) {
+      if (!line) continue
+      try {
+        apply(JSON.parse(line) as LogEntry)
+      } catch (err) {
+        // A crash can leave the last line half written; anything else is corruption.
+        if (i < lines.length - 2) throw new Error(`Corrupt invoice log at line ${i + 1}: ${err}`)
+        console.warn('Ignoring torn last line of invoice log')
+      }
+    }
+    this.handle = await fs.open(this.logPath, 'a', 0o600)
+  }
+
+  append(entry: LogEntry, durable: boolean): Promise<void> {
+    this.buffer.push(JSON.stringify(entry) + '\n')
+    this.entriesSinceSnapshot++
+    const done = durable
+      ? new Promise<void>((resolve, reject) => this.waiters.push({ resolve, reject }))
+      : Promise.resolve()
+    if (!this.timer) {
+      this.timer = setTimeout(() => {
+        this.timer = null
+        this.flushing = this.flushing.then(() => this.flush())
+      }, this.fsyncIntervalMs)
+    }
+    return done
+  }
+
+  private async flush() {
+    if (this.buffer.length === 0) return
+    const data = this.buffer.join('')
+    const waiters = this.waiters
+    this.buffer = []
+    this.waiters = []
+    try {
+      await this.handle!.write(data)
+      await this.handle!.datasync()
+      for (const waiter of waiters) waiter.resolve()
+    } catch (err) {
+      console.error('Failed to write invoice log:', err)
+      for (const waiter of waiters) waiter.reject(err)
+    }
+  }
+
+  /**
+   * Writes `records()` as the new snapshot and empties the log. Runs in the
+   * flush sequence, so everything in the log is already in the snapshot;
+   * entries buffered meanwhile are written to the emptied log afterwards.
+   */
+  compact(records: () => InvoiceRecord[]): Promise<void> {
+    const run = async () => {
+      await this.flush()
+      const snapshot: Snapshot = { version: 1, records: records() }
+      this.entriesSinceSnapshot = this.buffer.length
+      const tmp = `${this.snapshotPath}.tmp`
+      const file = await fs.open(tmp, 'w', 0o600)
+      try {
+        await file.writeFile(JSON.stringify(snapshot))
+        await file.sync()
+      } finally {
+        await file.close()
+      }
+      await fs.rename(tmp, this.snapshotPath)
+      const dir = await fs.open(this.dir, 'r')
+      try {
+        await dir.sync()
+      } finally {
+        await dir.close()
+      }
+      await this.handle!.truncate(0)
+      await this.handle!.sync()
+    }
+    const compaction = this.flushing.then(run)
+    this.flushing = compaction.catch((err) => console.error('Failed to compact invoice log:', err))
+    return compaction
+  }
+
+  async close(): Promise<void> {
+    if (this.timer) {
+      clearTimeout(this.timer)
+      this.timer = null
+    }
+    await (this.flushing = this.flushing.then(() => this.flush()))
+    await this.handle?.close()
+    this.handle = null
+  }
+}
+
+type Deadline = { at: number; id: string; kind: 'close' | 'evict' }
+
+export type EmbeddedInvoiceStoreOptions = {
+  // Persist to this directory; memory only when unset.
+  dataDir?: string
+  retentionMs: number
+  fsyncIntervalMs?: number
+  snapshotEvery?: number
+}
+
+/**
+ * Single-node invoice store. Open invoices, and paid ones not yet notified
+ * or swept, are kept in their own indexes, and a min-heap of
+ * deadlines closes invoices when they expire and evicts records
+ * `retentionMs` later, a few at a time on each call, so a scan costs
+ * O(open invoices) and nothing grows without bound.
+ *
+ * With a data directory every change is appended to `invoices.log` and
+ * fsynced in batches before create() and markPaid() resolve; the log is
+ * compacted into `invoices.snapshot.json` every `snapshotEvery` entries
+ * and on startup. Both files hold invoice mnemonics and are created 0600.
+ */
+export class EmbeddedInvoiceStore implements InvoiceStore {
+  private records = new Map<string, InvoiceRecord>()
+  private unpaid = new Map<string, InvoiceRecord>()
+  private unsettled = new Map<string, InvoiceRecord>()
+  private deadlines = new MinHeap<Deadline>()
+  private log: InvoiceLog | null = null
+  private ready: Promise<void>
+  private snapshotEvery: number
+
+  constructor(private readonly options: EmbeddedInvoiceStoreOptions) {
+    this.snapshotEvery = options.snapshotEvery ?? 10000
+    if (options.dataDir) {
+      const log = new InvoiceLog(options.dataDir, options.fsyncIntervalMs ?? 10)
+      this.log = log
+      this.ready = log.load((entry) => this.apply(entry)).then(async () => {
+        this.expire(Date.now(), Infinity)
+        await log.compact(() => this.snapshotRecords())
+        console.log(`Loaded ${this.records.size} invoices (${this.unpaid.size} open) from ${options.dataDir}`)
+      })
+    } else {
+      this.ready = Promise.resolve()
+    }
+  }
+
+  private apply(entry: LogEntry) {
+    switch (entry.op) {
+      case 'create':
+        this.index(entry.rec)
+        break
+      case 'paid': {
+        const rec = this.records.get(entry.id)
+        if (!rec) break
+        rec.paid = true
+        rec.notified = false
+        rec.swept = false
+        rec.sending_address = entry.sending_address
+        rec.updated_at = entry.updated_at
+        this.unpaid.delete(entry.id)
+        this.unsettled.set(entry.id, rec)
+        break
+      }
+      case 'notified':
+      case 'swept': {
+        const rec = this.records.get(entry.id)
+        if (!rec) break
+        rec[entry.op] = true
+        if (rec.notified !== false && rec.swept !== false) this.unsettled.delete(entry.id)
+        break
+      }
+      case 'cursor': {
+        const rec = this.records.get(entry.id)
+        if (rec && !rec.paid) rec.match_cursor = entry.cursor
+        break
+      }
+      case 'evict':
+        this.forget(entry.id)
+        break
+    }
+  }
+
+  private index(rec: InvoiceRecord) {
+    this.records.set(rec.id, rec)
+    if (rec.paid) this.unpaid.delete(rec.id)
+    else this.unpaid.set(rec.id, rec)
+    // Records written before settlement was tracked have no flags.
+    if (rec.paid && (rec.notified === false || rec.swept === false)) this.unsettled.set(rec.id, rec)
+    this.deadlines.push({ at: rec.expires_at, id: rec.id, kind: 'close' })
+    this.deadlines.push({ at: rec.expires_at + this.options.retentionMs, id: rec.id, kind: 'evict' })
+  }
+
+  // Processes up to `limit` due deadlines.
+  private expire(now: number, limit: number) {
+    for (const deadline of this.deadlines.popDue(now, limit)) {
+      const rec = this.records.get(deadline.id)
+      if (!rec) continue
+      if (deadline.kind === 'close') {
+        if (rec.expires_at <= now) this.unpaid.delete(rec.id)
+      } else if (rec.expires_at + this.options.retentionMs <= now) {
+        this.forget(rec.id)
+        this.log?.append({ op: 'evict', id: rec.id }, false)
+      }
+    }
+  }
+
+  private forget(id: string) {
+    this.records.delete(id)
+    this.unpaid.delete(id)
+    this.unsettled.delete(id)
+  }
+
+  private snapshotRecords(): InvoiceRecord[] {
+    return Array.from(this.records.values())
+  }
+
+  private async persist(entry: LogEntry, durable: boolean) {
+    if (!this.log) return
+    const written = this.log.append(entry, durable)
+    if (this.log.entriesSinceSnapshot >= this.snapshotEvery) {
+      this.log.compact(() => this.snapshotRecords()).catch(() => {})
+    }
+    await written
+  }
+
+  async create(input: CreateInvoiceInput): Promise<{ id: string }> {
+    await this.ready
+    const id = input.id ?? crypto.randomUUID()
+    const now = Date.now()
+    const rec: InvoiceRecord = {
+      id,
+      created_at: now,
+      updated_at: now,
+      expires_at: input.expires_at,
+      network: input.network,
+      mnemonic: input.mnemonic,
+      offers_json: input.offers_json,
+      webhook_url: input.webhook_url,
+      sweep_address: input.sweep_address,
+      spark_address: input.spark_address,
+      sending_address: null,
+      lightning_invoice: input.lightning_invoice,
+      paid: false,
+      notified: false,
+      swept: false,
+      match_cursor: null,
+    }
+    this.expire(now, 100)
+    this.index(rec)
+    await this.persist({ op: 'create', rec: { ...rec } }, true)
+    return { id }
+  }
+
+  async getById(id: string): Promise<InvoiceRecord | null> {
+    await this.ready
+    const rec = this.records.get(id)
+    return rec ? { ...rec } : null
+  }
+
+  async markPaid(id: string, sendingAddress: string | null): Promise<boolean> {
+    await this.ready
+    const rec = this.records.get(id)
+    if (!rec || rec.paid) return false
+    const entry: LogEntry = { op: 'paid', id, sending_address: sendingAddress, updated_at: Date.now() }
+    this.apply(entry)
+    await this.persist(entry, true)
+    return true
+  }
+
+  async markNotified(id: string): Promise<void> {
+    await this.ready
+    if (!this.unsettled.has(id)) return
+    const entry: LogEntry = { op: 'notified', id }
+    this.apply(entry)
+    // Losing it only queues the webhook again.
+    await this.persist(entry, false)
+  }
+
+  async markSwept(id: string): Promise<void> {
+    await this.ready
+    if (!this.unsettled.has(id)) return
+    const entry: LogEntry = { op: 'swept', id }
+    this.apply(entry)
+    // Losing it only repeats a sweep of an empty wallet.
+    await this.persist(entry, false)
+  }
+
+  async saveMatchCursor(id: string, cursor: string): Promise<void> {
+    await this.ready
+    const rec = this.records.get(id)
+    if (!rec || rec.paid) return
+    rec.match_cursor = cursor
+    // Only saves rescanning work, so it is not worth waiting for the fsync.
+    await this.persist({ op: 'cursor', id, cursor }, false)
+  }
+
+  async listUnpaidAndUnexpired(nowMs: number): Promise<InvoiceRecord[]> {
+    await this.ready
+    this.expire(nowMs, 1000)
+    const open: InvoiceRecord[] = []
+    for (const rec of this.unpaid.values()) {
+      if (rec.expires_at > nowMs) open.push({ ...rec })
+    }
+    return open
+  }
+
+  async listUnsettled(): Promise<InvoiceRecord[]> {
+    await this.ready
+    return Array.from(this.unsettled.values(), (rec) => ({ ...rec }))
+  }
+
+  async close(): Promise<void> {
+    await this.ready
+    await this.log?.close()
+  }
+}
@@ -0,0 +1,17 @@
+import IORedis from 'ioredis'
+import type { Redis as RedisClient } from 'ioredis'
+
+export type { RedisClient }
+
+export function getRedisUrl(): string | null {
+  const redisUrl = process.env.REDIS_URL
+  return redisUrl && redisUrl.length > 0 ? redisUrl : null
+}
+
+export function createRedisClient(url: string): RedisClient {
+  const useTLS = url.startsWith('rediss://') || process.env.REDIS_TLS === '1' || process.env.REDIS_TLS === 'true'
+  const rejectUnauthorized = !(process.env.REDIS_TLS_REJECT_UNAUTHORIZED === 'false' || process.env.REDIS_TLS_REJECT_UNAUTHORIZED === '0')
+  const options = useTLS ? { tls: { rejectUnauthorized } } : undefined
+  const RedisCtor = IORedis as unknown as { new (url: string, options?: any): RedisClient }
+  return options ? new RedisCtor(url, options as any) : new RedisCtor(url)
+}
@@ -1,6 +1,6 @@
-import IORedis from 'ioredis'
-import type { Redis as RedisClient } from 'ioredis'
 import * as crypto from 'crypto'
+import { createRedisClient, getRedisUrl, type RedisClient } from './redis.js'
+import { EmbeddedInvoiceStore, MinHeap } from './embedded.js'
 
 export type InvoiceRecord = {
   id: string
@@ -16,80 +16,161 @@ export type InvoiceRecord = {
   sending_address: string | null
   lightning_invoice: string
   paid: boolean
+  // False from payment until the merchant's webhook has been queued.
+  notified: boolean
+  // False from payment until the invoice wallet has been swept in full.
+  swept: boolean
+  // JSON MatchCursor from the last payment check, if any.
+  match_cursor: string | null
 }
 
 export type CreateInvoiceInput = Omit<
   InvoiceRecord,
-  'id' | 'created_at' | 'updated_at' | 'paid' | 'sending_address'
+  'id' | 'created_at' | 'updated_at' | 'paid' | 'notified' | 'swept' | 'sending_address' | 'match_cursor'
 > & { id?: string }
 
 export interface InvoiceStore {
   create(input: CreateInvoiceInput): Promise<{ id: string }>
   getById(id: string): Promise<InvoiceRecord | null>
-  markPaid(id: string, sendingAddress: string | null): Promise<void>
+  // Resolves to false if the invoice does not exist or was already paid.
+  // A paid invoice stays listed by listUnsettled() until both markNotified()
+  // and markSwept() have been called.
+  markPaid(id: string, sendingAddress: string | null): Promise<boolean>
+  markNotified(id: string): Promise<void>
+  markSwept(id: string): Promise<void>
+  // Ignored once the invoice is paid or gone.
+  saveMatchCursor(id: string, cursor: string): Promise<void>
   listUnpaidAndUnexpired(nowMs: number): Promise<InvoiceRecord[]>
+  // Paid invoices whose merchant still has to be notified or whose wallet
+  // still has to be swept.
+  listUnsettled(): Promise<InvoiceRecord[]>
 }
 
-class InMemoryInvoiceStore implements InvoiceStore {
-  private invoices = new Map<string, InvoiceRecord>()
+const MARK_PAID_SCRIPT = `
+if redis.call('HGET', KEYS[1], 'paid') ~= '0' then
+  return 0
+end
+redis.call('HSET', KEYS[1], 'paid', '1', 'notified', '0', 'swept', '0', 'sending_address', ARGV[1], 'updated_at', ARGV[2])
+redis.call('ZREM', KEYS[2], ARGV[3])
+redis.call('ZADD', KEYS[3], ARGV[2], ARGV[3])
+return 1`
 
-  async create(input: CreateInvoiceInput): Promise<{ id: string }> {
-    const id = input.id ?? crypto.randomUUID()
-    const now = Date.now()
-    const rec: InvoiceRecord = {
-      id,
-      created_at: now,
-      updated_at: now,
-      expires_at: input.expires_at,
-      network: input.network,
-      mnemonic: input.mnemonic,
-      offers_json: input.offers_json,
-      webhook_url: input.webhook_url,
-      sweep_address: input.sweep_address,
-      spark_address: input.spark_address,
-      sending_address: null,
-      lightning_invoice: input.lightning_invoice,
-      paid: false,
-    }
-    this.invoices.set(id, rec)
-    return { id }
-  }
-
-  async getById(id: string): Promise<InvoiceRecord | null> {
-    return this.invoices.get(id) ?? null
-  }
-
-  async markPaid(id: string, sendingAddress: string | null): Promise<void> {
-    const existing = this.invoices.get(id)
-    if (!existing) return
-    existing.paid = true
-    existing.sending_address = sendingAddress
-    existing.updated_at = Date.now()
-    this.invoices.set(id, existing)
-  }
+// Sets the settlement step ARGV[2] ('notified' or 'swept') and drops the
+// invoice from the unsettled index once neither step is outstanding.
+const MARK_SETTLED_SCRIPT = `
+if redis.call('HGET', KEYS[1], 'paid') == '1' then
+  redis.call('HSET', KEYS[1], ARGV[2], '1')
+  if redis.call('HGET', KEYS[1], 'notified') == '0' or redis.call('HGET', KEYS[1], 'swept') == '0' then
+    return 1
+  end
+end
+redis.call('ZREM', KEYS[2], ARGV[1])
+return 1`
 
-  async listUnpaidAndUnexpired(nowMs: number): Promise<InvoiceRecord[]> {
-    const all = Array.from(this.invoices.values())
-    return all.filter((i) => !i.paid && i.expires_at > nowMs)
-  }
-}
+const SAVE_CURSOR_SCRIPT = `
+if redis.call('HGET', KEYS[1], 'paid') ~= '0' then
+  return 0
+end
+redis.call('HSET', KEYS[1], 'match_cursor', ARGV[1])
+return 1`
 
+/**
+ * Invoices are stored as hashes at `invoice:{id}` and indexed by expiry in
+ * the `invoices:unpaid:by_expiry` sorted set, so a scan only touches open
+ * invoices. Paid invoices wait in `invoices:unsettled`, by payment time,
+ * until the webhook is queued and their wallet is swept. Records expire
+ * INVOICE_RETENTION_MS after the invoice does.
+ */
 class RedisInvoiceStore implements InvoiceStore {
   private redis: RedisClient
-  private unpaidSetKey = 'invoices:unpaid'
+  private unpaidIndexKey = 'invoices:unpaid:by_expiry'
+  private unsettledIndexKey = 'invoices:unsettled'
+  private legacyUnpaidSetKey = 'invoices:unpaid'
+  private retentionMs = invoiceRetentionMs()
+  private pageSize = 500
+  private migrated: Promise<void>
 
   constructor(url: string) {
-    const useTLS = url.startsWith('rediss://') || process.env.REDIS_TLS === '1' || process.env.REDIS_TLS === 'true'
-    const rejectUnauthorized = !(process.env.REDIS_TLS_REJECT_UNAUTHORIZED === 'false' || process.env.REDIS_TLS_REJECT_UNAUTHORIZED === '0')
-    const options = useTLS ? { tls: { rejectUnauthorized } } : undefined
-    const RedisCtor = IORedis as unknown as { new (url: string, options?: any): RedisClient }
-    this.redis = options ? new RedisCtor(url, options as any) : new RedisCtor(url)
+    this.redis = createRedisClient(url)
+    this.migrated = this.migrateLegacyRecords().catch((err) => {
+      console.warn('Failed to migrate legacy invoice records:', err)
+    })
   }
 
   private key(id: string) {
     return `invoice:${id}`
   }
 
+  private toHash(rec: InvoiceRecord): Record<string, string> {
+    return {
+      id: rec.id,
+      created_at: String(rec.created_at),
+      updated_at: String(rec.updated_at),
+      expires_at: String(rec.expires_at),
+      network: rec.network,
+      mnemonic: rec.mnemonic,
+      offers_json: rec.offers_json,
+      webhook_url: rec.webhook_url,
+      sweep_address: rec.sweep_address,
+      spark_address: rec.spark_address,
+      sending_address: rec.sending_address ?? '',
+      lightning_invoice: rec.lightning_invoice,
+      paid: rec.paid ? '1' : '0',
+      notified: rec.notified ? '1' : '0',
+      swept: rec.swept ? '1' : '0',
+      match_cursor: rec.match_cursor ?? '',
+    }
+  }
+
+  private fromHash(hash: Record<string, string>): InvoiceRecord | null {
+    if (!hash.id) return null
+    return {
+      id: hash.id,
+      created_at: Number(hash.created_at),
+      updated_at: Number(hash.updated_at),
+      expires_at: Number(hash.expires_at),
+      network: hash.network,
+      mnemonic: hash.mnemonic,
+      offers_json: hash.offers_json,
+      webhook_url: hash.webhook_url,
+      sweep_address: hash.sweep_address,
+      spark_address: hash.spark_address,
+      sending_address: hash.sending_address || null,
+      lightning_invoice: hash.lightning_invoice,
+      paid: hash.paid === '1',
+      // Invoices paid before settlement was tracked have no flags.
+      notified: hash.notified !== '0',
+      swept: hash.swept !== '0',
+      match_cursor: hash.match_cursor || null,
+    }
+  }
+
+  private write(rec: InvoiceRecord) {
+    const key = this.key(rec.id)
+    const multi = this.redis.multi()
+      .del(key)
+      .hset(key, this.toHash(rec))
+      .pexpireat(key, rec.expires_at + this.retentionMs)
+    if (!rec.paid) multi.zadd(this.unpaidIndexKey, rec.expires_at, rec.id)
+    else if (!rec.notified || !rec.swept) multi.zadd(this.unsettledIndexKey, rec.updated_at, rec.id)
+    return multi.exec()
+  }
+
+  /**
+   * Earlier versions stored JSON strings and tracked open invoices in a set.
+   */
+  private async migrateLegacyRecords() {
+    const ids = await this.redis.smembers(this.legacyUnpaidSetKey)
+    for (const id of ids) {
+      const key = this.key(id)
+      if (await this.redis.type(key) === 'string') {
+        const json = await this.redis.get(key)
+        if (json) await this.write(JSON.parse(json) as InvoiceRecord)
+      }
+      await this.redis.srem(this.legacyUnpaidSetKey, id)
+    }
+  }
+
   async create(input: CreateInvoiceInput): Promise<{ id: string }> {
     const id = input.id ?? crypto.randomUUID()
     const now = Date.now()
@@ -107,15 +188,23 @@ class RedisInvoiceStore implements InvoiceStore {
       sending_address: null,
       lightning_invoice: input.lightning_invoice,
       paid: false,
+      notified: false,
+      swept: false,
+      match_cursor: null,
     }
-    const key = this.key(id)
-    await this.redis.set(key, JSON.stringify(rec))
-    await this.redis.sadd(this.unpaidSetKey, id)
+    await this.write(rec)
     return { id }
   }
 
   async getById(id: string): Promise<InvoiceRecord | null> {
-    const json = await this.redis.get(this.key(id))
+    const key = this.key(id)
+    try {
+      return this.fromHash(await this.redis.hgetall(key))
+    } catch (err) {
+      if (!(err instanceof Error) || !err.message.startsWith('WRONGTYPE')) throw err
+    }
+    // Paid invoices written by earlier versions are left as JSON strings.
+    const json = await this.redis.get(key)
     if (!json) return null
     try {
       return JSON.parse(json) as InvoiceRecord
@@ -124,49 +213,102 @@ class RedisInvoiceStore implements InvoiceStore {
     }
   }
 
-  async markPaid(id: string, sendingAddress: string | null): Promise<void> {
-    const key = this.key(id)
-    const json = await this.redis.get(key)
-    if (!json) return
-    const rec = JSON.parse(json) as InvoiceRecord
-    rec.paid = true
-    rec.sending_address = sendingAddress
-    rec.updated_at = Date.now()
-    await this.redis.set(key, JSON.stringify(rec))
-    await this.redis.srem(this.unpaidSetKey, id)
+  async markPaid(id: string, sendingAddress: string | null): Promise<boolean> {
+    await this.migrated
+    const updated = await this.redis.eval(
+      MARK_PAID_SCRIPT, 3, this.key(id), this.unpaidIndexKey, this.unsettledIndexKey,
+      sendingAddress ?? '', String(Date.now()), id
+    )
+    return updated === 1
+  }
+
+  async markNotified(id: string): Promise<void> {
+    await this.redis.eval(MARK_SETTLED_SCRIPT, 2, this.key(id), this.unsettledIndexKey, id, 'notified')
+  }
+
+  async markSwept(id: string): Promise<void> {
+    await this.redis.eval(MARK_SETTLED_SCRIPT, 2, this.key(id), this.unsettledIndexKey, id, 'swept')
+  }
+
+  async saveMatchCursor(id: string, cursor: string): Promise<void> {
+    await this.redis.eval(SAVE_CURSOR_SCRIPT, 1, this.key(id), cursor)
   }
 
   async listUnpaidAndUnexpired(nowMs: number): Promise<InvoiceRecord[]> {
-    const ids = await this.redis.smembers(this.unpaidSetKey)
-    if (ids.length === 0) return []
-    const keys = ids.map((id: string) => this.key(id))
-    const jsons = await this.redis.mget(...keys)
+    await this.migrated
+    await this.redis.zremrangebyscore(this.unpaidIndexKey, '-inf', nowMs)
+
     const recs: InvoiceRecord[] = []
-    for (const json of jsons) {
-      if (!json) continue
-      try {
-        const rec = JSON.parse(json) as InvoiceRecord
-        if (!rec.paid && rec.expires_at > nowMs) {
+    for (let offset = 0; ; offset += this.pageSize) {
+      const ids = await this.redis.zrangebyscore(this.unpaidIndexKey, `(${nowMs}`, '+inf', 'LIMIT', offset, this.pageSize)
+      if (ids.length === 0) break
+
+      const pipeline = this.redis.pipeline()
+      for (const id of ids) pipeline.hgetall(this.key(id))
+      const results = (await pipeline.exec()) ?? []
+
+      const stale: string[] = []
+      results.forEach(([err, hash], i) => {
+        const rec = err ? null : this.fromHash(hash as Record<string, string>)
+        if (rec && !rec.paid) {
           recs.push(rec)
-        } else if (rec.paid || rec.expires_at <= nowMs) {
-          await this.redis.srem(this.unpaidSetKey, rec.id)
+        } else if (!err) {
+          stale.push(ids[i])
         }
-      } catch {
+      })
+      if (stale.length > 0) {
+        await this.redis.zrem(this.unpaidIndexKey, ...stale)
+        offset -= stale.length
       }
+      if (ids.length < this.pageSize) break
     }
     return recs
   }
+
+  async listUnsettled(): Promise<InvoiceRecord[]> {
+    const ids = await this.redis.zrange(this.unsettledIndexKey, 0, this.pageSize - 1)
+    if (ids.length === 0) return []
+    const pipeline = this.redis.pipeline()
+    for (const id of ids) pipeline.hgetall(this.key(id))
+    const results = (await pipeline.exec()) ?? []
+
+    const recs: InvoiceRecord[] = []
+    const stale: string[] = []
+    results.forEach(([err, hash], i) => {
+      const rec = err ? null : this.fromHash(hash as Record<string, string>)
+      if (rec && rec.paid && (!rec.notified || !rec.swept)) {
+        recs.push(rec)
+      } else if (!err) {
+        // Settled, or evicted after INVOICE_RETENTION_MS.
+        stale.push(ids[i])
+      }
+    })
+    if (stale.length > 0) await this.redis.zrem(this.unsettledIndexKey, ...stale)
+    return recs
+  }
+}
+
+function invoiceRetentionMs(): number {
+  return Number(process.env.INVOICE_RETENTION_MS ?? 30 * 24 * 60 * 60 * 1000)
 }
 
 let storeSingleton: InvoiceStore | null = null
 
 export function getInvoiceStore(): InvoiceStore {
   if (storeSingleton) return storeSingleton
-  const redisUrl = process.env.REDIS_URL
-  if (redisUrl && redisUrl.length > 0) {
+  const redisUrl = getRedisUrl()
+  if (redisUrl) {
     storeSingleton = new RedisInvoiceStore(redisUrl)
   } else {
-    storeSingleton = new InMemoryInvoiceStore()
+    // DATA_DIR= (empty) opts out of persistence.
+    const dataDir = process.env.DATA_DIR ?? './data'
+    if (!dataDir) {
+      console.warn('Invoices are kept in memory only and are lost on restart; set REDIS_URL or DATA_DIR to keep them')
+    }
+    storeSingleton = new EmbeddedInvoiceStore({
+      dataDir: dataDir || undefined,
+      retentionMs: invoiceRetentionMs(),
+    })
   }
   return storeSingleton
 }
@@ -182,10 +324,66 @@ export type IdempotencyRecord = {
 export interface IdempotencyStore {
   get(key: string): Promise<IdempotencyRecord | null>
   set(key: string, statusCode: number, responseBody: string, ttlMs?: number): Promise<void>
+  // Marks the key as in progress for `owner`; false if another request holds it.
+  reserve(key: string, owner: string, ttlMs: number): Promise<boolean>
+  // Extends `owner`'s reservation to ttlMs from now; false if it no longer holds the key.
+  renew(key: string, owner: string, ttlMs: number): Promise<boolean>
+  release(key: string, owner: string): Promise<void>
+  // Resolves once the key is no longer reserved, or after timeoutMs.
+  waitForRelease(key: string, timeoutMs: number): Promise<void>
+}
+
+type Reservation = {
+  owner: string
+  timer: NodeJS.Timeout
+  released: Promise<void>
+  resolve: () => void
 }
 
 class InMemoryIdempotencyStore implements IdempotencyStore {
   private records = new Map<string, IdempotencyRecord>()
+  // Expiry times of stored records, oldest first; see set().
+  private expiries = new MinHeap<{ at: number; key: string }>()
+  private reservations = new Map<string, Reservation>()
+
+  async reserve(key: string, owner: string, ttlMs: number): Promise<boolean> {
+    if (this.reservations.has(key)) return false
+    let resolve!: () => void
+    const released = new Promise<void>((r) => { resolve = r })
+    // Reservations lapse on their own if the request never finishes.
+    const timer = setTimeout(() => this.release(key, owner), ttlMs)
+    timer.unref()
+    this.reservations.set(key, { owner, timer, released, resolve })
+    return true
+  }
+
+  async renew(key: string, owner: string, ttlMs: number): Promise<boolean> {
+    const reservation = this.reservations.get(key)
+    if (!reservation || reservation.owner !== owner) return false
+    clearTimeout(reservation.timer)
+    reservation.timer = setTimeout(() => this.release(key, owner), ttlMs)
+    reservation.timer.unref()
+    return true
+  }
+
+  async release(key: string, owner: string): Promise<void> {
+    const reservation = this.reservations.get(key)
+    if (!reservation || reservation.owner !== owner) return
+    this.reservations.delete(key)
+    clearTimeout(reservation.timer)
+    reservation.resolve()
+  }
+
+  async waitForRelease(key: string, timeoutMs: number): Promise<void> {
+    const reservation = this.reservations.get(key)
+    if (!reservation) return
+    let timer: NodeJS.Timeout | undefined
+    await Promise.race([
+      reservation.released,
+      new Promise<void>((resolve) => { timer = setTimeout(resolve, timeoutMs) }),
+    ])
+    clearTimeout(timer)
+  }
 
   async get(key: string): Promise<IdempotencyRecord | null> {
     const record = this.records.get(key)
@@ -207,14 +405,12 @@ class InMemoryIdempotencyStore implements IdempotencyStore {
       expires_at: now + ttlMs,
     }
     this.records.set(key, record)
-    // Clean up expired records periodically (simple approach)
-    if (this.records.size > 10000) {
-      const cleanupNow = Date.now()
-      for (const [k, v] of this.records.entries()) {
-        if (v.expires_at < cleanupNow) {
-          this.records.delete(k)
-        }
-      }
+    this.expiries.push({ at: record.expires_at, key })
+    // Drop a few expired records per write instead of scanning them all.
+    // Heap entries left behind by an overwritten key are skipped.
+    for (const { key: k } of this.expiries.popDue(now, 16)) {
+      const existing = this.records.get(k)
+      if (existing && existing.expires_at <= now) this.records.delete(k)
     }
   }
 }
@@ -223,17 +419,37 @@ class RedisIdempotencyStore implements IdempotencyStore {
   private redis: RedisClient
 
   constructor(url: string) {
-    const useTLS = url.startsWith('rediss://') || process.env.REDIS_TLS === '1' || process.env.REDIS_TLS === 'true'
-    const rejectUnauthorized = !(process.env.REDIS_TLS_REJECT_UNAUTHORIZED === 'false' || process.env.REDIS_TLS_REJECT_UNAUTHORIZED === '0')
-    const options = useTLS ? { tls: { rejectUnauthorized } } : undefined
-    const RedisCtor = IORedis as unknown as { new (url: string, options?: any): RedisClient }
-    this.redis = options ? new RedisCtor(url, options as any) : new RedisCtor(url)
+    this.redis = createRedisClient(url)
   }
 
   private key(idempotencyKey: string) {
     return `idempotency:${idempotencyKey}`
   }
 
+  private lockKey(idempotencyKey: string) {
+    return `idempotency-lock:${idempotencyKey}`
+  }
+
+  async reserve(key: string, owner: string, ttlMs: number): Promise<boolean> {
+    return await this.redis.set(this.lockKey(key), owner, 'PX', ttlMs, 'NX') === 'OK'
+  }
+
+  async renew(key: string, owner: string, ttlMs: number): Promise<boolean> {
+    return await this.redis.eval(RENEW_LEASE_SCRIPT, 1, this.lockKey(key), owner, String(ttlMs)) === 1
+  }
+
+  async release(key: string, owner: string): Promise<void> {
+    await this.redis.eval(RELEASE_LEASE_SCRIPT, 1, this.lockKey(key), owner)
+  }
+
+  // Other replicas may hold the reservation, so this polls.
+  async waitForRelease(key: string, timeoutMs: number): Promise<void> {
+    const deadline = Date.now() + timeoutMs
+    while (Date.now() < deadline && await this.redis.exists(this.lockKey(key))) {
+      await new Promise((resolve) => setTimeout(resolve, Math.min(100, Math.max(0, deadline - Date.now()))))
+    }
+  }
+
   async get(key: string): Promise<IdempotencyRecord | null> {
     const json = await this.redis.get(this.key(key))
     if (!json) return null
@@ -263,8 +479,8 @@ let idempotencyStoreSingleton: IdempotencyStore | null = null
 
 export function getIdempotencyStore(): IdempotencyStore {
   if (idempotencyStoreSingleton) return idempotencyStoreSingleton
-  const redisUrl = process.env.REDIS_URL
-  if (redisUrl && redisUrl.length > 0) {
+  const redisUrl = getRedisUrl()
+  if (redisUrl) {
     idempotencyStoreSingleton = new RedisIdempotencyStore(redisUrl)
   } else {
     idempotencyStoreSingleton = new InMemoryIdempotencyStore()
@@ -273,3 +489,418 @@ export function getIdempotencyStore(): IdempotencyStore {
 }
 
 
+export type ReservedWallet = {
+  mnemonic: string
+  address: string
+}
+
+export interface WalletReservoirStore {
+  push(pool: string, wallet: ReservedWallet): Promise<void>
+  pop(pool: string): Promise<ReservedWallet | null>
+  size(pool: string): Promise<number>
+}
+
+class InMemoryWalletReservoirStore implements WalletReservoirStore {
+  private pools = new Map<string, ReservedWallet[]>()
+
+  async push(pool: string, wallet: ReservedWallet): Promise<void> {
+    const wallets = this.pools.get(pool) ?? []
+    wallets.push(wallet)
+    this.pools.set(pool, wallets)
+  }
+
+  async pop(pool: string): Promise<ReservedWallet | null> {
+    return this.pools.get(pool)?.shift() ?? null
+  }
+
+  async size(pool: string): Promise<number> {
+    return this.pools.get(pool)?.length ?? 0
+  }
+}
+
+/**
+ * Reservoir entries hold mnemonics, so they are sealed with AES-256-GCM
+ * before they are written to Redis. LPOP hands each wallet to exactly one
+ * caller, even across replicas.
+ */
+class RedisWalletReservoirStore implements WalletReservoirStore {
+  private redis: RedisClient
+  private encryptionKey: Buffer
+
+  constructor(url: string, secret: string) {
+    this.redis = createRedisClient(url)
+    this.encryptionKey = crypto.createHash('sha256').update(secret).digest()
+  }
+
+  private key(pool: string) {
+    return `reservoir:${pool}`
+  }
+
+  private seal(wallet: ReservedWallet): string {
+    const iv = crypto.randomBytes(12)
+    const cipher = crypto.createCipheriv('aes-256-gcm', this.encryptionKey, iv)
+    const ciphertext = Buffer.concat([cipher.update(JSON.stringify(wallet), 'utf8'), cipher.final()])
+    return Buffer.concat([iv, cipher.getAuthTag(), ciphertext]).toString('base64')
+  }
+
+  private open(sealed: string): ReservedWallet {
+    const data = Buffer.from(sealed, 'base64')
+    const decipher = crypto.createDecipheriv('aes-256-gcm', this.encryptionKey, data.subarray(0, 12))
+    decipher.setAuthTag(data.subarray(12, 28))
+    const plaintext = Buffer.concat([decipher.update(data.subarray(28)), decipher.final()])
+    return JSON.parse(plaintext.toString('utf8')) as ReservedWallet
+  }
+
+  async push(pool: string, wallet: ReservedWallet): Promise<void> {
+    await this.redis.rpush(this.key(pool), this.seal(wallet))
+  }
+
+  async pop(pool: string): Promise<ReservedWallet | null> {
+    // Skip entries sealed with a different key (e.g. after key rotation).
+    for (;;) {
+      const sealed = await this.redis.lpop(this.key(pool))
+      if (!sealed) return null
+      try {
+        return this.open(sealed)
+      } catch {
+        console.warn(`Discarding unreadable reservoir entry in ${pool}`)
+      }
+    }
+  }
+
+  async size(pool: string): Promise<number> {
+    return this.redis.llen(this.key(pool))
+  }
+}
+
+let reservoirStoreSingleton: WalletReservoirStore | null = null
+
+export function getWalletReservoirStore(): WalletReservoirStore {
+  if (reservoirStoreSingleton) return reservoirStoreSingleton
+  const redisUrl = getRedisUrl()
+  const secret = process.env.WALLET_RESERVOIR_KEY
+  if (redisUrl && secret && secret.length > 0) {
+    reservoirStoreSingleton = new RedisWalletReservoirStore(redisUrl, secret)
+  } else {
+    reservoirStoreSingleton = new InMemoryWalletReservoirStore()
+  }
+  return reservoirStoreSingleton
+}
+
+/**
+ * Short-lived exclusive leases used to coordinate replicas, e.g. so that each
+ * open invoice is scanned and settled by one instance at a time.
+ */
+export interface LeaseStore {
+  // Acquires the lease, or extends it if `owner` already holds it.
+  acquire(key: string, owner: string, ttlMs: number): Promise<boolean>
+  release(key: string, owner: string): Promise<void>
+  // The current owner of the lease, or null if nobody holds it.
+  holder(key: string): Promise<string | null>
+}
+
+class InMemoryLeaseStore implements LeaseStore {
+  private leases = new Map<string, { owner: string; expires_at: number }>()
+  // Expiry times of granted leases, oldest first; see acquire().
+  private expiries = new MinHeap<{ at: number; key: string }>()
+
+  async acquire(key: string, owner: string, ttlMs: number): Promise<boolean> {
+    const now = Date.now()
+    // Drop a few expired leases per call instead of scanning them all.
+    // Heap entries left behind by a renewed or re-granted lease are skipped.
+    for (const { key: k } of this.expiries.popDue(now, 16)) {
+      const existing = this.leases.get(k)
+      if (existing && existing.expires_at <= now) this.leases.delete(k)
+    }
+    const lease = this.leases.get(key)
+    if (lease && lease.expires_at > now && lease.owner !== owner) return false
+    this.leases.set(key, { owner, expires_at: now + ttlMs })
+    this.expiries.push({ at: now + ttlMs, key })
+    return true
+  }
+
+  async release(key: string, owner: string): Promise<void> {
+    if (this.leases.get(key)?.owner === owner) this.leases.delete(key)
+  }
+
+  async holder(key: string): Promise<string | null> {
+    const lease = this.leases.get(key)
+    return lease && lease.expires_at > Date.now() ? lease.owner : null
+  }
+}
+
+const RENEW_LEASE_SCRIPT = `
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0`
+
+const RELEASE_LEASE_SCRIPT = `
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0`
+
+class RedisLeaseStore implements LeaseStore {
+  private redis: RedisClient
+
+  constructor(url: string) {
+    this.redis = createRedisClient(url)
+  }
+
+  private key(lease: string) {
+    return `lease:${lease}`
+  }
+
+  async acquire(key: string, owner: string, ttlMs: number): Promise<boolean> {
+    const redisKey = this.key(key)
+    const acquired = await this.redis.set(redisKey, owner, 'PX', ttlMs, 'NX')
+    if (acquired === 'OK') return true
+    const renewed = await this.redis.eval(RENEW_LEASE_SCRIPT, 1, redisKey, owner, String(ttlMs))
+    return renewed === 1
+  }
+
+  async release(key: string, owner: string): Promise<void> {
+    await this.redis.eval(RELEASE_LEASE_SCRIPT, 1, this.key(key), owner)
+  }
+
+  async holder(key: string): Promise<string | null> {
+    return this.redis.get(this.key(key))
+  }
+}
+
+let leaseStoreSingleton: LeaseStore | null = null
+
+export function getLeaseStore(): LeaseStore {
+  if (leaseStoreSingleton) return leaseStoreSingleton
+  const redisUrl = getRedisUrl()
+  if (redisUrl) {
+    leaseStoreSingleton = new RedisLeaseStore(redisUrl)
+  } else {
+    leaseStoreSingleton = new InMemoryLeaseStore()
+  }
+  return leaseStoreSingleton
+}
+
+export interface CacheStore {
+  get(key: string): Promise<string | null>
+  // A ttlMs of 0 keeps the entry until it is deleted (or evicted, in memory).
+  set(key: string, value: string, ttlMs: number): Promise<void>
+  delete(...keys: string[]): Promise<void>
+}
+
+class InMemoryCacheStore implements CacheStore {
+  private entries = new Map<string, { value: string; expires_at: number }>()
+
+  constructor(private readonly maxEntries = 50000) {}
+
+  async get(key: string): Promise<string | null> {
+    const entry = this.entries.get(key)
+    if (!entry) return null
+    if (entry.expires_at <= Date.now()) {
+      this.entries.delete(key)
+      return null
+    }
+    return entry.value
+  }
+
+  async set(key: string, value: string, ttlMs: number): Promise<void> {
+    this.entries.delete(key)
+    this.entries.set(key, { value, expires_at: ttlMs > 0 ? Date.now() + ttlMs : Infinity })
+    // Maps iterate in insertion order, so the first entry is the oldest write.
+    while (this.entries.size > this.maxEntries) {
+      this.entries.delete(this.entries.keys().next().value!)
+    }
+  }
+
+  async delete(...keys: string[]): Promise<void> {
+    for (const key of keys) this.entries.delete(key)
+  }
+}
+
+class RedisCacheStore implements CacheStore {
+  private redis: RedisClient
+
+  constructor(url: string) {
+    this.redis = createRedisClient(url)
+  }
+
+  private key(key: string) {
+    return `cache:${key}`
+  }
+
+  async get(key: string): Promise<string | null> {
+    return this.redis.get(this.key(key))
+  }
+
+  async set(key: string, value: string, ttlMs: number): Promise<void> {
+    if (ttlMs > 0) {
+      await this.redis.set(this.key(key), value, 'PX', ttlMs)
+    } else {
+      await this.redis.set(this.key(key), value)
+    }
+  }
+
+  async delete(...keys: string[]): Promise<void> {
+    if (keys.length > 0) await this.redis.del(...keys.map((key) => this.key(key)))
+  }
+}
+
+let cacheStoreSingleton: CacheStore | null = null
+
+export function getCacheStore(): CacheStore {
+  if (cacheStoreSingleton) return cacheStoreSingleton
+  const redisUrl = getRedisUrl()
+  if (redisUrl) {
+    cacheStoreSingleton = new RedisCacheStore(redisUrl)
+  } else {
+    cacheStoreSingleton = new InMemoryCacheStore()
+  }
+  return cacheStoreSingleton
+}
+
+export type WebhookJob = {
+  id: string
+  url: string
+  payload: string
+  attempts: number
+  created_at: number
+  next_attempt_at: number
+  last_error: string | null
+}
+
+/**
+ * Durable queue of pending webhook deliveries. `claimDue` hides claimed jobs
+ * for `visibilityMs` so that a replica that dies mid-delivery does not lose
+ * them, and so that two replicas never deliver the same job concurrently.
+ */
+export interface WebhookOutboxStore {
+  enqueue(job: WebhookJob): Promise<void>
+  claimDue(nowMs: number, limit: number, visibilityMs: number): Promise<WebhookJob[]>
+  complete(id: string): Promise<void>
+  reschedule(job: WebhookJob): Promise<void>
+  deadLetter(job: WebhookJob): Promise<void>
+  size(): Promise<number>
+}
+
+class InMemoryWebhookOutboxStore implements WebhookOutboxStore {
+  private jobs = new Map<string, WebhookJob>()
+  private dead: WebhookJob[] = []
+
+  async enqueue(job: WebhookJob): Promise<void> {
+    this.jobs.set(job.id, { ...job })
+  }
+
+  async claimDue(nowMs: number, limit: number, visibilityMs: number): Promise<WebhookJob[]> {
+    const due: WebhookJob[] = []
+    for (const job of this.jobs.values()) {
+      if (due.length >= limit) break
+      if (job.next_attempt_at <= nowMs) {
+        job.next_attempt_at = nowMs + visibilityMs
+        due.push({ ...job })
+      }
+    }
+    return due
+  }
+
+  async complete(id: string): Promise<void> {
+    this.jobs.delete(id)
+  }
+
+  async reschedule(job: WebhookJob): Promise<void> {
+    this.jobs.set(job.id, { ...job })
+  }
+
+  async deadLetter(job: WebhookJob): Promise<void> {
+    this.jobs.delete(job.id)
+    this.dead.push(job)
+    if (this.dead.length > 1000) this.dead.shift()
+  }
+
+  async size(): Promise<number> {
+    return this.jobs.size
+  }
+}
+
+const CLAIM_WEBHOOK_SCRIPT = `
+local score = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if score and tonumber(score) <= tonumber(ARGV[2]) then
+  redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+  return 1
+end
+return 0`
+
+class RedisWebhookOutboxStore implements WebhookOutboxStore {
+  private redis: RedisClient
+  private queueKey = 'webhooks:outbox'
+  private deadKey = 'webhooks:dead'
+
+  constructor(url: string) {
+    this.redis = createRedisClient(url)
+  }
+
+  private key(id: string) {
+    return `webhook:${id}`
+  }
+
+  async enqueue(job: WebhookJob): Promise<void> {
+    await this.redis.multi()
+      .set(this.key(job.id), JSON.stringify(job))
+      .zadd(this.queueKey, job.next_attempt_at, job.id)
+      .exec()
+  }
+
+  async claimDue(nowMs: number, limit: number, visibilityMs: number): Promise<WebhookJob[]> {
+    const ids = await this.redis.zrangebyscore(this.queueKey, '-inf', nowMs, 'LIMIT', 0, limit)
+    const jobs: WebhookJob[] = []
+    for (const id of ids) {
+      const claimed = await this.redis.eval(CLAIM_WEBHOOK_SCRIPT, 1, this.queueKey, id, String(nowMs), String(nowMs + visibilityMs))
+      if (claimed !== 1) continue
+      const json = await this.redis.get(this.key(id))
+      if (!json) {
+        await this.redis.zrem(this.queueKey, id)
+        continue
+      }
+      try {
+        jobs.push(JSON.parse(json) as WebhookJob)
+      } catch {
+        await this.redis.zrem(this.queueKey, id)
+      }
+    }
+    return jobs
+  }
+
+  async complete(id: string): Promise<void> {
+    await this.redis.multi().zrem(this.queueKey, id).del(this.key(id)).exec()
+  }
+
+  async reschedule(job: WebhookJob): Promise<void> {
+    await this.enqueue(job)
+  }
+
+  async deadLetter(job: WebhookJob): Promise<void> {
+    await this.redis.multi()
+      .zrem(this.queueKey, job.id)
+      .del(this.key(job.id))
+      .lpush(this.deadKey, JSON.stringify(job))
+      .ltrim(this.deadKey, 0, 999)
+      .exec()
+  }
+
+  async size(): Promise<number> {
+    return this.redis.zcard(this.queueKey)
+  }
+}
+
+let webhookOutboxSingleton: WebhookOutboxStore | null = null
+
+export function getWebhookOutboxStore(): WebhookOutboxStore {
+  if (webhookOutboxSingleton) return webhookOutboxSingleton
+  const redisUrl = getRedisUrl()
+  if (redisUrl) {
+    webhookOutboxSingleton = new RedisWebhookOutboxStore(redisUrl)
+  } else {
+    webhookOutboxSingleton = new InMemoryWebhookOutboxStore()
+  }
+  return webhookOutboxSingleton
+}
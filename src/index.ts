@@ -3,15 +3,54 @@ import { serve } from '@hono/node-server'
 import { OpenAPIHono } from '@hono/zod-openapi'
 import { app as walletRouter } from './wallet/router.js'
 import { app as paymentRouter } from './payment/router.js'
+import { sparkBackendName } from './worker/backend.js'
 import { swaggerUI } from '@hono/swagger-ui'
 import { serveStatic } from '@hono/node-server/serve-static'
-import { executionTimes } from './utils.js'
+import { performance } from 'node:perf_hooks'
 import { publicKey } from './keys.js'
+import { increment, observe, renderJson, renderPrometheus } from './metrics.js'
+import { tracingMiddleware } from './tracing.js'
+import { OverloadedError } from './worker/admission.js'
+import { unknownErrorToJson } from './utils.js'
+import { HTTPException } from 'hono/http-exception'
 
 const app = new OpenAPIHono()
 
+app.use('*', tracingMiddleware)
+
+app.use('*', async (c, next) => {
+  const start = performance.now()
+  let status = 500
+  try {
+    await next()
+    status = c.res.status
+  } finally {
+    // After next() the matched route's path is available (e.g. /payment/{invoice_id}).
+    const labels = { method: c.req.method, route: c.req.routePath }
+    observe('sparkproxy_http_request_duration_ms', labels, performance.now() - start)
+    increment('sparkproxy_http_requests_total', { ...labels, status: String(status) })
+    if (status >= 400) increment('sparkproxy_http_errors_total', labels)
+  }
+})
+
+app.onError((err, c) => {
+  if (err instanceof OverloadedError) {
+    return c.json({ error: unknownErrorToJson(err) }, 429, {
+      'Retry-After': String(Math.ceil(err.retryAfterMs / 1000)),
+    })
+  }
+  if (err instanceof HTTPException) return err.getResponse()
+  console.error(err)
+  return c.text('Internal Server Error', 500)
+})
+
 app.route('/wallet', walletRouter)
 app.route('/payment', paymentRouter)
+if (sparkBackendName() === 'simulated') {
+  // Imported here so that a real deployment never loads the simulator.
+  const { app: simRouter } = await import('./sim/router.js')
+  app.route('/sim', simRouter)
+}
 
 app.doc("/openapi.json", {
   openapi: "3.0.0",
@@ -21,8 +60,13 @@ app.doc("/openapi.json", {
   },
 });
 
-app.get("/metrics", (c) => {
-  return c.json(executionTimes, 200)
+app.get("/metrics", async (c) => {
+  if (c.req.query('format') === 'json') {
+    return c.json(await renderJson(), 200)
+  }
+  return c.text(await renderPrometheus(), 200, {
+    'Content-Type': 'text/plain; version=0.0.4; charset=utf-8',
+  })
 })
 
 app.get("/docs", swaggerUI({ url: "/openapi.json" }));
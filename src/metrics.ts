@@ -0,0 +1,195 @@
+type Labels = Record<string, string>
+
+// Buckets grow by 2^(1/8) (~9% relative error) starting at 0.01ms, which
+// covers everything up to ~12 hours in a fixed 256 slots.
+const BUCKET_COUNT = 256
+const MIN_VALUE = 0.01
+const LOG_BASE = Math.log(2) / 8
+
+/**
+ * Fixed-size log-bucketed histogram (HDR-style). Memory does not grow with
+ * the number of samples; quantiles are accurate to one bucket width.
+ */
+export class Histogram {
+  private buckets = new Float64Array(BUCKET_COUNT)
+  count = 0
+  sum = 0
+  max = 0
+
+  record(value: number) {
+    const v = Math.max(value, 0)
+    const index = v <= MIN_VALUE ? 0 : Math.min(BUCKET_COUNT - 1, Math.ceil(Math.log(v / MIN_VALUE) / LOG_BASE))
+    this.buckets[index]++
+    this.count++
+    this.sum += v
+    if (v > this.max) this.max = v
+  }
+
+  quantile(q: number): number {
+    if (this.count === 0) return 0
+    const rank = Math.ceil(q * this.count)
+    let seen = 0
+    for (let i = 0; i < BUCKET_COUNT; i++) {
+      seen += this.buckets[i]
+      if (seen >= rank) return Math.min(MIN_VALUE * Math.exp(i * LOG_BASE), this.max)
+    }
+    return this.max
+  }
+}
+
+type Series<T> = { name: string; labels: Labels; value: T }
+type GaugeCollector = () => Array<{ labels: Labels; value: number }> | Promise<Array<{ labels: Labels; value: number }>>
+
+const histograms = new Map<string, Series<Histogram>>()
+const counters = new Map<string, Series<number>>()
+const gauges = new Map<string, { help: string; collect: GaugeCollector }>()
+const help = new Map<string, string>()
+
+const QUANTILES = [0.5, 0.9, 0.99]
+
+function seriesKey(name: string, labels: Labels) {
+  return `${name}${formatLabels(labels)}`
+}
+
+function formatLabels(labels: Labels): string {
+  const entries = Object.entries(labels)
+  if (entries.length === 0) return ''
+  const body = entries
+    .map(([k, v]) => `${k}="${v.replace(/\\/g, '\\\\').replace(/"/g, '\\"').replace(/\n/g, '\\n')}"`)
+    .join(',')
+  return `{${body}}`
+}
+
+export function describe(name: string, text: string) {
+  help.set(name, text)
+}
+
+export function observe(name: string, labels: Labels, value: number) {
+  const key = seriesKey(name, labels)
+  let series = histograms.get(key)
+  if (!series) {
+    series = { name, labels, value: new Histogram() }
+    histograms.set(key, series)
+  }
+  series.value.record(value)
+}
+
+export function increment(name: string, labels: Labels, by = 1) {
+  const key = seriesKey(name, labels)
+  const series = counters.get(key)
+  if (series) {
+    series.value += by
+  } else {
+    counters.set(key, { name, labels, value: by })
+  }
+}
+
+export function registerGauge(name: string, text: string, collect: GaugeCollector) {
+  gauges.set(name, { help: text, collect })
+}
+
+function groupByName<T>(series: Iterable<Series<T>>): Map<string, Array<Series<T>>> {
+  const grouped = new Map<string, Array<Series<T>>>()
+  for (const s of series) {
+    const group = grouped.get(s.name) ?? []
+    group.push(s)
+    grouped.set(s.name, group)
+  }
+  return grouped
+}
+
+/**
+ * Renders every metric in the Prometheus text exposition format. Histograms
+ * are exposed as summaries (p50/p90/p99, _sum, _count) plus a _max gauge.
+ */
+export async function renderPrometheus(): Promise<string> {
+  const lines: string[] = []
+  for (const [name, series] of groupByName(histograms.values())) {
+    if (help.has(name)) lines.push(`# HELP ${name} ${help.get(name)}`)
+    lines.push(`# TYPE ${name} summary`)
+    for (const { labels, value } of series) {
+      for (const q of QUANTILES) {
+        lines.push(`${name}${formatLabels({ ...labels, quantile: String(q) })} ${value.quantile(q)}`)
+      }
+      lines.push(`${name}_sum${formatLabels(labels)} ${value.sum}`)
+      lines.push(`${name}_count${formatLabels(labels)} ${value.count}`)
+    }
+    lines.push(`# TYPE ${name}_max gauge`)
+    for (const { labels, value } of series) {
+      lines.push(`${name}_max${formatLabels(labels)} ${value.max}`)
+    }
+  }
+  for (const [name, series] of groupByName(counters.values())) {
+    if (help.has(name)) lines.push(`# HELP ${name} ${help.get(name)}`)
+    lines.push(`# TYPE ${name} counter`)
+    for (const { labels, value } of series) {
+      lines.push(`${name}${formatLabels(labels)} ${value}`)
+    }
+  }
+  for (const [name, gauge] of gauges) {
+    let samples: Array<{ labels: Labels; value: number }>
+    try {
+      samples = await gauge.collect()
+    } catch (err) {
+      console.warn(`Failed to collect metric ${name}:`, err)
+      continue
+    }
+    lines.push(`# HELP ${name} ${gauge.help}`)
+    lines.push(`# TYPE ${name} gauge`)
+    for (const { labels, value } of samples) {
+      lines.push(`${name}${formatLabels(labels)} ${value}`)
+    }
+  }
+  return lines.join('\n') + '\n'
+}
+
+/**
+ * JSON view of the same data, keyed by metric name and series labels.
+ */
+export async function renderJson(): Promise<Record<string, unknown>> {
+  const out: Record<string, Record<string, unknown>> = {}
+  const section = (name: string) => (out[name] ??= {})
+  for (const { name, labels, value } of histograms.values()) {
+    section(name)[formatLabels(labels) || '{}'] = {
+      count: value.count,
+      p50: value.quantile(0.5),
+      p90: value.quantile(0.9),
+      p99: value.quantile(0.99),
+      max: value.max,
+    }
+  }
+  for (const { name, labels, value } of counters.values()) {
+    section(name)[formatLabels(labels) || '{}'] = value
+  }
+  for (const [name, gauge] of gauges) {
+    try {
+      for (const { labels, value } of await gauge.collect()) {
+        section(name)[formatLabels(labels) || '{}'] = value
+      }
+    } catch {
+    }
+  }
+  return out
+}
+
+describe('sparkproxy_operation_duration_ms', 'Duration of individual Spark SDK steps inside workers')
+describe('sparkproxy_worker_call_duration_ms', 'End-to-end duration of worker operations')
+describe('sparkproxy_worker_call_errors_total', 'Worker operations that failed or timed out')
+describe('sparkproxy_worker_queue_wait_ms', 'Time from dispatching a worker operation until the worker picked it up')
+describe('sparkproxy_admission_total', 'Worker operations by admission outcome: immediate, queued, rejected (queue full), shed (displaced by higher priority) or timeout')
+describe('sparkproxy_admission_wait_ms', 'Time worker operations waited for admission')
+describe('sparkproxy_wallet_lane_wait_ms', 'Time spending operations waited for earlier operations on the same wallet')
+describe('sparkproxy_wallet_lane_rejections_total', 'Spending operations turned away because their wallet queue was full or the wait timed out')
+describe('sparkproxy_http_request_duration_ms', 'HTTP request latency by route')
+describe('sparkproxy_http_requests_total', 'HTTP requests by route and status')
+describe('sparkproxy_http_errors_total', 'HTTP requests that returned 4xx/5xx or threw')
+describe('sparkproxy_invoice_scan_duration_ms', 'Duration of one invoice scan cycle')
+describe('sparkproxy_webhook_attempt_duration_ms', 'Duration of individual webhook delivery attempts')
+describe('sparkproxy_webhook_delivery_latency_ms', 'Time from enqueueing a webhook to its successful delivery')
+describe('sparkproxy_webhook_attempts_total', 'Webhook delivery attempts by outcome')
+describe('sparkproxy_webhook_dead_letters_total', 'Webhooks dropped after exhausting their retries')
+describe('sparkproxy_sparkscan_lookups_total', 'SparkScan lookups by how they were answered: cached, coalesced with one in flight, or fetched')
+describe('sparkproxy_sparkscan_requests_total', 'HTTP requests sent to SparkScan by status')
+describe('sparkproxy_sparkscan_request_duration_ms', 'SparkScan HTTP request latency')
+describe('sparkproxy_sparkscan_throttle_wait_ms', 'Time SparkScan lookups waited for the rate limiter')
+describe('sparkproxy_wallet_cache_lookups_total', 'Wallet balance and address cache lookups by result: hit, miss or bypass (Cache-Control: no-cache)')
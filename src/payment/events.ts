@@ -0,0 +1,112 @@
+import { createRedisClient, getRedisUrl, type RedisClient } from '../db/redis.js';
+import { registerGauge } from '../metrics.js';
+
+export type InvoiceStatus = {
+    invoice_id: string
+    paid: boolean
+    sending_address: string | null
+}
+
+type Listener = (status: InvoiceStatus) => void
+
+const CHANNEL = 'invoice-events'
+
+/**
+ * Fans invoice status changes out to the SSE and long-poll requests waiting
+ * on them. With REDIS_URL set, changes are published on the `invoice-events`
+ * channel so a request held by one replica hears about a payment settled by
+ * another; every replica delivers to its own listeners from the channel,
+ * including the one that published. Without Redis delivery is in-process.
+ *
+ * Delivery is best effort: waiters always read the store before
+ * subscribing, and long-lived streams re-check it periodically.
+ */
+export class InvoiceEvents {
+    private listeners = new Map<string, Set<Listener>>()
+    private publisher: RedisClient | null = null
+    private subscriber: RedisClient | null = null
+
+    constructor(redisUrl: string | null) {
+        if (!redisUrl) return
+        this.publisher = createRedisClient(redisUrl)
+        // A subscribed ioredis connection cannot issue other commands.
+        this.subscriber = createRedisClient(redisUrl)
+        this.subscriber.on('message', (_channel: string, message: string) => {
+            try {
+                this.deliver(JSON.parse(message) as InvoiceStatus)
+            } catch (err) {
+                console.warn('Ignoring malformed invoice event:', err)
+            }
+        })
+        this.subscriber.subscribe(CHANNEL).catch((err) => {
+            console.warn('Failed to subscribe to invoice events:', err)
+        })
+    }
+
+    get size(): number {
+        let total = 0
+        for (const set of this.listeners.values()) total += set.size
+        return total
+    }
+
+    async publish(status: InvoiceStatus): Promise<void> {
+        if (!this.publisher) {
+            this.deliver(status)
+            return
+        }
+        try {
+            await this.publisher.publish(CHANNEL, JSON.stringify(status))
+        } catch (err) {
+            // Local waiters can still be told; remote ones fall back to re-checking.
+            console.warn(`Failed to publish status of invoice ${status.invoice_id}:`, err)
+            this.deliver(status)
+        }
+    }
+
+    // Returns a function that removes the listener.
+    subscribe(invoiceId: string, listener: Listener): () => void {
+        const set = this.listeners.get(invoiceId) ?? new Set()
+        set.add(listener)
+        this.listeners.set(invoiceId, set)
+        return () => {
+            set.delete(listener)
+            if (set.size === 0 && this.listeners.get(invoiceId) === set) this.listeners.delete(invoiceId)
+        }
+    }
+
+    // Resolves with the next status published for the invoice, or null after `timeoutMs`.
+    next(invoiceId: string, timeoutMs: number, signal?: AbortSignal): Promise<InvoiceStatus | null> {
+        return new Promise((resolve) => {
+            let unsubscribe = () => {}
+            const finish = (status: InvoiceStatus | null) => {
+                clearTimeout(timer)
+                unsubscribe()
+                signal?.removeEventListener('abort', onAbort)
+                resolve(status)
+            }
+            const onAbort = () => finish(null)
+            const timer = setTimeout(() => finish(null), timeoutMs)
+            unsubscribe = this.subscribe(invoiceId, finish)
+            signal?.addEventListener('abort', onAbort)
+            if (signal?.aborted) finish(null)
+        })
+    }
+
+    private deliver(status: InvoiceStatus) {
+        const set = this.listeners.get(status.invoice_id)
+        if (!set) return
+        for (const listener of [...set]) {
+            try {
+                listener(status)
+            } catch (err) {
+                console.warn(`Invoice event listener for ${status.invoice_id} failed:`, err)
+            }
+        }
+    }
+}
+
+export const invoiceEvents = new InvoiceEvents(getRedisUrl())
+
+registerGauge('sparkproxy_invoice_status_waiters', 'Requests waiting on an invoice status change (SSE and long-poll)', () => [
+    { labels: {}, value: invoiceEvents.size },
+])
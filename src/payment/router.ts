@@ -1,31 +1,30 @@
-import * as crypto from 'crypto';
-import { Network, type SparkAddressFormat } from '@buildonspark/spark-sdk'
+import { Network } from '@buildonspark/spark-sdk'
 import { OpenAPIHono } from '@hono/zod-openapi'
-import { getInvoiceStore } from '../db/store.js';
+import { streamSSE } from 'hono/streaming'
+import { getInvoiceStore, type InvoiceRecord } from '../db/store.js';
 import { createInvoiceRoute, checkInvoiceRoute } from './routes/index.js';
 import { workerClient } from '../worker/client.js';
-import { privateKey } from '../keys.js';
-import { checkIdempotency, storeIdempotencyResponse } from '../utils.js';
+import { walletReservoir } from '../wallet/reservoir.js';
+import { invoiceWatcher } from './watcher.js';
+import { startInvoiceScanner } from './scanner.js';
+import { invoiceEvents, type InvoiceStatus } from './events.js';
+import { checkIdempotency, releaseIdempotencyKey, storeIdempotencyResponse } from '../utils.js';
+import { addSpan, preciseNow } from '../tracing.js';
 
 export const app = new OpenAPIHono()
 const invoices = getInvoiceStore();
 
-async function sendWebhook(webhookURL: string, payload: string) {
-    const sign = crypto.createSign('SHA256');
-    sign.update(payload);
-    sign.end();
+// How long an SSE stream is held before the client has to reconnect, and
+// how often an idle one gets a keep-alive comment and a store re-check.
+const streamTimeoutMs = Number(process.env.INVOICE_STREAM_TIMEOUT_MS ?? 10 * 60 * 1000)
+const streamHeartbeatMs = 15000
 
-    const signature = sign.sign(privateKey, 'base64');
-    await fetch(webhookURL, {
-        method: 'POST',
-        headers: {
-            'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({
-            payload: payload,
-            signature: signature,
-        }),
-    })
+function toStatus(invoice: InvoiceRecord): InvoiceStatus {
+    return {
+        invoice_id: invoice.id,
+        paid: invoice.paid,
+        sending_address: invoice.sending_address,
+    }
 }
 
 app.openapi(createInvoiceRoute, async (c) => {
@@ -37,129 +36,157 @@ app.openapi(createInvoiceRoute, async (c) => {
         return cachedResponse
     }
 
-    const { mnemonic, address: sparkAddress } = await workerClient.initialize({
-        network: c.req.valid('json').network as keyof typeof Network,
-        environment: 'prod',
-    })
-
-    const offers = c.req.valid('json').offers
-    const seenKeys = new Set<string>()
-    for (const offer of offers as Array<{ asset: string; amount: number; tokenIdentifier?: string }>) {
-        const key = offer.asset === 'TOKEN' ? `TOKEN:${offer.tokenIdentifier ?? ''}` : 'BITCOIN'
-        if (seenKeys.has(key)) {
-            const errorResponse = { error: 'Duplicate asset/tokenIdentifier detected' }
-            await storeIdempotencyResponse(idempotencyKey, 'createInvoice', 400, errorResponse)
-            return c.json(errorResponse, 400)
+    try {
+        const body = c.req.valid('json')
+        const network = body.network as keyof typeof Network
+
+        const seenKeys = new Set<string>()
+        for (const offer of body.offers as Array<{ asset: string; amount: number; tokenIdentifier?: string }>) {
+            const key = offer.asset === 'TOKEN' ? `TOKEN:${offer.tokenIdentifier ?? ''}` : 'BITCOIN'
+            if (seenKeys.has(key)) {
+                const errorResponse = { error: 'Duplicate asset/tokenIdentifier detected' }
+                await storeIdempotencyResponse(idempotencyKey, 'createInvoice', 400, errorResponse)
+                return c.json(errorResponse, 400)
+            }
+            seenKeys.add(key)
         }
-        seenKeys.add(key)
-    }
 
-    let invoice = "";
-    for (const offer of c.req.valid('json').offers) {
-        if (offer.asset === "BITCOIN") {
-            const { invoice: encoded } = await workerClient.createLightningInvoice({
-                mnemonic: mnemonic!,
-                network: c.req.valid('json').network as keyof typeof Network,
+        // With a Lightning offer, a new wallet and its invoice come from one
+        // worker call and one wallet bootstrap. Token-only invoices just need
+        // a wallet, which the reservoir usually has ready.
+        const bitcoin = body.offers.find((offer) => offer.asset === 'BITCOIN')
+        let mnemonic: string
+        let sparkAddress: string
+        let invoice = ''
+        if (bitcoin) {
+            const created = await workerClient.createInvoiceWallet({
+                network,
                 environment: 'prod',
-                amountSats: offer.amount,
+                amountSats: bitcoin.amount,
             })
-            invoice = encoded
-            break;
+            mnemonic = created.mnemonic
+            sparkAddress = created.address
+            invoice = created.invoice ?? ''
+        } else {
+            ({ mnemonic, address: sparkAddress } = await walletReservoir.take(network, 'prod'))
         }
-    }
 
-    const { id } = await invoices.create({
-        network: c.req.valid('json').network,
-        mnemonic: mnemonic!,
-        expires_at: Date.now() + 1000 * 60 * 60,
-        offers_json: JSON.stringify(c.req.valid('json').offers),
-        webhook_url: c.req.valid('json').webhook_url,
-        sweep_address: c.req.valid('json').spark_address,
-        spark_address: sparkAddress,
-        lightning_invoice: invoice,
-    })
-
-    const response = {
-        invoice_id: id,
-        spark_address: sparkAddress,
-        lightning_invoice: invoice,
-    }
+        const storeStart = preciseNow()
+        const { id } = await invoices.create({
+            network: body.network,
+            mnemonic,
+            expires_at: Date.now() + 1000 * 60 * 60,
+            offers_json: JSON.stringify(body.offers),
+            webhook_url: body.webhook_url,
+            sweep_address: body.spark_address,
+            spark_address: sparkAddress,
+            lightning_invoice: invoice,
+        })
+        addSpan('invoiceStore', storeStart, preciseNow() - storeStart)
+
+        const response = {
+            invoice_id: id,
+            spark_address: sparkAddress,
+            lightning_invoice: invoice,
+        }
     
-    await storeIdempotencyResponse(idempotencyKey, 'createInvoice', 200, response)
-    return c.json(response, 200)
+        // Subscribe in the background; the scan loop retries if this fails.
+        invoices.getById(id)
+            .then((record) => record ? invoiceWatcher.watch(record) : undefined)
+            .catch((err) => console.warn(`Failed to watch invoice ${id}:`, err))
+
+        await storeIdempotencyResponse(idempotencyKey, 'createInvoice', 200, response)
+        return c.json(response, 200)
+    } catch (err) {
+        // Let a retry with the same key run instead of waiting for the reservation to lapse.
+        await releaseIdempotencyKey(idempotencyKey, 'createInvoice')
+        throw err
+    }
 })
 
 app.openapi(checkInvoiceRoute, async (c) => {
-    const invoice = await invoices.getById(c.req.valid('param').invoice_id)
-    if (!invoice) {
-        return c.json({ error: 'Invoice not found' }, 404)
+    const invoiceId = c.req.valid('param').invoice_id
+    const waitMs = (c.req.valid('query').wait ?? 0) * 1000
+    // Subscribe before reading so a payment landing in between is not missed.
+    const cancel = new AbortController()
+    const onClose = () => cancel.abort()
+    c.req.raw.signal.addEventListener('abort', onClose)
+    const change = waitMs > 0 ? invoiceEvents.next(invoiceId, waitMs, cancel.signal) : null
+    try {
+        const invoice = await invoices.getById(invoiceId)
+        if (!invoice) {
+            return c.json({ error: 'Invoice not found' }, 404)
+        }
+        if (invoice.paid || !change) {
+            return c.json(toStatus(invoice), 200)
+        }
+        const status = await change
+        if (status?.paid) {
+            return c.json(status, 200)
+        }
+        // Timed out; the store is the source of truth if an event was lost.
+        const latest = await invoices.getById(invoiceId)
+        return c.json(toStatus(latest ?? invoice), 200)
+    } finally {
+        cancel.abort()
+        c.req.raw.signal.removeEventListener('abort', onClose)
     }
-    return c.json({
-        invoice_id: invoice.id,
-        paid: invoice.paid,
-        sending_address: invoice.sending_address,
-    }, 200)
 })
 
-async function scanInvoices() {
-    try {
-        const pending = await invoices.listUnpaidAndUnexpired(Date.now())
-        for (const invoice of pending) {
-            try {
-                console.log(`Checking invoice ${invoice.id}`)
-
-                const resp = await fetch(`https://api.sparkscan.io/v1/address/${invoice.spark_address}?network=${invoice.network}`, {
-                    headers: {
-                        'Authorization': `Bearer ${process.env.SPARKSCAN_API_KEY}`
-                    }
-                })
-                if (!resp.ok) {
-                    console.warn(`SparkScan request failed for ${invoice.id}: ${resp.status}`)
-                    await new Promise(resolve => setTimeout(resolve, 1000))
-                    continue
-                }
-                let data: any = null
-                try {
-                    data = await resp.json()
-                } catch (e) {
-                    console.warn(`Failed to parse SparkScan response for ${invoice.id}`)
-                    continue
+/**
+ * Server-sent events for one invoice: a `status` event with the current
+ * state, then another when it is paid, after which the stream ends. Left
+ * out of the OpenAPI document, which cannot describe an event stream.
+ */
+app.get('/:invoice_id/events', async (c) => {
+    const invoiceId = c.req.param('invoice_id')
+    if (!await invoices.getById(invoiceId)) {
+        return c.json({ error: 'Invoice not found' }, 404)
+    }
+    return streamSSE(c, async (stream) => {
+        let pending: InvoiceStatus | null = null
+        let wake = () => {}
+        const unsubscribe = invoiceEvents.subscribe(invoiceId, (status) => {
+            pending = status
+            wake()
+        })
+        stream.onAbort(() => wake())
+        try {
+            const invoice = await invoices.getById(invoiceId)
+            if (!invoice) return
+            let current = toStatus(invoice)
+            await stream.writeSSE({ event: 'status', data: JSON.stringify(current), retry: 1000 })
+            const deadline = Date.now() + streamTimeoutMs
+            while (!current.paid && !stream.aborted && Date.now() < deadline) {
+                if (!pending) {
+                    await new Promise<void>((resolve) => {
+                        const timer = setTimeout(resolve, Math.min(streamHeartbeatMs, deadline - Date.now()))
+                        wake = () => {
+                            clearTimeout(timer)
+                            resolve()
+                        }
+                    })
+                    wake = () => {}
                 }
-                if (!data || (typeof data['transactionCount'] === 'number' && data['transactionCount'] === 0)) {
-                    await new Promise(resolve => setTimeout(resolve, 1000))
+                if (stream.aborted) break
+                if (pending) {
+                    current = pending
+                    pending = null
+                    await stream.writeSSE({ event: 'status', data: JSON.stringify(current) })
                     continue
                 }
-
-                const offerStatus = await workerClient.isOfferMet({
-                    mnemonic: invoice.mnemonic,
-                    network: invoice.network as keyof typeof Network,
-                    environment: 'prod',
-                    offers: JSON.parse(invoice.offers_json),
-                })
-                if (offerStatus.paid) {
-                    await invoices.markPaid(invoice.id, offerStatus.sending_address || null)
-                    await workerClient.transferAll({
-                        mnemonic: invoice.mnemonic,
-                        network: invoice.network as keyof typeof Network,
-                        environment: 'prod',
-                        receiverSparkAddress: invoice.sweep_address as SparkAddressFormat,
-                    })
-                    if (invoice.webhook_url) {
-                        await sendWebhook(invoice.webhook_url, JSON.stringify({
-                            invoice_id: invoice.id,
-                            paid: true,
-                        }))
-                    }
+                const latest = await invoices.getById(invoiceId)
+                if (latest?.paid) {
+                    current = toStatus(latest)
+                    await stream.writeSSE({ event: 'status', data: JSON.stringify(current) })
+                } else {
+                    await stream.write(': keep-alive\n\n')
                 }
-            } catch (err) {
-                console.warn(`Error while scanning invoice ${invoice.id}:`, err)
             }
+        } finally {
+            unsubscribe()
         }
-    } finally {
-        setTimeout(scanInvoices, 5000)
-    }
-}
-
-scanInvoices()
-
+    })
+})
 
+startInvoiceScanner()
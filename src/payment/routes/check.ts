@@ -14,6 +14,11 @@ export const checkInvoiceRoute = createRoute({
         params: z.object({
             invoice_id: z.string(),
         }),
+        query: z.object({
+            wait: z.coerce.number().int().min(0).max(60).optional().openapi({
+                description: 'Long-poll: hold the request for up to this many seconds until the invoice is paid',
+            }),
+        }),
     },
     responses: {
         200: {
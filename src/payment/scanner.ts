@@ -0,0 +1,109 @@
+import { Network } from '@buildonspark/spark-sdk'
+import { getInvoiceStore, getLeaseStore, type InvoiceRecord } from '../db/store.js';
+import { workerClient } from '../worker/client.js';
+import { instanceId, mapWithConcurrency } from '../utils.js';
+import { observe } from '../metrics.js';
+import { getSparkScan } from '../sparkscan.js';
+import type { NetworkName } from '../worker/types.js';
+import { retrySettlement, settleInvoice } from './settlement.js';
+import { invoiceWatcher } from './watcher.js';
+
+const invoices = getInvoiceStore();
+const leases = getLeaseStore();
+
+const scanIntervalMs = Number(process.env.INVOICE_SCAN_INTERVAL_MS ?? 5000)
+const scanConcurrency = Number(process.env.INVOICE_SCAN_CONCURRENCY ?? 16)
+const reconcileIntervalMs = Number(process.env.INVOICE_RECONCILE_INTERVAL_MS ?? 60000)
+const settleRetryMs = Number(process.env.INVOICE_SETTLE_RETRY_MS ?? 60000)
+let lastReconcileAt = 0
+
+async function checkInvoice(invoice: InvoiceRecord) {
+    const summary = await getSparkScan().addressSummary(invoice.spark_address, invoice.network as NetworkName)
+    if (!summary || summary.transactionCount === 0) {
+        return
+    }
+
+    const offerStatus = await workerClient.isOfferMet({
+        mnemonic: invoice.mnemonic,
+        network: invoice.network as keyof typeof Network,
+        environment: 'prod',
+        offers: JSON.parse(invoice.offers_json),
+        since: invoice.created_at,
+        cursor: invoice.match_cursor ? JSON.parse(invoice.match_cursor) : undefined,
+    })
+    if (offerStatus.paid) {
+        await settleInvoice(invoice, offerStatus)
+    } else if (offerStatus.cursor) {
+        // The next check only reads transfers newer than this.
+        const cursor = JSON.stringify(offerStatus.cursor)
+        if (cursor !== invoice.match_cursor) await invoices.saveMatchCursor(invoice.id, cursor)
+    }
+}
+
+async function scanInvoice(invoice: InvoiceRecord, reconcile: boolean) {
+    if (!invoiceWatcher.isWatching(invoice.id) && invoiceWatcher.hasCapacity()) {
+        if (await invoiceWatcher.watch(invoice)) return
+    }
+    // Between reconciliations, push covers invoices watched here or by another replica.
+    if (!reconcile && (invoiceWatcher.isWatching(invoice.id) || await invoiceWatcher.isWatchedElsewhere(invoice.id))) return
+
+    // Held until it expires so that no other replica checks this invoice
+    // again during the same cycle.
+    if (!await leases.acquire(`invoice-scan:${invoice.id}`, instanceId, scanIntervalMs)) return
+    await checkInvoice(invoice)
+}
+
+// Paid invoices whose webhook was not queued or whose sweep did not
+// complete, each retried at most once every INVOICE_SETTLE_RETRY_MS across
+// replicas.
+async function retrySettlements() {
+    const unsettled = await invoices.listUnsettled()
+    await mapWithConcurrency(unsettled, scanConcurrency, async (invoice) => {
+        try {
+            // Left to expire, like the scan lease.
+            if (!await leases.acquire(`invoice-settle-retry:${invoice.id}`, instanceId, settleRetryMs)) return
+            await retrySettlement(invoice.id)
+        } catch (err) {
+            console.warn(`Error while settling paid invoice ${invoice.id}:`, err)
+        }
+    })
+}
+
+/**
+ * One pass over the open invoices: soonest-expiring first, with at most
+ * INVOICE_SCAN_CONCURRENCY invoices in flight. Watched invoices are only
+ * polled every INVOICE_RECONCILE_INTERVAL_MS in case a push was missed.
+ */
+async function scanInvoices() {
+    const start = Date.now()
+    try {
+        const pending = await invoices.listUnpaidAndUnexpired(start)
+        pending.sort((a, b) => a.expires_at - b.expires_at)
+        await invoiceWatcher.prune(start, new Set(pending.map((invoice) => invoice.id)))
+
+        const reconcile = !invoiceWatcher.enabled || start - lastReconcileAt >= reconcileIntervalMs
+        if (reconcile) lastReconcileAt = start
+
+        await mapWithConcurrency(pending, scanConcurrency, async (invoice) => {
+            try {
+                await scanInvoice(invoice, reconcile)
+            } catch (err) {
+                console.warn(`Error while scanning invoice ${invoice.id}:`, err)
+            }
+        })
+
+        await retrySettlements()
+
+        const duration = Date.now() - start
+        observe('sparkproxy_invoice_scan_duration_ms', {}, duration)
+        console.log(`Scanned ${pending.length} open invoices in ${duration}ms`)
+    } catch (err) {
+        console.warn('Invoice scan failed:', err)
+    } finally {
+        setTimeout(scanInvoices, Math.max(0, scanIntervalMs - (Date.now() - start)))
+    }
+}
+
+export function startInvoiceScanner() {
+    scanInvoices()
+}
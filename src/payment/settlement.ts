@@ -0,0 +1,91 @@
+import { Network, type SparkAddressFormat } from '@buildonspark/spark-sdk'
+import { getInvoiceStore, getLeaseStore, type InvoiceRecord } from '../db/store.js';
+import { workerClient } from '../worker/client.js';
+import type { IsOfferMetResult } from '../worker/types.js';
+import { instanceId } from '../utils.js';
+import { webhookDispatcher } from './webhooks.js';
+import { invoiceEvents } from './events.js';
+
+const invoices = getInvoiceStore();
+const leases = getLeaseStore();
+
+// Invoices currently being settled by this process; the watcher and the
+// reconciliation scan can both report the same payment.
+const settling = new Set<string>();
+
+/**
+ * Marks a paid invoice, notifies the merchant and sweeps its wallet. The
+ * settle lease keeps two replicas from sweeping the same invoice. Steps
+ * that fail are retried by retrySettlement() until they complete.
+ */
+export async function settleInvoice(invoice: InvoiceRecord, status: IsOfferMetResult) {
+    await withSettleLease(invoice.id, async () => {
+        if (!await invoices.markPaid(invoice.id, status.sending_address || null)) return
+        const paid = { ...invoice, sending_address: status.sending_address || null }
+        try {
+            await notifyPaid(paid)
+        } finally {
+            await sweepInvoice(paid)
+        }
+    })
+}
+
+/**
+ * Finishes settling a paid invoice whose webhook was not queued or whose
+ * sweep did not complete.
+ */
+export async function retrySettlement(invoiceId: string) {
+    await withSettleLease(invoiceId, async () => {
+        // Re-read under the lease: another attempt may have just finished.
+        const invoice = await invoices.getById(invoiceId)
+        if (!invoice?.paid) return
+        try {
+            if (!invoice.notified) await notifyPaid(invoice)
+        } finally {
+            if (!invoice.swept) await sweepInvoice(invoice)
+        }
+    })
+}
+
+async function withSettleLease(invoiceId: string, fn: () => Promise<void>) {
+    if (settling.has(invoiceId)) return
+    settling.add(invoiceId)
+    const leaseKey = `invoice-settle:${invoiceId}`
+    try {
+        if (!await leases.acquire(leaseKey, instanceId, 2 * 60 * 1000)) return
+        await fn()
+    } finally {
+        settling.delete(invoiceId)
+        await leases.release(leaseKey, instanceId).catch(() => {})
+    }
+}
+
+// The invoice stays listed by listUnsettled() until the webhook is queued.
+async function notifyPaid(invoice: InvoiceRecord) {
+    // Tell waiting checkout pages now rather than after the sweep. A failed
+    // publish must not hold up the webhook.
+    await invoiceEvents.publish({ invoice_id: invoice.id, paid: true, sending_address: invoice.sending_address })
+        .catch((err) => console.warn(`Failed to publish payment of invoice ${invoice.id}:`, err))
+    if (invoice.webhook_url) {
+        await webhookDispatcher.enqueue(invoice.webhook_url, JSON.stringify({
+            invoice_id: invoice.id,
+            paid: true,
+        }))
+    }
+    await invoices.markNotified(invoice.id)
+}
+
+// The invoice stays listed by listUnsettled() until this completes.
+async function sweepInvoice(invoice: InvoiceRecord) {
+    const sweep = await workerClient.transferAll({
+        mnemonic: invoice.mnemonic,
+        network: invoice.network as keyof typeof Network,
+        environment: 'prod',
+        receiverSparkAddress: invoice.sweep_address as SparkAddressFormat,
+    })
+    if (!sweep.complete) {
+        const errors = sweep.transfers.filter((t) => t.error).map((t) => `${t.tokenIdentifier ?? t.asset}: ${t.error!.message}`)
+        throw new Error(`Incomplete sweep of invoice ${invoice.id}: ${errors.join('; ') || 'timed out'}`)
+    }
+    await invoices.markSwept(invoice.id)
+}
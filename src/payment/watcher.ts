@@ -0,0 +1,131 @@
+import { Network } from '@buildonspark/spark-sdk'
+import { getInvoiceStore, getLeaseStore, type InvoiceRecord } from '../db/store.js';
+import { workerClient, workerPool } from '../worker/client.js';
+import type { WorkerEvent } from '../worker/types.js';
+import { instanceId } from '../utils.js';
+import { settleInvoice } from './settlement.js';
+
+const invoices = getInvoiceStore();
+const leases = getLeaseStore();
+
+// Watch leases are renewed on every scan pass; a replica that stops
+// scanning loses its watches to another one after this long.
+const watchLeaseMs = Number(process.env.INVOICE_SCAN_INTERVAL_MS ?? 5000) * 6
+
+type ActiveWatch = {
+    threadId: number
+    expiresAt: number
+}
+
+/**
+ * Holds a live subscription on each open invoice wallet and settles the
+ * invoice as soon as its worker reports an incoming transfer that meets an
+ * offer. Watches are capped at `maxWatches`; invoices beyond that are left
+ * to the reconciliation scan. Across replicas, each invoice is watched by
+ * whichever instance holds its watch lease.
+ */
+export class InvoiceWatcher {
+    private watches = new Map<string, ActiveWatch>()
+    private starting = new Set<string>()
+
+    constructor(private readonly maxWatches: number) {
+        workerPool.on('event', (event: WorkerEvent) => {
+            if (event.event !== 'offerMet' || !this.isWatching(event.watchId)) return
+            this.onOfferMet(event.watchId, event).catch((err) => {
+                console.warn(`Error while settling invoice ${event.watchId}:`, err)
+            })
+        })
+        workerPool.on('workerExit', (threadId: number) => {
+            // Subscriptions died with the worker; the next scan re-registers them.
+            for (const [invoiceId, watch] of this.watches) {
+                if (watch.threadId === threadId) this.watches.delete(invoiceId)
+            }
+        })
+    }
+
+    get enabled(): boolean {
+        return this.maxWatches > 0
+    }
+
+    isWatching(invoiceId: string): boolean {
+        return this.watches.has(invoiceId) || this.starting.has(invoiceId)
+    }
+
+    // Whether another replica holds the invoice's watch lease.
+    async isWatchedElsewhere(invoiceId: string): Promise<boolean> {
+        const holder = await leases.holder(`invoice-watch:${invoiceId}`)
+        return holder !== null && holder !== instanceId
+    }
+
+    hasCapacity(): boolean {
+        return this.watches.size + this.starting.size < this.maxWatches
+    }
+
+    async watch(invoice: InvoiceRecord): Promise<boolean> {
+        if (!this.enabled || this.isWatching(invoice.id) || !this.hasCapacity()) return false
+        this.starting.add(invoice.id)
+        try {
+            if (!await leases.acquire(`invoice-watch:${invoice.id}`, instanceId, watchLeaseMs)) return false
+            const { threadId, status } = await workerClient.watchOffer({
+                watchId: invoice.id,
+                mnemonic: invoice.mnemonic,
+                network: invoice.network as keyof typeof Network,
+                environment: 'prod',
+                offers: JSON.parse(invoice.offers_json),
+                since: invoice.created_at,
+                cursor: invoice.match_cursor ? JSON.parse(invoice.match_cursor) : undefined,
+            })
+            this.watches.set(invoice.id, { threadId, expiresAt: invoice.expires_at })
+            if (status.paid) {
+                await this.onOfferMet(invoice.id, { event: 'offerMet', watchId: invoice.id, result: status })
+            }
+            return true
+        } catch (err) {
+            if (this.watches.has(invoice.id)) {
+                // Settling failed after the worker-side watch was registered.
+                await this.unwatch(invoice.id).catch(() => {})
+            } else {
+                await leases.release(`invoice-watch:${invoice.id}`, instanceId).catch(() => {})
+            }
+            throw err
+        } finally {
+            this.starting.delete(invoice.id)
+        }
+    }
+
+    async unwatch(invoiceId: string): Promise<void> {
+        if (!this.watches.delete(invoiceId)) return
+        await leases.release(`invoice-watch:${invoiceId}`, instanceId)
+        await workerClient.unwatchOffer({ watchId: invoiceId })
+    }
+
+    /**
+     * Drops watches for invoices that expired, are no longer open, or whose
+     * lease was lost, and renews the lease on the rest.
+     */
+    async prune(nowMs: number, openIds: Set<string>): Promise<void> {
+        for (const [invoiceId, watch] of Array.from(this.watches)) {
+            const keep = watch.expiresAt > nowMs
+                && openIds.has(invoiceId)
+                && await leases.acquire(`invoice-watch:${invoiceId}`, instanceId, watchLeaseMs).catch(() => false)
+            if (!keep) {
+                await this.unwatch(invoiceId).catch(() => {})
+            }
+        }
+    }
+
+    private async onOfferMet(invoiceId: string, event: WorkerEvent) {
+        try {
+            const invoice = await invoices.getById(invoiceId)
+            if (invoice) {
+                console.log(`Invoice ${invoiceId} paid (push)`)
+                await settleInvoice(invoice, event.result)
+            }
+        } finally {
+            // An incomplete sweep is retried by the scanner, not the watch.
+            await this.unwatch(invoiceId)
+        }
+    }
+}
+
+export const invoiceWatcher = new InvoiceWatcher(Number(process.env.INVOICE_WATCH_MAX ?? 1000))
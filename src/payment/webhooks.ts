@@ -0,0 +1,179 @@
+import * as crypto from 'crypto';
+import * as http from 'node:http';
+import * as https from 'node:https';
+import { performance } from 'node:perf_hooks';
+import { getWebhookOutboxStore, type WebhookJob, type WebhookOutboxStore } from '../db/store.js';
+import { privateKey } from '../keys.js';
+import { increment, observe, registerGauge } from '../metrics.js';
+
+export type WebhookDispatcherOptions = {
+    concurrency: number
+    perHostConcurrency: number
+    timeoutMs: number
+    maxAttempts: number
+    baseBackoffMs: number
+    maxBackoffMs: number
+}
+
+const httpAgent = new http.Agent({ keepAlive: true })
+const httpsAgent = new https.Agent({ keepAlive: true })
+
+export function signWebhook(payload: string): string {
+    const sign = crypto.createSign('SHA256');
+    sign.update(payload);
+    sign.end();
+    return sign.sign(privateKey, 'base64');
+}
+
+function postJson(webhookURL: string, body: string, timeoutMs: number): Promise<number> {
+    const url = new URL(webhookURL)
+    const secure = url.protocol === 'https:'
+    const options: http.RequestOptions = {
+        method: 'POST',
+        agent: secure ? httpsAgent : httpAgent,
+        headers: {
+            'Content-Type': 'application/json',
+            'Content-Length': Buffer.byteLength(body),
+        },
+        timeout: timeoutMs,
+    }
+    return new Promise((resolve, reject) => {
+        const onResponse = (res: http.IncomingMessage) => {
+            // Drain the body so the socket can go back to the pool.
+            res.resume()
+            res.on('end', () => resolve(res.statusCode ?? 0))
+            res.on('error', reject)
+        }
+        const req = secure ? https.request(url, options, onResponse) : http.request(url, options, onResponse)
+        req.on('timeout', () => req.destroy(new Error(`Webhook timed out after ${timeoutMs}ms`)))
+        req.on('error', reject)
+        req.end(body)
+    })
+}
+
+/**
+ * Delivers queued webhooks outside the settlement path. Jobs are persisted
+ * in the outbox store before delivery and retried with exponential backoff
+ * and jitter; a slow receiver only ties up its own per-host slots.
+ */
+export class WebhookDispatcher {
+    private inFlight = 0
+    private perHost = new Map<string, number>()
+    private timer: NodeJS.Timeout | null = null
+    private polling = false
+
+    constructor(private readonly store: WebhookOutboxStore, private readonly options: WebhookDispatcherOptions) {}
+
+    async enqueue(webhookURL: string, payload: string): Promise<void> {
+        const now = Date.now()
+        await this.store.enqueue({
+            id: crypto.randomUUID(),
+            url: webhookURL,
+            payload,
+            attempts: 0,
+            created_at: now,
+            next_attempt_at: now,
+            last_error: null,
+        })
+        this.poll()
+    }
+
+    start() {
+        this.timer = setInterval(() => this.poll(), 1000)
+        this.timer.unref()
+        this.poll()
+    }
+
+    private poll() {
+        if (this.polling) return
+        this.polling = true
+        this.claimAndDeliver()
+            .catch((err) => console.warn('Webhook outbox poll failed:', err))
+            .finally(() => {
+                this.polling = false
+            })
+    }
+
+    private async claimAndDeliver() {
+        const capacity = this.options.concurrency - this.inFlight
+        if (capacity <= 0) return
+        const now = Date.now()
+        // Claimed jobs stay invisible to other pollers until the delivery
+        // attempt can no longer be running.
+        const jobs = await this.store.claimDue(now, capacity, this.options.timeoutMs * 2)
+        for (const job of jobs) {
+            let host: string
+            try {
+                host = new URL(job.url).host
+            } catch {
+                await this.store.deadLetter({ ...job, last_error: 'Invalid webhook URL' })
+                continue
+            }
+            const active = this.perHost.get(host) ?? 0
+            if (active >= this.options.perHostConcurrency) {
+                await this.store.reschedule({ ...job, next_attempt_at: now + 250 })
+                continue
+            }
+            this.perHost.set(host, active + 1)
+            this.inFlight++
+            this.deliver(job).finally(() => {
+                this.inFlight--
+                const remaining = (this.perHost.get(host) ?? 1) - 1
+                if (remaining > 0) this.perHost.set(host, remaining)
+                else this.perHost.delete(host)
+                this.poll()
+            })
+        }
+    }
+
+    private backoff(attempts: number): number {
+        const ceiling = Math.min(this.options.maxBackoffMs, this.options.baseBackoffMs * 2 ** (attempts - 1))
+        return ceiling / 2 + Math.random() * ceiling / 2
+    }
+
+    private async deliver(job: WebhookJob) {
+        const start = performance.now()
+        const attempts = job.attempts + 1
+        let error: string | null = null
+        try {
+            const body = JSON.stringify({ payload: job.payload, signature: signWebhook(job.payload) })
+            const status = await postJson(job.url, body, this.options.timeoutMs)
+            if (status < 200 || status >= 300) error = `HTTP ${status}`
+        } catch (err) {
+            error = err instanceof Error ? err.message : String(err)
+        }
+        observe('sparkproxy_webhook_attempt_duration_ms', { outcome: error ? 'failure' : 'success' }, performance.now() - start)
+        increment('sparkproxy_webhook_attempts_total', { outcome: error ? 'failure' : 'success' })
+
+        try {
+            if (!error) {
+                observe('sparkproxy_webhook_delivery_latency_ms', {}, Date.now() - job.created_at)
+                await this.store.complete(job.id)
+            } else if (attempts >= this.options.maxAttempts) {
+                console.warn(`Webhook ${job.id} to ${job.url} failed after ${attempts} attempts: ${error}`)
+                increment('sparkproxy_webhook_dead_letters_total', {})
+                await this.store.deadLetter({ ...job, attempts, last_error: error })
+            } else {
+                await this.store.reschedule({ ...job, attempts, last_error: error, next_attempt_at: Date.now() + this.backoff(attempts) })
+            }
+        } catch (err) {
+            // The claim expires and the job is retried by the next poll.
+            console.warn(`Failed to record webhook ${job.id} outcome:`, err)
+        }
+    }
+}
+
+export const webhookDispatcher = new WebhookDispatcher(getWebhookOutboxStore(), {
+    concurrency: Number(process.env.WEBHOOK_CONCURRENCY ?? 64),
+    perHostConcurrency: Number(process.env.WEBHOOK_HOST_CONCURRENCY ?? 4),
+    timeoutMs: Number(process.env.WEBHOOK_TIMEOUT_MS ?? 10000),
+    maxAttempts: Number(process.env.WEBHOOK_MAX_ATTEMPTS ?? 12),
+    baseBackoffMs: 1000,
+    maxBackoffMs: 60 * 60 * 1000,
+})
+
+webhookDispatcher.start()
+
+registerGauge('sparkproxy_webhook_outbox_size', 'Webhook deliveries waiting in the outbox', async () => [
+    { labels: {}, value: await getWebhookOutboxStore().size() },
+])
@@ -0,0 +1,217 @@
+import { BroadcastChannel, threadId } from 'node:worker_threads'
+import { randomUUID } from 'node:crypto'
+import type { AddressSummary, AddressTransaction, SparkScanApi } from '../sparkscan.js'
+import type {
+  BackendWallet,
+  InitializeOptions,
+  SparkBackend,
+  StaticDepositQuote,
+  TokenBalance,
+  WalletTransfer,
+} from '../worker/backend.js'
+import type { NetworkName } from '../worker/types.js'
+import { SIM_CHANNEL, createRandom, simAddress, simConfig } from './config.js'
+import { rateFor } from '../config.js'
+import type { LedgerMessage, LedgerMethod, SimTokenMetadata, SimTransfer, SimUtxo } from './ledger.js'
+
+type Listener = (...args: any[]) => void
+
+/**
+ * Talks to the main-thread SimulatedLedger, adding the configured latency
+ * and failure rate to every operation (SPARK_SIM_LATENCY_MS and
+ * SPARK_SIM_FAILURE_RATE, either a single value or "op=value" pairs).
+ */
+class LedgerClient {
+  private channel = new BroadcastChannel(SIM_CHANNEL)
+  private pending = new Map<string, { resolve: (value: any) => void; reject: (e: Error) => void }>()
+  private claimedListeners = new Map<string, Set<Listener>>()
+  // Each worker draws from its own seeded stream.
+  private random = createRandom(simConfig.seed * 7919 + threadId)
+
+  constructor() {
+    this.channel.unref()
+    this.channel.onmessage = (event: unknown) => this.onMessage((event as { data: LedgerMessage }).data)
+  }
+
+  private onMessage(message: LedgerMessage) {
+    if (message.type === 'reply') {
+      const call = this.pending.get(message.id)
+      if (!call) return
+      this.pending.delete(message.id)
+      if (message.error !== undefined) call.reject(new Error(message.error))
+      else call.resolve(message.result)
+    } else if (message.type === 'claimed') {
+      for (const listener of this.claimedListeners.get(message.address) ?? []) listener()
+    }
+  }
+
+  async simulate(op: string) {
+    const latency = rateFor(simConfig.latencyMs, op)
+    if (latency > 0) {
+      // Uniform in [latency / 2, latency * 1.5).
+      await new Promise((resolve) => setTimeout(resolve, latency * (0.5 + this.random())))
+    }
+    if (this.random() < rateFor(simConfig.failureRate, op)) {
+      throw new Error(`Simulated ${op} failure`)
+    }
+  }
+
+  async call<T>(op: string, method: LedgerMethod, ...args: unknown[]): Promise<T> {
+    await this.simulate(op)
+    const id = randomUUID()
+    return new Promise<T>((resolve, reject) => {
+      this.pending.set(id, { resolve, reject })
+      this.channel.postMessage({ type: 'call', id, method, args } satisfies LedgerMessage)
+    })
+  }
+
+  onClaimed(address: string, listener: Listener) {
+    const listeners = this.claimedListeners.get(address) ?? new Set()
+    listeners.add(listener)
+    this.claimedListeners.set(address, listeners)
+  }
+
+  offClaimed(address: string, listener: Listener) {
+    const listeners = this.claimedListeners.get(address)
+    if (!listeners) return
+    listeners.delete(listener)
+    if (listeners.size === 0) this.claimedListeners.delete(address)
+  }
+}
+
+class SimulatedWallet implements BackendWallet {
+  private listeners: Array<{ event: string; listener: Listener }> = []
+
+  constructor(
+    private readonly ledger: LedgerClient,
+    private readonly address: string,
+    private readonly identity: string,
+    private readonly network: NetworkName,
+  ) {}
+
+  async getSparkAddress(): Promise<string> {
+    return this.address
+  }
+
+  async getBalance() {
+    const { balance, tokens } = await this.ledger.call<{ balance: number; tokens: Array<[string, number, SimTokenMetadata]> }>(
+      'getBalance', 'balance', this.address,
+    )
+    const tokenBalances = new Map<string, TokenBalance>()
+    for (const [tokenIdentifier, amount, metadata] of tokens) {
+      tokenBalances.set(tokenIdentifier, {
+        availableToSendBalance: BigInt(amount),
+        tokenMetadata: { ...metadata, maxSupply: BigInt(metadata.maxSupply) },
+      })
+    }
+    return { balance: BigInt(balance), tokenBalances }
+  }
+
+  async getTransfers(limit: number, offset: number): Promise<{ transfers: WalletTransfer[] }> {
+    const transfers = await this.ledger.call<SimTransfer[]>('getTransfers', 'transfers', this.address, limit, offset)
+    return {
+      transfers: transfers.map((transfer) => ({
+        id: transfer.id,
+        transferDirection: transfer.direction,
+        // Lightning and faucet credits have no Spark sender.
+        senderIdentityPublicKey: transfer.counterparty ?? this.identity,
+        totalValue: transfer.amountSats,
+        createdTime: new Date(transfer.createdAt),
+      })),
+    }
+  }
+
+  transfer(args: { amountSats: number; receiverSparkAddress: string }) {
+    return this.ledger.call<{ id: string }>('transfer', 'transfer', this.address, args.receiverSparkAddress, args.amountSats)
+  }
+
+  async transferTokens(args: { tokenIdentifier: string; tokenAmount: bigint; receiverSparkAddress: string }) {
+    const { id } = await this.ledger.call<{ id: string }>(
+      'transferTokens', 'transferTokens', this.address, args.receiverSparkAddress, args.tokenIdentifier, Number(args.tokenAmount),
+    )
+    return id
+  }
+
+  payLightningInvoice(args: { invoice: string; maxFeeSats: number }) {
+    return this.ledger.call<{ id: string }>('payLightningInvoice', 'payInvoice', this.address, args.invoice, args.maxFeeSats)
+  }
+
+  async createLightningInvoice(args: { amountSats: number; memo?: string; expirySeconds?: number; receiverIdentityPubkey?: string }) {
+    const { invoice } = await this.ledger.call<{ invoice: string }>(
+      'createLightningInvoice', 'createInvoice',
+      args.receiverIdentityPubkey ?? this.identity, this.network, args.amountSats, args.expirySeconds ?? 60 * 60 * 24,
+    )
+    return { invoice: { encodedInvoice: invoice } }
+  }
+
+  getStaticDepositAddress() {
+    return this.ledger.call<string>('getStaticDepositAddress', 'depositAddress', this.address)
+  }
+
+  getUtxosForDepositAddress(depositAddress: string, _limit?: number, _offset?: number, excludeClaimed?: boolean) {
+    return this.ledger.call<SimUtxo[]>('getUtxosForDepositAddress', 'depositUtxos', depositAddress, excludeClaimed ?? false)
+  }
+
+  getClaimStaticDepositQuote(txHash: string, vout: number) {
+    return this.ledger.call<StaticDepositQuote>('getClaimStaticDepositQuote', 'claimQuote', this.address, txHash, vout)
+  }
+
+  claimStaticDeposit(args: { transactionId: string; creditAmountSats: number; sspSignature: string; outputIndex: number }) {
+    return this.ledger.call('claimStaticDeposit', 'claim', this.address, args.transactionId, args.outputIndex, args.creditAmountSats)
+  }
+
+  getWithdrawalFeeQuote(args: { amountSats: number; withdrawalAddress: string }) {
+    return this.ledger.call('getWithdrawalFeeQuote', 'withdrawalQuote', args.amountSats)
+  }
+
+  withdraw(args: { onchainAddress: string; amountSats: number; feeQuote: any; deductFeeFromWithdrawalAmount: boolean }) {
+    return this.ledger.call('withdraw', 'withdraw', this.address, args.amountSats, Number(args.feeQuote?.feeSats ?? 0), args.deductFeeFromWithdrawalAmount)
+  }
+
+  on(event: 'transfer:claimed' | 'stream:connected', listener: Listener) {
+    if (event === 'stream:connected') {
+      setTimeout(listener, 0)
+      return this
+    }
+    this.listeners.push({ event, listener })
+    this.ledger.onClaimed(this.address, listener)
+    return this
+  }
+
+  off(event: 'transfer:claimed' | 'stream:connected', listener: Listener) {
+    if (event === 'transfer:claimed') {
+      this.listeners = this.listeners.filter((l) => l.listener !== listener)
+      this.ledger.offClaimed(this.address, listener)
+    }
+    return this
+  }
+
+  async cleanupConnections() {
+    for (const { listener } of this.listeners) this.ledger.offClaimed(this.address, listener)
+    this.listeners = []
+  }
+}
+
+export class SimulatedBackend implements SparkBackend {
+  readonly name = 'simulated'
+  private ledger = new LedgerClient()
+
+  async initialize(options: InitializeOptions): Promise<{ mnemonic: string; wallet: BackendWallet }> {
+    const mnemonic = options.mnemonic
+      ?? (await this.ledger.call<{ mnemonic: string }>('initialize', 'createWallet', options.network)).mnemonic
+    const { address, identity } = await this.ledger.call<{ address: string; identity: string }>(
+      'loadWallet', 'openWallet', mnemonic, options.network,
+    )
+    return { mnemonic, wallet: new SimulatedWallet(this.ledger, address, identity, options.network) }
+  }
+
+  encodeSparkAddress(identityPublicKey: string, network: NetworkName): string {
+    return simAddress(identityPublicKey, network)
+  }
+
+  readonly sparkscan: SparkScanApi = {
+    addressSummary: (address) => this.ledger.call<AddressSummary>('sparkscan', 'addressSummary', address),
+    addressTransactions: (address, _network, limit, offset) =>
+      this.ledger.call<AddressTransaction[]>('sparkscan', 'addressTransactions', address, limit, offset),
+  }
+}
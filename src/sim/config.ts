@@ -0,0 +1,50 @@
+import * as crypto from 'crypto'
+import { parseRates } from '../config.js'
+import type { NetworkName } from '../worker/types.js'
+
+export const SIM_CHANNEL = 'sparkproxy-sim'
+
+export const simConfig = {
+  seed: Number(process.env.SPARK_SIM_SEED ?? 1),
+  latencyMs: parseRates(process.env.SPARK_SIM_LATENCY_MS, 0, 'SPARK_SIM_LATENCY_MS'),
+  failureRate: parseRates(process.env.SPARK_SIM_FAILURE_RATE, 0, 'SPARK_SIM_FAILURE_RATE'),
+  initialBalanceSats: Number(process.env.SPARK_SIM_INITIAL_BALANCE_SATS ?? 0),
+}
+
+/**
+ * mulberry32: small, fast and good enough for reproducible latency and
+ * failure draws. Returns floats in [0, 1).
+ */
+export function createRandom(seed: number): () => number {
+  let state = seed >>> 0
+  return () => {
+    state = (state + 0x6d2b79f5) >>> 0
+    let t = state
+    t = Math.imul(t ^ (t >>> 15), t | 1)
+    t ^= t + Math.imul(t ^ (t >>> 7), t | 61)
+    return ((t ^ (t >>> 14)) >>> 0) / 4294967296
+  }
+}
+
+export function identityFor(mnemonic: string): string {
+  return '02' + crypto.createHash('sha256').update(mnemonic).digest('hex')
+}
+
+export function simAddress(identityPublicKey: string, network: NetworkName): string {
+  return `${network === 'MAINNET' ? 'sp' : 'sprt'}1sim${identityPublicKey}`
+}
+
+export function identityFromAddress(address: string): string | null {
+  const match = /^(?:sp|sprt)1sim([0-9a-f]{66})$/.exec(address)
+  return match ? match[1] : null
+}
+
+/**
+ * Amount in sats encoded in a BOLT11 human-readable part, e.g. lnbc250n1...
+ */
+export function bolt11AmountSats(invoice: string): number | null {
+  const match = /^ln(?:bcrt|bc|tbs|tb)(\d+)([munp]?)1/.exec(invoice.toLowerCase())
+  if (!match) return null
+  const multipliers: Record<string, number> = { '': 1e8, m: 1e5, u: 100, n: 0.1, p: 0.0001 }
+  return Math.floor(Number(match[1]) * multipliers[match[2]])
+}
@@ -0,0 +1,415 @@
+import { BroadcastChannel } from 'node:worker_threads'
+import type { AddressSummary, AddressTransaction, SparkScanApi } from '../sparkscan.js'
+import type { NetworkName } from '../worker/types.js'
+import {
+  SIM_CHANNEL,
+  bolt11AmountSats,
+  createRandom,
+  identityFor,
+  identityFromAddress,
+  simAddress,
+  simConfig,
+} from './config.js'
+
+export type SimTransfer = {
+  id: string
+  kind: 'spark_transfer' | 'token_transfer' | 'lightning_payment' | 'bitcoin_deposit' | 'bitcoin_withdrawal'
+  direction: 'INCOMING' | 'OUTGOING'
+  counterparty: string | null
+  amountSats: number
+  tokenIdentifier?: string
+  createdAt: number
+}
+
+export type SimUtxo = {
+  txHash: string
+  vout: number
+  amountSats: number
+  confirmations: number
+  claimed: boolean
+}
+
+export type SimTokenMetadata = {
+  tokenPublicKey: string
+  tokenName: string
+  tokenTicker: string
+  decimals: number
+  maxSupply: number
+}
+
+type Account = {
+  address: string
+  identity: string
+  network: NetworkName
+  balance: number
+  tokens: Map<string, number>
+  // Newest first, like getTransfers.
+  transfers: SimTransfer[]
+  depositAddress: string
+}
+
+type SimInvoice = {
+  receiver: string
+  amountSats: number
+  expiresAt: number
+  paid: boolean
+}
+
+// Not a real BIP-39 mnemonic; the simulator only needs it to be unique.
+const WORDS = [
+  'abandon', 'bridge', 'coral', 'delta', 'echo', 'fabric', 'glance', 'harbor',
+  'island', 'jungle', 'kettle', 'lemon', 'mobile', 'noble', 'orbit', 'pledge',
+  'quantum', 'rocket', 'slice', 'timber', 'unfold', 'velvet', 'walnut', 'yellow',
+]
+
+const LIGHTNING_FEE_PPM = 5000
+
+export type LedgerMethod = Exclude<keyof SimulatedLedger, 'sparkscan' | 'stats' | 'onClaimed'>
+
+/**
+ * In-memory stand-in for the Spark network and SparkScan. It lives in the
+ * main thread so that every worker sees the same balances; workers reach it
+ * over a BroadcastChannel (see serveSimulatedLedger).
+ */
+export class SimulatedLedger {
+  private accounts = new Map<string, Account>()
+  private depositAddresses = new Map<string, Account>()
+  private utxos = new Map<string, SimUtxo[]>()
+  private invoices = new Map<string, SimInvoice>()
+  private tokenMetadata = new Map<string, SimTokenMetadata>()
+  private random = createRandom(simConfig.seed)
+  private listeners = new Set<(address: string) => void>()
+
+  private randomHex(bytes: number): string {
+    let out = ''
+    for (let i = 0; i < bytes; i++) out += Math.floor(this.random() * 256).toString(16).padStart(2, '0')
+    return out
+  }
+
+  onClaimed(listener: (address: string) => void) {
+    this.listeners.add(listener)
+  }
+
+  private credited(address: string) {
+    for (const listener of this.listeners) listener(address)
+  }
+
+  private account(address: string): Account {
+    const account = this.accounts.get(address)
+    if (!account) throw new Error(`Unknown Spark address: ${address}`)
+    return account
+  }
+
+  private ensureAccount(identity: string, network: NetworkName): Account {
+    const address = simAddress(identity, network)
+    let account = this.accounts.get(address)
+    if (!account) {
+      account = {
+        address,
+        identity,
+        network,
+        balance: simConfig.initialBalanceSats,
+        tokens: new Map(),
+        transfers: [],
+        depositAddress: `${network === 'MAINNET' ? 'bc1q' : 'bcrt1q'}sim${identity.slice(2, 42)}`,
+      }
+      this.accounts.set(address, account)
+      this.depositAddresses.set(account.depositAddress, account)
+    }
+    return account
+  }
+
+  private record(account: Account, transfer: Omit<SimTransfer, 'createdAt'>) {
+    account.transfers.unshift({ ...transfer, createdAt: Date.now() })
+  }
+
+  createWallet(network: NetworkName): { mnemonic: string; address: string } {
+    let mnemonic: string
+    do {
+      mnemonic = Array.from({ length: 12 }, () => WORDS[Math.floor(this.random() * WORDS.length)]).join(' ')
+    } while (this.accounts.has(simAddress(identityFor(mnemonic), network)))
+    return { mnemonic, address: this.ensureAccount(identityFor(mnemonic), network).address }
+  }
+
+  openWallet(mnemonic: string, network: NetworkName): { address: string; identity: string } {
+    const account = this.ensureAccount(identityFor(mnemonic), network)
+    return { address: account.address, identity: account.identity }
+  }
+
+  balance(address: string): { balance: number; tokens: Array<[string, number, SimTokenMetadata]> } {
+    const account = this.account(address)
+    return {
+      balance: account.balance,
+      tokens: Array.from(account.tokens.entries()).map(([id, amount]) => [id, amount, this.token(id)]),
+    }
+  }
+
+  // Like the SDK, the transfer list only covers sats; tokens show up in SparkScan.
+  transfers(address: string, limit: number, offset: number): SimTransfer[] {
+    return this.account(address).transfers.filter((t) => t.kind !== 'token_transfer').slice(offset, offset + limit)
+  }
+
+  transfer(address: string, receiverSparkAddress: string, amountSats: number): { id: string } {
+    const sender = this.account(address)
+    const identity = identityFromAddress(receiverSparkAddress)
+    if (!identity) throw new Error(`Invalid Spark address: ${receiverSparkAddress}`)
+    if (!Number.isInteger(amountSats) || amountSats <= 0) throw new Error('Amount must be a positive integer')
+    if (sender.balance < amountSats) throw new Error(`Insufficient balance: ${sender.balance} < ${amountSats}`)
+    const receiver = this.ensureAccount(identity, sender.network)
+    const id = this.randomHex(16)
+    sender.balance -= amountSats
+    receiver.balance += amountSats
+    this.record(sender, { id, kind: 'spark_transfer', direction: 'OUTGOING', counterparty: receiver.identity, amountSats })
+    this.record(receiver, { id, kind: 'spark_transfer', direction: 'INCOMING', counterparty: sender.identity, amountSats })
+    this.credited(receiver.address)
+    return { id }
+  }
+
+  transferTokens(address: string, receiverSparkAddress: string, tokenIdentifier: string, amount: number): { id: string } {
+    const sender = this.account(address)
+    const identity = identityFromAddress(receiverSparkAddress)
+    if (!identity) throw new Error(`Invalid Spark address: ${receiverSparkAddress}`)
+    const held = sender.tokens.get(tokenIdentifier) ?? 0
+    if (amount <= 0 || held < amount) throw new Error(`Insufficient token balance: ${held} < ${amount}`)
+    const receiver = this.ensureAccount(identity, sender.network)
+    const id = this.randomHex(32)
+    sender.tokens.set(tokenIdentifier, held - amount)
+    if (held - amount === 0) sender.tokens.delete(tokenIdentifier)
+    receiver.tokens.set(tokenIdentifier, (receiver.tokens.get(tokenIdentifier) ?? 0) + amount)
+    const transfer = { id, kind: 'token_transfer' as const, amountSats: amount, tokenIdentifier }
+    this.record(sender, { ...transfer, direction: 'OUTGOING', counterparty: receiver.identity })
+    this.record(receiver, { ...transfer, direction: 'INCOMING', counterparty: sender.identity })
+    // Like the real SDK, token receipts do not raise transfer:claimed.
+    return { id }
+  }
+
+  createInvoice(receiverIdentity: string, network: NetworkName, amountSats: number, expirySeconds: number): { invoice: string } {
+    const receiver = this.ensureAccount(receiverIdentity, network)
+    const prefix = network === 'MAINNET' ? 'lnbc' : 'lnbcrt'
+    const invoice = `${prefix}${amountSats * 10}n1sim${this.randomHex(32)}`
+    this.invoices.set(invoice, {
+      receiver: receiver.address,
+      amountSats,
+      expiresAt: Date.now() + expirySeconds * 1000,
+      paid: false,
+    })
+    return { invoice }
+  }
+
+  payInvoice(address: string, invoice: string, maxFeeSats: number): { id: string } {
+    const payer = this.account(address)
+    const internal = this.invoices.get(invoice)
+    const amountSats = internal?.amountSats ?? bolt11AmountSats(invoice)
+    if (!amountSats) throw new Error('Invoice has no amount')
+    // Invoices issued by the simulator settle internally; anything else is
+    // treated as an external payment routed through the SSP.
+    const feeSats = internal ? 0 : Math.ceil(amountSats * LIGHTNING_FEE_PPM / 1e6)
+    if (feeSats > maxFeeSats) throw new Error(`Fee ${feeSats} exceeds maxFeeSats ${maxFeeSats}`)
+    if (internal) this.checkPayable(internal)
+    if (payer.balance < amountSats + feeSats) throw new Error(`Insufficient balance: ${payer.balance} < ${amountSats + feeSats}`)
+
+    const id = this.randomHex(16)
+    payer.balance -= amountSats + feeSats
+    this.record(payer, { id, kind: 'lightning_payment', direction: 'OUTGOING', counterparty: null, amountSats: amountSats + feeSats })
+    if (internal) this.settleInvoice(internal, id, payer.identity)
+    return { id }
+  }
+
+  /**
+   * An external Lightning wallet pays an invoice issued by the simulator.
+   */
+  payInvoiceExternally(invoice: string): { id: string } {
+    const internal = this.invoices.get(invoice)
+    if (!internal) throw new Error('Unknown invoice')
+    this.checkPayable(internal)
+    const id = this.randomHex(16)
+    this.settleInvoice(internal, id, null)
+    return { id }
+  }
+
+  private checkPayable(invoice: SimInvoice) {
+    if (invoice.paid) throw new Error('Invoice already paid')
+    if (invoice.expiresAt < Date.now()) throw new Error('Invoice expired')
+  }
+
+  private settleInvoice(invoice: SimInvoice, id: string, payerIdentity: string | null) {
+    const receiver = this.account(invoice.receiver)
+    invoice.paid = true
+    receiver.balance += invoice.amountSats
+    this.record(receiver, { id, kind: 'lightning_payment', direction: 'INCOMING', counterparty: payerIdentity, amountSats: invoice.amountSats })
+    this.credited(receiver.address)
+  }
+
+  depositAddress(address: string): string {
+    return this.account(address).depositAddress
+  }
+
+  deposit(depositAddress: string, amountSats: number): SimUtxo {
+    if (!this.depositAddresses.has(depositAddress)) throw new Error(`Unknown deposit address: ${depositAddress}`)
+    const utxo: SimUtxo = { txHash: this.randomHex(32), vout: 0, amountSats, confirmations: 3, claimed: false }
+    const list = this.utxos.get(depositAddress) ?? []
+    list.push(utxo)
+    this.utxos.set(depositAddress, list)
+    return utxo
+  }
+
+  depositUtxos(depositAddress: string, excludeClaimed: boolean): SimUtxo[] {
+    return (this.utxos.get(depositAddress) ?? []).filter((utxo) => !excludeClaimed || !utxo.claimed)
+  }
+
+  private findUtxo(address: string, txHash: string, vout: number): SimUtxo {
+    const utxo = this.depositUtxos(this.account(address).depositAddress, false)
+      .find((u) => u.txHash === txHash && u.vout === vout)
+    if (!utxo) throw new Error(`Deposit ${txHash}:${vout} not found`)
+    if (utxo.claimed) throw new Error(`Deposit ${txHash}:${vout} already claimed`)
+    return utxo
+  }
+
+  claimQuote(address: string, txHash: string, vout: number) {
+    const utxo = this.findUtxo(address, txHash, vout)
+    const feeSats = Math.min(utxo.amountSats, 500)
+    return {
+      transactionId: txHash,
+      outputIndex: vout,
+      depositAmountSats: utxo.amountSats,
+      feeSats,
+      creditAmountSats: utxo.amountSats - feeSats,
+      signature: this.randomHex(64),
+    }
+  }
+
+  claim(address: string, txHash: string, vout: number, creditAmountSats: number): { ok: true } {
+    const account = this.account(address)
+    const utxo = this.findUtxo(address, txHash, vout)
+    utxo.claimed = true
+    account.balance += creditAmountSats
+    this.record(account, { id: txHash, kind: 'bitcoin_deposit', direction: 'INCOMING', counterparty: null, amountSats: creditAmountSats })
+    this.credited(account.address)
+    return { ok: true }
+  }
+
+  withdrawalQuote(amountSats: number): { feeSats: number } {
+    return { feeSats: Math.max(200, Math.ceil(amountSats * 0.002)) }
+  }
+
+  withdraw(address: string, amountSats: number, feeSats: number, deductFee: boolean): { id: string; status: string } {
+    const account = this.account(address)
+    const debit = deductFee ? amountSats : amountSats + feeSats
+    if (deductFee && amountSats <= feeSats) throw new Error('Amount does not cover the withdrawal fee')
+    if (account.balance < debit) throw new Error(`Insufficient balance: ${account.balance} < ${debit}`)
+    const id = this.randomHex(16)
+    account.balance -= debit
+    this.record(account, { id, kind: 'bitcoin_withdrawal', direction: 'OUTGOING', counterparty: null, amountSats: debit })
+    return { id, status: 'pending' }
+  }
+
+  /**
+   * Credits sats and/or tokens out of thin air, for funding test wallets.
+   */
+  faucet(address: string, amountSats: number, tokenIdentifier?: string, tokenAmount?: number): { id: string } {
+    const identity = identityFromAddress(address)
+    if (!identity) throw new Error(`Invalid Spark address: ${address}`)
+    const account = this.ensureAccount(identity, address.startsWith('sprt') ? 'REGTEST' : 'MAINNET')
+    const id = this.randomHex(16)
+    if (amountSats > 0) {
+      account.balance += amountSats
+      this.record(account, { id, kind: 'spark_transfer', direction: 'INCOMING', counterparty: null, amountSats })
+    }
+    if (tokenIdentifier && tokenAmount) {
+      account.tokens.set(tokenIdentifier, (account.tokens.get(tokenIdentifier) ?? 0) + tokenAmount)
+      this.record(account, { id, kind: 'token_transfer', direction: 'INCOMING', counterparty: null, amountSats: tokenAmount, tokenIdentifier })
+    }
+    if (amountSats > 0) this.credited(account.address)
+    return { id }
+  }
+
+  private token(tokenIdentifier: string): SimTokenMetadata {
+    let metadata = this.tokenMetadata.get(tokenIdentifier)
+    if (!metadata) {
+      metadata = {
+        tokenPublicKey: identityFor(tokenIdentifier),
+        tokenName: `Simulated ${tokenIdentifier.slice(-6)}`,
+        tokenTicker: 'SIM',
+        decimals: 0,
+        maxSupply: 0,
+      }
+      this.tokenMetadata.set(tokenIdentifier, metadata)
+    }
+    return metadata
+  }
+
+  addressSummary(address: string): AddressSummary {
+    return { transactionCount: this.accounts.get(address)?.transfers.length ?? 0 }
+  }
+
+  addressTransactions(address: string, limit: number, offset: number): AddressTransaction[] {
+    const account = this.accounts.get(address)
+    if (!account) return []
+    return account.transfers.slice(offset, offset + limit).map((transfer) => ({
+      id: transfer.id,
+      type: transfer.kind,
+      direction: transfer.direction === 'INCOMING' ? 'incoming' : 'outgoing',
+      createdAt: new Date(transfer.createdAt).toISOString(),
+      ...(transfer.tokenIdentifier
+        ? { tokenAmount: transfer.amountSats, tokenMetadata: { tokenIdentifier: transfer.tokenIdentifier } }
+        : { amountSats: transfer.amountSats }),
+      ...(transfer.counterparty
+        ? { counterparty: { type: 'spark', identifier: simAddress(transfer.counterparty, account.network) } }
+        : {}),
+    }))
+  }
+
+  readonly sparkscan: SparkScanApi = {
+    addressSummary: async (address) => this.addressSummary(address),
+    addressTransactions: async (address, _network, limit, offset) => this.addressTransactions(address, limit, offset),
+  }
+
+  stats() {
+    let balance = 0
+    for (const account of this.accounts.values()) balance += account.balance
+    return {
+      accounts: this.accounts.size,
+      invoices: this.invoices.size,
+      deposits: Array.from(this.utxos.values()).reduce((n, list) => n + list.length, 0),
+      totalBalanceSats: balance,
+    }
+  }
+}
+
+export type LedgerRequest = { type: 'call'; id: string; method: LedgerMethod; args: unknown[] }
+export type LedgerMessage =
+  | LedgerRequest
+  | { type: 'reply'; id: string; result?: unknown; error?: string }
+  | { type: 'claimed'; address: string }
+
+let ledger: SimulatedLedger | null = null
+
+/**
+ * The process-wide ledger. The first call (from the main thread) also
+ * starts answering worker requests on the simulator channel.
+ */
+export function getSimulatedLedger(): SimulatedLedger {
+  if (!ledger) {
+    ledger = new SimulatedLedger()
+    serveSimulatedLedger(ledger)
+  }
+  return ledger
+}
+
+function serveSimulatedLedger(target: SimulatedLedger) {
+  const channel = new BroadcastChannel(SIM_CHANNEL)
+  channel.unref()
+  target.onClaimed((address) => channel.postMessage({ type: 'claimed', address } satisfies LedgerMessage))
+  channel.onmessage = (event: unknown) => {
+    const message = (event as { data: LedgerMessage }).data
+    if (message.type !== 'call') return
+    let reply: LedgerMessage
+    try {
+      const method = target[message.method] as (...args: unknown[]) => unknown
+      reply = { type: 'reply', id: message.id, result: method.apply(target, message.args) }
+    } catch (e) {
+      reply = { type: 'reply', id: message.id, error: e instanceof Error ? e.message : String(e) }
+    }
+    channel.postMessage(reply)
+  }
+}
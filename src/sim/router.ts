@@ -0,0 +1,44 @@
+import { OpenAPIHono } from '@hono/zod-openapi'
+import { unknownErrorToJson } from '../utils.js'
+import { getSimulatedLedger } from './ledger.js'
+
+/**
+ * Test-only controls for the simulated backend, mounted at /sim when
+ * SPARK_BACKEND=simulated. Deliberately left out of the OpenAPI document.
+ */
+export const app = new OpenAPIHono()
+
+app.post('/faucet', async (c) => {
+  const body = await c.req.json().catch(() => ({}))
+  try {
+    const result = getSimulatedLedger().faucet(
+      String(body.address ?? ''),
+      Number(body.amountSats ?? 0),
+      body.tokenIdentifier ? String(body.tokenIdentifier) : undefined,
+      body.tokenAmount ? Number(body.tokenAmount) : undefined,
+    )
+    return c.json(result, 200)
+  } catch (err: unknown) {
+    return c.json({ error: unknownErrorToJson(err) }, 400)
+  }
+})
+
+app.post('/deposit', async (c) => {
+  const body = await c.req.json().catch(() => ({}))
+  try {
+    return c.json(getSimulatedLedger().deposit(String(body.depositAddress ?? ''), Number(body.amountSats ?? 0)), 200)
+  } catch (err: unknown) {
+    return c.json({ error: unknownErrorToJson(err) }, 400)
+  }
+})
+
+app.post('/lightning/pay', async (c) => {
+  const body = await c.req.json().catch(() => ({}))
+  try {
+    return c.json(getSimulatedLedger().payInvoiceExternally(String(body.invoice ?? '')), 200)
+  } catch (err: unknown) {
+    return c.json({ error: unknownErrorToJson(err) }, 400)
+  }
+})
+
+app.get('/state', (c) => c.json(getSimulatedLedger().stats(), 200))
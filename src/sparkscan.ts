@@ -0,0 +1,305 @@
+import { BroadcastChannel } from 'node:worker_threads'
+import { randomUUID } from 'node:crypto'
+import { performance } from 'node:perf_hooks'
+import type { NetworkName } from './worker/types.js'
+import { sparkBackendName } from './worker/backend.js'
+import { increment, observe } from './metrics.js'
+
+export type AddressSummary = {
+  transactionCount?: number
+}
+
+// Newest first.
+export type AddressTransaction = {
+  id?: string
+  type: string
+  direction: string
+  createdAt?: string
+  tokenAmount?: number | string
+  tokenMetadata?: { tokenIdentifier: string }
+  counterparty?: { identifier: string }
+  [key: string]: unknown
+}
+
+/**
+ * The subset of the SparkScan API used to detect incoming payments. The
+ * simulated backend provides its own implementation backed by its ledger.
+ */
+export interface SparkScanApi {
+  // Resolves to null when the lookup failed; callers retry on their next pass.
+  addressSummary(address: string, network: NetworkName): Promise<AddressSummary | null>
+  addressTransactions(address: string, network: NetworkName, limit: number, offset: number): Promise<AddressTransaction[]>
+}
+
+export class SparkScanError extends Error {
+  constructor(readonly status: number, path: string) {
+    super(`SparkScan request failed: ${status} ${path}`)
+    this.name = 'SparkScanError'
+  }
+}
+
+function parseRetryAfterMs(value: string | null): number | null {
+  if (!value) return null
+  const seconds = Number(value)
+  if (Number.isFinite(seconds)) return Math.max(0, seconds * 1000)
+  const date = Date.parse(value)
+  return Number.isNaN(date) ? null : Math.max(0, date - Date.now())
+}
+
+/**
+ * Allows `rate` requests per second in bursts of up to `burst`, serving
+ * waiters in arrival order. pauseFor() holds everyone back, e.g. for the
+ * Retry-After of a 429. A rate of 0 disables the limit.
+ */
+export class TokenBucket {
+  private tokens: number
+  private updatedAt = Date.now()
+  private pausedUntil = 0
+  private queue: Promise<void> = Promise.resolve()
+
+  constructor(private readonly rate: number, private readonly burst: number) {
+    this.tokens = burst
+  }
+
+  // Resolves once the caller may proceed, with how long it waited.
+  async take(): Promise<number> {
+    if (this.rate <= 0 && this.pausedUntil <= Date.now()) return 0
+    const start = Date.now()
+    const turn = this.queue.then(() => this.waitForToken())
+    this.queue = turn
+    await turn
+    return Date.now() - start
+  }
+
+  pauseFor(ms: number) {
+    this.pausedUntil = Math.max(this.pausedUntil, Date.now() + ms)
+    this.tokens = 0
+  }
+
+  private async waitForToken() {
+    for (;;) {
+      const now = Date.now()
+      if (this.rate > 0) {
+        this.tokens = Math.min(this.burst, this.tokens + ((now - this.updatedAt) / 1000) * this.rate)
+      }
+      this.updatedAt = now
+      const refillMs = this.rate <= 0 || this.tokens >= 1 ? 0 : ((1 - this.tokens) / this.rate) * 1000
+      const waitMs = Math.max(this.pausedUntil - now, refillMs)
+      if (waitMs <= 0) {
+        if (this.rate > 0) this.tokens -= 1
+        return
+      }
+      await new Promise((resolve) => setTimeout(resolve, waitMs))
+    }
+  }
+}
+
+export type HttpSparkScanOptions = {
+  apiKey?: string
+  cacheTtlMs: number
+  ratePerSecond: number
+  burst: number
+  maxAttempts: number
+}
+
+/**
+ * SparkScan over HTTP. Identical requests in flight share one fetch,
+ * responses are cached for `cacheTtlMs`, and every fetch waits for the
+ * token bucket. 429 and 503 replies pause the bucket for their Retry-After
+ * (or an exponential backoff) and are retried up to `maxAttempts` times.
+ *
+ * SparkScan has no multi-address lookup, so a scan cycle's requests are
+ * shared through the cache rather than batched.
+ */
+export class HttpSparkScan implements SparkScanApi {
+  private cache = new Map<string, { expiresAt: number; value: unknown }>()
+  private inFlight = new Map<string, Promise<unknown>>()
+  private bucket: TokenBucket
+
+  constructor(private readonly baseUrl: string, private readonly options: HttpSparkScanOptions) {
+    this.bucket = new TokenBucket(options.ratePerSecond, options.burst)
+  }
+
+  private headers(): Record<string, string> {
+    const headers: Record<string, string> = { accept: 'application/json' }
+    if (this.options.apiKey) headers['Authorization'] = `Bearer ${this.options.apiKey}`
+    return headers
+  }
+
+  async addressSummary(address: string, network: NetworkName): Promise<AddressSummary | null> {
+    try {
+      return await this.get('address', `/v1/address/${address}?network=${network}`, (data: any) => {
+        if (!data) return null
+        return typeof data.transactionCount === 'number' ? { transactionCount: data.transactionCount } : {}
+      })
+    } catch (err) {
+      console.warn(`SparkScan lookup failed for ${address}:`, err instanceof Error ? err.message : err)
+      return null
+    }
+  }
+
+  addressTransactions(address: string, network: NetworkName, limit: number, offset: number): Promise<AddressTransaction[]> {
+    return this.get(
+      'transactions',
+      `/v1/address/${address}/transactions?network=${network}&limit=${limit}&offset=${offset}`,
+      (data: any) => (data?.data ?? []) as AddressTransaction[],
+    )
+  }
+
+  private get<T>(endpoint: string, path: string, parse: (data: unknown) => T): Promise<T> {
+    const cached = this.cache.get(path)
+    if (cached && cached.expiresAt > Date.now()) {
+      increment('sparkproxy_sparkscan_lookups_total', { endpoint, result: 'cached' })
+      return Promise.resolve(cached.value as T)
+    }
+    const pending = this.inFlight.get(path)
+    if (pending) {
+      increment('sparkproxy_sparkscan_lookups_total', { endpoint, result: 'coalesced' })
+      return pending as Promise<T>
+    }
+    increment('sparkproxy_sparkscan_lookups_total', { endpoint, result: 'fetched' })
+    const request = this.fetchJson(endpoint, path)
+      .then((data) => {
+        const value = parse(data)
+        if (this.options.cacheTtlMs > 0) this.remember(path, value)
+        return value
+      })
+      .finally(() => this.inFlight.delete(path))
+    this.inFlight.set(path, request)
+    return request
+  }
+
+  private remember(path: string, value: unknown) {
+    const now = Date.now()
+    if (this.cache.size >= 10000) {
+      for (const [key, entry] of this.cache) {
+        if (entry.expiresAt <= now) this.cache.delete(key)
+      }
+    }
+    this.cache.set(path, { expiresAt: now + this.options.cacheTtlMs, value })
+  }
+
+  private async fetchJson(endpoint: string, path: string): Promise<unknown> {
+    for (let attempt = 1; ; attempt++) {
+      observe('sparkproxy_sparkscan_throttle_wait_ms', { endpoint }, await this.bucket.take())
+      const start = performance.now()
+      const resp = await fetch(`${this.baseUrl}${path}`, { headers: this.headers() })
+      observe('sparkproxy_sparkscan_request_duration_ms', { endpoint }, performance.now() - start)
+      increment('sparkproxy_sparkscan_requests_total', { endpoint, status: String(resp.status) })
+      if ((resp.status === 429 || resp.status === 503) && attempt < this.options.maxAttempts) {
+        await resp.body?.cancel()
+        this.bucket.pauseFor(parseRetryAfterMs(resp.headers.get('retry-after')) ?? 1000 * 2 ** (attempt - 1))
+        continue
+      }
+      if (!resp.ok) {
+        await resp.body?.cancel()
+        throw new SparkScanError(resp.status, path)
+      }
+      return resp.json()
+    }
+  }
+}
+
+export function createHttpSparkScan(): HttpSparkScan {
+  const ratePerSecond = Number(process.env.SPARKSCAN_RATE_LIMIT ?? 10)
+  return new HttpSparkScan((process.env.SPARKSCAN_API_URL ?? 'https://api.sparkscan.io').replace(/\/+$/, ''), {
+    apiKey: process.env.SPARKSCAN_API_KEY,
+    cacheTtlMs: Number(process.env.SPARKSCAN_CACHE_TTL_MS ?? 2000),
+    ratePerSecond,
+    burst: Number(process.env.SPARKSCAN_BURST ?? Math.max(1, ratePerSecond)),
+    maxAttempts: 4,
+  })
+}
+
+const SPARKSCAN_CHANNEL = 'sparkproxy-sparkscan'
+
+type SparkScanMessage =
+  | { type: 'call'; id: string; method: keyof SparkScanApi; args: unknown[] }
+  | { type: 'reply'; id: string; result?: unknown; error?: string }
+
+function serveSparkScan(target: SparkScanApi) {
+  const channel = new BroadcastChannel(SPARKSCAN_CHANNEL)
+  channel.unref()
+  channel.onmessage = async (event: unknown) => {
+    const message = (event as { data: SparkScanMessage }).data
+    if (message.type !== 'call') return
+    let reply: SparkScanMessage
+    try {
+      const method = target[message.method] as (...args: unknown[]) => Promise<unknown>
+      reply = { type: 'reply', id: message.id, result: await method.apply(target, message.args) }
+    } catch (e) {
+      reply = { type: 'reply', id: message.id, error: e instanceof Error ? e.message : String(e) }
+    }
+    channel.postMessage(reply)
+  }
+}
+
+/**
+ * Used by workers: forwards lookups to the main thread's client so that the
+ * cache, coalescing and rate limit are shared by the whole process.
+ */
+export class ChannelSparkScan implements SparkScanApi {
+  private channel = new BroadcastChannel(SPARKSCAN_CHANNEL)
+  private pending = new Map<string, { resolve: (value: any) => void; reject: (e: Error) => void }>()
+
+  constructor(private readonly timeoutMs = 60000) {
+    this.channel.unref()
+    this.channel.onmessage = (event: unknown) => {
+      const message = (event as { data: SparkScanMessage }).data
+      if (message.type !== 'reply') return
+      const call = this.pending.get(message.id)
+      if (!call) return
+      this.pending.delete(message.id)
+      if (message.error !== undefined) call.reject(new Error(message.error))
+      else call.resolve(message.result)
+    }
+  }
+
+  private call<T>(method: keyof SparkScanApi, args: unknown[]): Promise<T> {
+    const id = randomUUID()
+    return new Promise<T>((resolve, reject) => {
+      const timer = setTimeout(() => {
+        this.pending.delete(id)
+        reject(new Error(`SparkScan ${method} timed out`))
+      }, this.timeoutMs)
+      this.pending.set(id, {
+        resolve: (value) => { clearTimeout(timer); resolve(value) },
+        reject: (e) => { clearTimeout(timer); reject(e) },
+      })
+      this.channel.postMessage({ type: 'call', id, method, args } satisfies SparkScanMessage)
+    })
+  }
+
+  addressSummary(address: string, network: NetworkName): Promise<AddressSummary | null> {
+    return this.call<AddressSummary | null>('addressSummary', [address, network]).catch(() => null)
+  }
+
+  addressTransactions(address: string, network: NetworkName, limit: number, offset: number): Promise<AddressTransaction[]> {
+    return this.call('addressTransactions', [address, network, limit, offset])
+  }
+}
+
+let shared: SparkScanApi | null = null
+
+// Imported only when simulated, so that a real deployment never evaluates
+// the simulator or its SPARK_SIM_* settings.
+const simulatedLedger = sparkBackendName() === 'simulated'
+  ? (await import('./sim/ledger.js')).getSimulatedLedger
+  : null
+
+/**
+ * The process-wide SparkScan client, created in the main thread; the
+ * simulator's ledger when SPARK_BACKEND=simulated. The HTTP client also
+ * starts answering worker lookups.
+ */
+export function getSparkScan(): SparkScanApi {
+  if (!shared) {
+    if (simulatedLedger) {
+      shared = simulatedLedger().sparkscan
+    } else {
+      shared = createHttpSparkScan()
+      serveSparkScan(shared)
+    }
+  }
+  return shared
+}
@@ -0,0 +1,122 @@
+import { AsyncLocalStorage } from 'node:async_hooks'
+import { randomUUID } from 'node:crypto'
+import { performance } from 'node:perf_hooks'
+import type { MiddlewareHandler } from 'hono'
+import type { TraceSpan, WorkerOp, WorkerResponse } from './worker/types.js'
+
+/**
+ * Per-request tracing. Every HTTP request gets a request id (the caller's
+ * `x-request-id` if it sent a usable one), echoed back in the response and
+ * passed along with each worker call. Sampled requests also collect spans:
+ * the time each worker call spent queued, the worker's own steps (loadWallet,
+ * streamConnected, getBalance, ...) and the call as a whole. These are
+ * returned as a `Server-Timing` header and/or logged as one JSON line.
+ *
+ * TRACE_SERVER_TIMING_SAMPLE_RATE (default 1) and TRACE_LOG_SAMPLE_RATE
+ * (default 0) are the fractions of requests that get each.
+ */
+
+export type Trace = {
+  requestId: string
+  start: number
+  serverTiming: boolean
+  log: boolean
+  spans: TraceSpan[]
+  ended: boolean
+}
+
+const serverTimingSampleRate = Number(process.env.TRACE_SERVER_TIMING_SAMPLE_RATE ?? 1)
+const logSampleRate = Number(process.env.TRACE_LOG_SAMPLE_RATE ?? 0)
+
+const storage = new AsyncLocalStorage<Trace>()
+
+// Epoch milliseconds with sub-millisecond precision, comparable across threads.
+export function preciseNow(): number {
+  return performance.timeOrigin + performance.now()
+}
+
+export function currentTrace(): Trace | undefined {
+  return storage.getStore()
+}
+
+function isSampled(trace: Trace | undefined): trace is Trace {
+  return !!trace && !trace.ended && (trace.serverTiming || trace.log)
+}
+
+// Whether spans are being collected for the current request.
+export function tracing(): boolean {
+  return isSampled(currentTrace())
+}
+
+export function addSpan(name: string, start: number, durationMs: number) {
+  const trace = currentTrace()
+  if (isSampled(trace)) trace.spans.push({ name, start, durationMs })
+}
+
+/**
+ * Records a worker call made from the current request: its queue time, the
+ * steps the worker reported and the round trip. `response` is missing if
+ * the call failed without an answer, e.g. on timeout.
+ */
+export function addWorkerSpans(op: WorkerOp, sentAt: number, response?: WorkerResponse) {
+  const trace = currentTrace()
+  if (!isSampled(trace)) return
+  if (response?.receivedAt !== undefined) {
+    trace.spans.push({ name: `${op}.queue`, start: sentAt, durationMs: Math.max(0, response.receivedAt - sentAt) })
+  }
+  for (const span of response?.spans ?? []) trace.spans.push(span)
+  trace.spans.push({ name: `${op}.worker`, start: sentAt, durationMs: preciseNow() - sentAt })
+}
+
+function validRequestId(value: string | undefined): value is string {
+  return !!value && value.length <= 128 && /^[A-Za-z0-9._:-]+$/.test(value)
+}
+
+// Server-Timing metric names are HTTP tokens; repeated spans are summed.
+function serverTimingHeader(trace: Trace, totalMs: number): string {
+  const totals = new Map<string, number>()
+  for (const span of trace.spans) {
+    const name = span.name.replace(/[^A-Za-z0-9!#$%&'*+.^_`|~-]/g, '_')
+    totals.set(name, (totals.get(name) ?? 0) + span.durationMs)
+  }
+  totals.set('total', totalMs)
+  return Array.from(totals, ([name, ms]) => `${name};dur=${ms.toFixed(1)}`).join(', ')
+}
+
+export const tracingMiddleware: MiddlewareHandler = async (c, next) => {
+  const incoming = c.req.header('x-request-id')
+  const trace: Trace = {
+    requestId: validRequestId(incoming) ? incoming : randomUUID(),
+    start: preciseNow(),
+    serverTiming: Math.random() < serverTimingSampleRate,
+    log: Math.random() < logSampleRate,
+    spans: [],
+    ended: false,
+  }
+  c.header('x-request-id', trace.requestId)
+  try {
+    await storage.run(trace, next)
+  } finally {
+    // Background work started by this request may outlive it; stop collecting.
+    trace.ended = true
+    const totalMs = preciseNow() - trace.start
+    if (trace.serverTiming) {
+      c.res.headers.set('Server-Timing', serverTimingHeader(trace, totalMs))
+    }
+    if (trace.log) {
+      console.log(JSON.stringify({
+        type: 'trace',
+        requestId: trace.requestId,
+        method: c.req.method,
+        route: c.req.routePath,
+        status: c.res.status,
+        durationMs: Number(totalMs.toFixed(1)),
+        spans: trace.spans.map((span) => ({
+          name: span.name,
+          offsetMs: Number((span.start - trace.start).toFixed(1)),
+          durationMs: Number(span.durationMs.toFixed(1)),
+        })),
+      }))
+    }
+  }
+}
@@ -1,9 +1,40 @@
 import type { Context } from 'hono'
+import * as crypto from 'crypto'
 import { getIdempotencyStore } from './db/store.js'
 
-export const devSparkConfig = JSON.parse(Buffer.from(process.env.DEV_SPARK_CONFIG!, 'base64').toString())
+export const devSparkConfig = process.env.DEV_SPARK_CONFIG
+  ? JSON.parse(Buffer.from(process.env.DEV_SPARK_CONFIG, 'base64').toString())
+  : {}
 
-export const executionTimes: Record<string, Array<number>> = {};
+// Identifies this process when coordinating with other replicas.
+export const instanceId = crypto.randomUUID()
+
+/**
+ * Stable identifier for a wallet that does not expose its mnemonic.
+ */
+export function walletKey(mnemonic: string, network: string, environment: string): string {
+  return crypto.createHash('sha256').update(`${environment}:${network}:${mnemonic}`).digest('hex')
+}
+
+/**
+ * Runs `fn` over `items` with at most `limit` calls in flight, preserving order.
+ */
+export async function mapWithConcurrency<T, R>(
+  items: readonly T[],
+  limit: number,
+  fn: (item: T, index: number) => Promise<R>
+): Promise<R[]> {
+  const results = new Array<R>(items.length)
+  let next = 0
+  const run = async () => {
+    while (next < items.length) {
+      const index = next++
+      results[index] = await fn(items[index], index)
+    }
+  }
+  await Promise.all(Array.from({ length: Math.max(1, Math.min(limit, items.length)) }, run))
+  return results
+}
 
 export function unknownErrorToJson(err: unknown): string {
   if (err instanceof Error) {
@@ -17,9 +48,98 @@ export function unknownErrorToJson(err: unknown): string {
   }
 }
 
+const idempotencyLockTtlMs = Number(process.env.IDEMPOTENCY_LOCK_TTL_MS ?? 60000)
+const idempotencyWaitMs = Number(process.env.IDEMPOTENCY_WAIT_MS ?? 30000)
+if (!(idempotencyLockTtlMs >= 3000)) {
+  throw new Error(`IDEMPOTENCY_LOCK_TTL_MS must be at least 3000, got ${process.env.IDEMPOTENCY_LOCK_TTL_MS}`)
+}
+
+type HeldReservation = { owner: string, heartbeat: NodeJS.Timeout }
+
+// Reservations held by requests in this process, by scoped key.
+const heldReservations = new Map<string, HeldReservation>()
+
+/**
+ * Keeps renewing a reservation until it is released. A request can spend
+ * longer than the TTL waiting for its wallet lane, admission and the worker,
+ * and a retry must not get the key in the meantime; the TTL only bounds how
+ * long a key stays reserved after the process holding it dies.
+ */
+function holdReservation(scopedKey: string, owner: string) {
+  const heartbeat = setInterval(() => {
+    getIdempotencyStore().renew(scopedKey, owner, idempotencyLockTtlMs)
+      .then((renewed) => {
+        if (renewed) return
+        clearInterval(heartbeat)
+        console.warn(`Lost idempotency reservation for ${scopedKey}`)
+      })
+      .catch((err) => console.warn(`Failed to renew idempotency reservation for ${scopedKey}:`, err))
+  }, idempotencyLockTtlMs / 3)
+  heartbeat.unref()
+  heldReservations.set(scopedKey, { owner, heartbeat })
+}
+
+export type IdempotencyClaim =
+  | { state: 'cached', statusCode: number, body: any }
+  | { state: 'reserved' }
+  | { state: 'in_progress' }
+
+/**
+ * Either returns the stored response for the key, or reserves the key for
+ * the caller, who must then store a response (or release the key). While
+ * another request holds the key this waits up to IDEMPOTENCY_WAIT_MS for
+ * its response before giving up with `in_progress`.
+ */
+export async function claimIdempotencyKey(idempotencyKey: string, operation: string): Promise<IdempotencyClaim> {
+  const store = getIdempotencyStore()
+  const scopedKey = `${operation}:${idempotencyKey}`
+  const deadline = Date.now() + idempotencyWaitMs
+  for (;;) {
+    const cached = await getIdempotentResponse(idempotencyKey, operation)
+    if (cached) {
+      return { state: 'cached', ...cached }
+    }
+    const owner = `${instanceId}:${crypto.randomUUID()}`
+    if (await store.reserve(scopedKey, owner, idempotencyLockTtlMs)) {
+      // The previous holder may have stored its response just before releasing.
+      const raced = await getIdempotentResponse(idempotencyKey, operation)
+      if (raced) {
+        await store.release(scopedKey, owner)
+        return { state: 'cached', ...raced }
+      }
+      holdReservation(scopedKey, owner)
+      return { state: 'reserved' }
+    }
+    const remaining = deadline - Date.now()
+    if (remaining <= 0) {
+      return { state: 'in_progress' }
+    }
+    await store.waitForRelease(scopedKey, remaining)
+  }
+}
+
+/**
+ * Gives up a reservation from claimIdempotencyKey without storing a response.
+ */
+export async function releaseIdempotencyKey(idempotencyKey: string | undefined, operation: string): Promise<void> {
+  if (!idempotencyKey) {
+    return
+  }
+  const scopedKey = `${operation}:${idempotencyKey}`
+  const held = heldReservations.get(scopedKey)
+  if (!held) {
+    return
+  }
+  heldReservations.delete(scopedKey)
+  clearInterval(held.heartbeat)
+  await getIdempotencyStore().release(scopedKey, held.owner)
+}
+
 /**
  * Handles idempotency key checks and response caching.
- * Returns the cached response if the idempotency key exists, otherwise returns null.
+ * Returns the cached response if the idempotency key exists, a 409 if a
+ * request with the same key is still running, otherwise reserves the key
+ * and returns null.
  */
 export async function checkIdempotency(
   c: Context,
@@ -30,17 +150,34 @@ export async function checkIdempotency(
     return null
   }
 
-  const store = getIdempotencyStore()
-  const record = await store.get(`${operation}:${idempotencyKey}`)
-  
-  if (record) {
+  const claim = await claimIdempotencyKey(idempotencyKey, operation)
+  if (claim.state === 'cached') {
     // Return the cached response
-    return c.json(JSON.parse(record.response_body), record.status_code as any)
+    return c.json(claim.body, claim.statusCode as any)
+  }
+  if (claim.state === 'in_progress') {
+    return c.json({ error: 'A request with this idempotency key is still in progress' }, 409)
   }
 
   return null
 }
 
+/**
+ * Looks up the stored response for an idempotency key without building an
+ * HTTP response.
+ */
+export async function getIdempotentResponse(
+  idempotencyKey: string,
+  operation: string
+): Promise<{ statusCode: number, body: any } | null> {
+  const store = getIdempotencyStore()
+  const record = await store.get(`${operation}:${idempotencyKey}`)
+  if (!record) {
+    return null
+  }
+  return { statusCode: record.status_code, body: JSON.parse(record.response_body) }
+}
+
 /**
  * Stores the response for an idempotency key.
  */
@@ -61,4 +198,5 @@ export async function storeIdempotencyResponse(
     JSON.stringify(responseBody),
     24 * 60 * 60 * 1000 // 24 hours TTL
   )
+  await releaseIdempotencyKey(idempotencyKey, operation)
 }
@@ -0,0 +1,91 @@
+import { getCacheStore, type CacheStore } from '../db/store.js'
+import { workerClient } from '../worker/client.js'
+import { increment } from '../metrics.js'
+import { walletKey } from '../utils.js'
+import type { BalanceResult, Environment, NetworkName } from '../worker/types.js'
+import type { SparkAddressFormat } from '@buildonspark/spark-sdk'
+
+type WalletRef = {
+    mnemonic: string
+    network: NetworkName
+    environment: Environment
+}
+
+/**
+ * Caches `/wallet/balance` per wallet for `balanceTtlMs` (0 disables it) and
+ * the wallet's address for good, since it is derived from the mnemonic.
+ * Entries are keyed by walletKey(), never by the mnemonic itself.
+ *
+ * Writes made through this proxy invalidate the balance. Payments arriving
+ * from elsewhere are only picked up when the entry expires, so keep the TTL
+ * short. A fetch that overlaps an invalidation does not repopulate the
+ * cache, so a read racing a transfer cannot pin the old balance.
+ */
+export class WalletCache {
+    // Bumped on every local invalidation.
+    private generations = new Map<string, number>()
+
+    constructor(private readonly store: CacheStore, private readonly balanceTtlMs: number) {}
+
+    async balance(wallet: WalletRef, options: { bypass?: boolean } = {}): Promise<BalanceResult> {
+        const key = walletKey(wallet.mnemonic, wallet.network, wallet.environment)
+        const useBalanceCache = this.balanceTtlMs > 0
+        if (useBalanceCache && !options.bypass) {
+            const cached = await this.read(`balance:${key}`)
+            if (cached) {
+                increment('sparkproxy_wallet_cache_lookups_total', { kind: 'balance', result: 'hit' })
+                return JSON.parse(cached) as BalanceResult
+            }
+        }
+        if (useBalanceCache) {
+            increment('sparkproxy_wallet_cache_lookups_total', { kind: 'balance', result: options.bypass ? 'bypass' : 'miss' })
+        }
+
+        const address = (await this.read(`address:${key}`)) as SparkAddressFormat | null
+        increment('sparkproxy_wallet_cache_lookups_total', { kind: 'address', result: address ? 'hit' : 'miss' })
+        const generation = this.generations.get(key) ?? 0
+        const result = await workerClient.balance({ ...wallet, address: address ?? undefined })
+
+        if (!address) this.write(`address:${key}`, result.address, 0)
+        if (useBalanceCache && (this.generations.get(key) ?? 0) === generation) {
+            this.write(`balance:${key}`, JSON.stringify(result), this.balanceTtlMs)
+        }
+        return result
+    }
+
+    /**
+     * Drops the cached balance. Call after any operation that may have moved
+     * funds, whether or not it succeeded.
+     */
+    async invalidate(wallet: WalletRef): Promise<void> {
+        if (this.balanceTtlMs <= 0) return
+        const key = walletKey(wallet.mnemonic, wallet.network, wallet.environment)
+        const generation = (this.generations.get(key) ?? 0) + 1
+        this.generations.set(key, generation)
+        try {
+            await this.store.delete(`balance:${key}`)
+        } catch (err) {
+            console.warn('Failed to invalidate cached balance:', err)
+        }
+        // Only fetches that started before this call care about the bump.
+        setTimeout(() => {
+            if (this.generations.get(key) === generation) this.generations.delete(key)
+        }, 60000).unref()
+    }
+
+    // The cache is an optimization; a failing store falls through to the wallet.
+    private async read(key: string): Promise<string | null> {
+        try {
+            return await this.store.get(key)
+        } catch (err) {
+            console.warn('Wallet cache read failed:', err)
+            return null
+        }
+    }
+
+    private write(key: string, value: string, ttlMs: number) {
+        this.store.set(key, value, ttlMs).catch((err) => console.warn('Wallet cache write failed:', err))
+    }
+}
+
+export const walletCache = new WalletCache(getCacheStore(), Number(process.env.BALANCE_CACHE_TTL_MS ?? 0))
@@ -0,0 +1,121 @@
+import { getWalletReservoirStore, type ReservedWallet, type WalletReservoirStore } from '../db/store.js'
+import { workerClient } from '../worker/client.js'
+import { increment, registerGauge } from '../metrics.js'
+import type { Environment, NetworkName } from '../worker/types.js'
+
+type ReservoirPool = {
+    network: NetworkName
+    environment: Environment
+}
+
+export type ReservoirOptions = {
+    pools: ReservoirPool[]
+    lowWatermark: number
+    highWatermark: number
+    refillPerSecond: number
+}
+
+function poolKey(network: NetworkName, environment: Environment) {
+    return `${network}:${environment}`
+}
+
+function parsePools(value: string): ReservoirPool[] {
+    return value
+        .split(',')
+        .map((entry) => entry.trim())
+        .filter((entry) => entry.length > 0)
+        .map((entry) => {
+            const [network, environment = 'prod'] = entry.split(':')
+            return { network: network as NetworkName, environment: environment as Environment }
+        })
+}
+
+/**
+ * Keeps a stock of freshly initialized wallets per network/environment so
+ * that wallet and invoice creation do not wait on SparkWallet.initialize.
+ *
+ * A pool is refilled up to the high watermark whenever it drops below the
+ * low watermark, starting at most `refillPerSecond` initializations per
+ * second. Pools that are not configured, or that run dry, fall back to
+ * initializing a wallet on the request path.
+ */
+export class WalletReservoir {
+    private refilling = new Set<string>()
+
+    constructor(private readonly store: WalletReservoirStore, private readonly options: ReservoirOptions) {}
+
+    start() {
+        if (this.options.highWatermark <= 0) return
+        const check = () => {
+            for (const { network, environment } of this.options.pools) {
+                this.refill(network, environment).catch((err) => {
+                    console.warn(`Wallet reservoir refill failed for ${poolKey(network, environment)}:`, err)
+                })
+            }
+        }
+        check()
+        setInterval(check, 5000).unref()
+    }
+
+    async take(network: NetworkName, environment: Environment): Promise<ReservedWallet> {
+        const pool = poolKey(network, environment)
+        const wallet = await this.store.pop(pool)
+        increment('sparkproxy_wallet_reservoir_takes_total', { pool, result: wallet ? 'hit' : 'miss' })
+        if (wallet) {
+            this.refill(network, environment).catch(() => {})
+            return wallet
+        }
+        return workerClient.initialize({ network, environment })
+    }
+
+    async sizes(): Promise<Record<string, number>> {
+        const sizes: Record<string, number> = {}
+        for (const { network, environment } of this.options.pools) {
+            const key = poolKey(network, environment)
+            sizes[key] = await this.store.size(key)
+        }
+        return sizes
+    }
+
+    private isConfigured(network: NetworkName, environment: Environment) {
+        return this.options.pools.some((pool) => pool.network === network && pool.environment === environment)
+    }
+
+    private async refill(network: NetworkName, environment: Environment) {
+        const key = poolKey(network, environment)
+        if (!this.isConfigured(network, environment) || this.refilling.has(key)) return
+        if (await this.store.size(key) >= this.options.lowWatermark) return
+
+        this.refilling.add(key)
+        try {
+            const intervalMs = 1000 / Math.max(this.options.refillPerSecond, 0.01)
+            const inFlight: Array<Promise<void>> = []
+            let deficit = this.options.highWatermark - await this.store.size(key)
+            while (deficit > 0) {
+                deficit--
+                inFlight.push(
+                    workerClient.initialize({ network, environment })
+                        .then((wallet) => this.store.push(key, wallet))
+                        .catch((err) => console.warn(`Wallet reservoir initialize failed for ${key}:`, err))
+                )
+                if (deficit > 0) await new Promise((resolve) => setTimeout(resolve, intervalMs))
+            }
+            await Promise.all(inFlight)
+        } finally {
+            this.refilling.delete(key)
+        }
+    }
+}
+
+export const walletReservoir = new WalletReservoir(getWalletReservoirStore(), {
+    pools: parsePools(process.env.WALLET_RESERVOIR_POOLS ?? 'MAINNET:prod'),
+    lowWatermark: Number(process.env.WALLET_RESERVOIR_LOW ?? 5),
+    highWatermark: Number(process.env.WALLET_RESERVOIR_HIGH ?? 20),
+    refillPerSecond: Number(process.env.WALLET_RESERVOIR_RATE ?? 2),
+})
+
+walletReservoir.start()
+
+registerGauge('sparkproxy_wallet_reservoir_size', 'Pre-initialized wallets ready per pool', async () =>
+    Object.entries(await walletReservoir.sizes()).map(([pool, value]) => ({ labels: { pool }, value }))
+)
@@ -1,4 +1,5 @@
 import { OpenAPIHono } from '@hono/zod-openapi'
+import { performance } from 'node:perf_hooks'
 import {
     initializeRoute,
     balanceRoute,
@@ -13,16 +14,47 @@ import {
     claimStaticDepositRoute,
     claimAllStaticDepositsRoute,
     coopExitRoute,
+    batchRoute,
 } from './routes/index.js'
-import { unknownErrorToJson, checkIdempotency, storeIdempotencyResponse } from '../utils.js'
+import type { z } from '@hono/zod-openapi'
+import type { BatchItemSchema, BatchItemOutputSchema } from './routes/index.js'
+import { unknownErrorToJson, checkIdempotency, claimIdempotencyKey, releaseIdempotencyKey, storeIdempotencyResponse } from '../utils.js'
 import { workerClient } from '../worker/client.js'
+import { OverloadedError } from '../worker/admission.js'
+import { walletReservoir } from './reservoir.js'
+import { walletCache } from './cache.js'
+import type { BatchItem, BatchResult, WorkerError } from '../worker/types.js'
 import type { Bech32mTokenIdentifier, SparkAddressFormat } from '@buildonspark/spark-sdk'
 
 export const app = new OpenAPIHono()
 
+// Overload (a busy server or wallet) is worth retrying with the same key:
+// free it and let the app's error handler answer 429 instead of caching a
+// failure.
+async function rethrowIfOverloaded(err: unknown, idempotencyKey?: string, operation?: string) {
+    if (err instanceof OverloadedError) {
+        if (operation) await releaseIdempotencyKey(idempotencyKey, operation)
+        throw err
+    }
+}
+
+// For a batch item whose worker call failed midway, so it may or may not have run.
+function outcomeUnknown(cause: unknown): string {
+    const err = new Error(`The batch was interrupted and this item may already have run; check the wallet before retrying it under a new key (${cause instanceof Error ? cause.message : String(cause)})`)
+    err.name = 'OutcomeUnknown'
+    return unknownErrorToJson(err)
+}
+
+// Same shape as the error body of the single-item routes.
+function workerErrorToJson(error: WorkerError): string {
+    const err = new Error(`${error.name}: ${error.message}`)
+    err.stack = error.stack
+    return unknownErrorToJson(err)
+}
+
 app.openapi(initializeRoute, async (c) => {
     const { 'spark-network': network, 'spark-environment': environment } = c.req.valid('header')
-    const { mnemonic, address } = await workerClient.initialize({ network, environment })
+    const { mnemonic, address } = await walletReservoir.take(network, environment)
     return c.json({
         mnemonic: mnemonic,
         address: address,
@@ -33,7 +65,7 @@ app.openapi(batchInitializeRoute, async (c) => {
     const { 'spark-network': network, 'spark-environment': environment } = c.req.valid('header')
     const count = c.req.valid('query').count
     const wallets = await Promise.all(Array.from({ length: count ?? 1 }, async () => {
-        const { mnemonic, address } = await workerClient.initialize({ network, environment })
+        const { mnemonic, address } = await walletReservoir.take(network, environment)
         return {
             mnemonic: mnemonic,
             address: address,
@@ -45,9 +77,11 @@ app.openapi(batchInitializeRoute, async (c) => {
 app.openapi(balanceRoute, async (c) => {
     const { 'spark-mnemonic': mnemonic, 'spark-network': network, 'spark-environment': environment } = c.req.valid('header')
     try {
-        const result = await workerClient.balance({ mnemonic, network, environment })
+        const bypass = /\bno-(cache|store)\b/i.test(c.req.header('cache-control') ?? '')
+        const result = await walletCache.balance({ mnemonic, network, environment }, { bypass })
         return c.json(result, 200)
     } catch (err: unknown) {
+        await rethrowIfOverloaded(err)
         return c.json({ error: unknownErrorToJson(err) }, 400)
     }
 })
@@ -73,9 +107,12 @@ app.openapi(transferRoute, async (c) => {
         await storeIdempotencyResponse(idempotencyKey, 'transfer', 200, response)
         return c.json(response, 200)
     } catch (err: unknown) {
+        await rethrowIfOverloaded(err, idempotencyKey, 'transfer')
         const errorResponse = { error: unknownErrorToJson(err) }
         await storeIdempotencyResponse(idempotencyKey, 'transfer', 400, errorResponse)
         return c.json(errorResponse, 400)
+    } finally {
+        await walletCache.invalidate({ mnemonic, network, environment })
     }
 })
 
@@ -101,9 +138,12 @@ app.openapi(tokenTransferRoute, async (c) => {
         await storeIdempotencyResponse(idempotencyKey, 'tokenTransfer', 200, response)
         return c.json(response, 200)
     } catch (err: unknown) {
+        await rethrowIfOverloaded(err, idempotencyKey, 'tokenTransfer')
         const errorResponse = { error: unknownErrorToJson(err) }
         await storeIdempotencyResponse(idempotencyKey, 'tokenTransfer', 400, errorResponse)
         return c.json(errorResponse, 400)
+    } finally {
+        await walletCache.invalidate({ mnemonic, network, environment })
     }
 })
 
@@ -128,9 +168,12 @@ app.openapi(payLightningInvoiceRoute, async (c) => {
         await storeIdempotencyResponse(idempotencyKey, 'payLightningInvoice', 200, response)
         return c.json(response, 200)
     } catch (err: unknown) {
+        await rethrowIfOverloaded(err, idempotencyKey, 'payLightningInvoice')
         const errorResponse = { error: unknownErrorToJson(err) }
         await storeIdempotencyResponse(idempotencyKey, 'payLightningInvoice', 400, errorResponse)
         return c.json(errorResponse, 400)
+    } finally {
+        await walletCache.invalidate({ mnemonic, network, environment })
     }
 })
 
@@ -156,6 +199,7 @@ app.openapi(createLightningInvoiceRoute, async (c) => {
         await storeIdempotencyResponse(idempotencyKey, 'createLightningInvoice', 200, response)
         return c.json(response, 200)
     } catch (err: unknown) {
+        await rethrowIfOverloaded(err, idempotencyKey, 'createLightningInvoice')
         const errorResponse = { error: unknownErrorToJson(err) }
         await storeIdempotencyResponse(idempotencyKey, 'createLightningInvoice', 400, errorResponse)
         return c.json(errorResponse, 400)
@@ -177,6 +221,7 @@ app.openapi(createThirdPartyLightningInvoiceRoute, async (c) => {
         })
         return c.json({ invoice }, 200)
     } catch (err: unknown) {
+        await rethrowIfOverloaded(err)
         return c.json({ error: unknownErrorToJson(err) }, 400)
     }
 })
@@ -191,6 +236,7 @@ app.openapi(staticDepositAddressRoute, async (c) => {
         })
         return c.json({ depositAddress }, 200)
     } catch (err: unknown) {
+        await rethrowIfOverloaded(err)
         return c.json({ error: unknownErrorToJson(err) }, 400)
     }
 })
@@ -208,6 +254,7 @@ app.openapi(depositUtxosRoute, async (c) => {
         })
         return c.json({ utxos }, 200)
     } catch (err: unknown) {
+        await rethrowIfOverloaded(err)
         return c.json({ error: unknownErrorToJson(err) }, 400)
     }
 })
@@ -234,9 +281,12 @@ app.openapi(claimStaticDepositRoute, async (c) => {
         await storeIdempotencyResponse(idempotencyKey, 'claimStaticDeposit', 200, response)
         return c.json(response, 200)
     } catch (err: unknown) {
+        await rethrowIfOverloaded(err, idempotencyKey, 'claimStaticDeposit')
         const errorResponse = { error: unknownErrorToJson(err) }
         await storeIdempotencyResponse(idempotencyKey, 'claimStaticDeposit', 400, errorResponse)
         return c.json(errorResponse, 400)
+    } finally {
+        await walletCache.invalidate({ mnemonic, network, environment })
     }
 })
 
@@ -250,18 +300,27 @@ app.openapi(claimAllStaticDepositsRoute, async (c) => {
     }
     
     try {
-        const { claims, totalClaimedSats } = await workerClient.claimAllStaticDeposits({
+        const { claims, totalClaimedSats, failed, remaining, complete } = await workerClient.claimAllStaticDeposits({
             mnemonic,
             network,
             environment,
         })
-        const response = { claims, totalClaimedSats }
+        const response = {
+            claims,
+            totalClaimedSats,
+            failed: failed.map(({ txHash, vout, error }) => ({ txHash, vout, error: workerErrorToJson(error) })),
+            remaining,
+            complete,
+        }
         await storeIdempotencyResponse(idempotencyKey, 'claimAllStaticDeposits', 200, response)
         return c.json(response, 200)
     } catch (err: unknown) {
+        await rethrowIfOverloaded(err, idempotencyKey, 'claimAllStaticDeposits')
         const errorResponse = { error: unknownErrorToJson(err) }
         await storeIdempotencyResponse(idempotencyKey, 'claimAllStaticDeposits', 400, errorResponse)
         return c.json(errorResponse, 400)
+    } finally {
+        await walletCache.invalidate({ mnemonic, network, environment })
     }
 })
 
@@ -296,10 +355,154 @@ app.openapi(coopExitRoute, async (c) => {
         await storeIdempotencyResponse(idempotencyKey, 'coopExit', 200, response)
         return c.json(response, 200)
     } catch (err: unknown) {
+        await rethrowIfOverloaded(err, idempotencyKey, 'coopExit')
         const errorResponse = { error: unknownErrorToJson(err) }
         await storeIdempotencyResponse(idempotencyKey, 'coopExit', 400, errorResponse)
         return c.json(errorResponse, 400)
+    } finally {
+        await walletCache.invalidate({ mnemonic, network, environment })
     }
 })
 
+// Items per worker call. A batch runs as a series of such calls, each bounded
+// by the batch timeout, so one request never holds the wallet's lane and a
+// worker slot for longer than that; other spending operations for the
+// wallet can run in between.
+const batchChunkItems = Number(process.env.BATCH_CHUNK_ITEMS ?? 50)
+if (!(Number.isInteger(batchChunkItems) && batchChunkItems > 0)) {
+    throw new Error(`BATCH_CHUNK_ITEMS must be a positive integer, got ${process.env.BATCH_CHUNK_ITEMS}`)
+}
+
+function toBatchWorkerItem(item: z.infer<typeof BatchItemSchema>): BatchItem {
+    switch (item.type) {
+        case 'transfer':
+            return { type: 'transfer', amountSats: item.amountSats, receiverSparkAddress: item.receiverSparkAddress as SparkAddressFormat }
+        case 'tokenTransfer':
+            return {
+                type: 'transferTokens',
+                tokenIdentifier: item.tokenIdentifier as Bech32mTokenIdentifier,
+                tokenAmount: String(item.tokenAmount),
+                receiverSparkAddress: item.receiverSparkAddress as SparkAddressFormat,
+            }
+        case 'payLightningInvoice':
+            return { type: 'payLightningInvoice', invoice: item.invoice, maxFeeSats: item.maxFeeSats }
+        case 'createLightningInvoice':
+            return { type: 'createLightningInvoice', amountSats: item.amount, memo: item.memo, expirySeconds: item.expirySeconds }
+    }
+}
+
+app.openapi(batchRoute, async (c) => {
+    const { 'spark-mnemonic': mnemonic, 'spark-network': network, 'spark-environment': environment } = c.req.valid('header')
+    const { items, stopOnError } = c.req.valid('json')
+    const start = performance.now()
+
+    type ItemOutput = z.infer<typeof BatchItemOutputSchema>
+    const results: Array<ItemOutput | null> = items.map(() => null)
+    // Item keys share the key space of the single-item routes ('transfer', 'tokenTransfer', ...).
+    const firstIndexByKey = new Map<string, number>()
+    const duplicates: Array<[number, number]> = []
+    await Promise.all(items.map(async (item, index) => {
+        if (!item.idempotencyKey) return
+        const scopedKey = `${item.type}:${item.idempotencyKey}`
+        const first = firstIndexByKey.get(scopedKey)
+        if (first !== undefined) {
+            duplicates.push([index, first])
+            return
+        }
+        firstIndexByKey.set(scopedKey, index)
+        const claim = await claimIdempotencyKey(item.idempotencyKey, item.type)
+        if (claim.state === 'reserved') return
+        if (claim.state === 'in_progress') {
+            results[index] = { index, type: item.type, ok: false, status: 'failed', error: 'A request with this idempotency key is still in progress', durationMs: 0 }
+            return
+        }
+        const ok = claim.statusCode === 200
+        results[index] = {
+            index,
+            type: item.type,
+            ok,
+            status: 'cached',
+            ...(ok ? { result: claim.body } : { error: claim.body.error }),
+            durationMs: 0,
+        }
+    }))
+    const duplicateIndexes = new Set(duplicates.map(([index]) => index))
+    const pending = items
+        .map((item, index) => ({ item, index }))
+        .filter(({ index }) => results[index] === null && !duplicateIndexes.has(index))
+
+    if (pending.length > 0) {
+        try {
+            let offset = 0
+            while (offset < pending.length) {
+                const chunk = pending.slice(offset, offset + batchChunkItems)
+                let batchResult: BatchResult
+                try {
+                    batchResult = await workerClient.batch({
+                        mnemonic,
+                        network,
+                        environment,
+                        items: chunk.map(({ item }) => toBatchWorkerItem(item)),
+                        stopOnError,
+                    })
+                } catch (err: unknown) {
+                    if (!(err instanceof OverloadedError)) {
+                        // A timeout or a crashed worker: any item of this chunk may have run.
+                        // Their keys keep this answer so a retry cannot pay twice.
+                        const error = outcomeUnknown(err)
+                        await Promise.all(chunk.map(async ({ item, index }) => {
+                            results[index] = { index, type: item.type, ok: false, status: 'failed', error, durationMs: 0 }
+                            await storeIdempotencyResponse(item.idempotencyKey, item.type, 400, { error })
+                        }))
+                        break
+                    }
+                    if (offset > 0) break
+                    // Refused before reaching a worker, so nothing ran.
+                    await Promise.all(pending.map(({ item }) => releaseIdempotencyKey(item.idempotencyKey, item.type)))
+                    throw err
+                }
+                const { results: itemResults, loadError } = batchResult
+                if (loadError) {
+                    if (offset > 0) break
+                    // The wallet could not be loaded; no item was attempted.
+                    await Promise.all(pending.map(({ item }) => releaseIdempotencyKey(item.idempotencyKey, item.type)))
+                    return c.json({ error: workerErrorToJson(loadError) }, 400)
+                }
+                await Promise.all(chunk.map(async ({ item, index }, i) => {
+                    const itemResult = itemResults[i]
+                    if (itemResult.status === 'done') {
+                        results[index] = { index, type: item.type, ok: true, status: 'done', result: itemResult.result, durationMs: itemResult.durationMs }
+                        await storeIdempotencyResponse(item.idempotencyKey, item.type, 200, itemResult.result)
+                    } else if (itemResult.status === 'failed') {
+                        const error = workerErrorToJson(itemResult.error)
+                        results[index] = { index, type: item.type, ok: false, status: 'failed', error, durationMs: itemResult.durationMs }
+                        await storeIdempotencyResponse(item.idempotencyKey, item.type, 400, { error })
+                    }
+                }))
+                if (stopOnError && itemResults.some((r) => r.status === 'failed')) break
+                // Items run in order, so those skipped at the chunk's deadline
+                // are at its end and go into the next chunk.
+                const ran = itemResults.findIndex((r) => r.status === 'skipped')
+                if (ran === 0) break
+                offset += ran === -1 ? chunk.length : ran
+            }
+        } finally {
+            if (pending.some(({ item }) => item.type !== 'createLightningInvoice')) {
+                await walletCache.invalidate({ mnemonic, network, environment })
+            }
+        }
+        // Never attempted: after a failure with stopOnError, or when a later
+        // chunk was refused or made no progress.
+        await Promise.all(pending.map(async ({ item, index }) => {
+            if (results[index] !== null) return
+            results[index] = { index, type: item.type, ok: false, status: 'skipped', durationMs: 0 }
+            await releaseIdempotencyKey(item.idempotencyKey, item.type)
+        }))
+    }
 
+    for (const [index, first] of duplicates) {
+        const original = results[first]!
+        results[index] = { ...original, index, status: original.status === 'skipped' ? 'skipped' : 'cached', durationMs: 0 }
+    }
+    return c.json({ results: results as ItemOutput[], durationMs: performance.now() - start }, 200)
+})
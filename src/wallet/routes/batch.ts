@@ -0,0 +1,81 @@
+import { createRoute } from "@hono/zod-openapi"
+import { z } from "@hono/zod-openapi"
+import { SparkHeadersSchema } from "../schema.js"
+import { TransferSchema } from "./transfer.js"
+import { TokenTransferSchema } from "./transfer_token.js"
+import { PayLightningInvoiceSchema } from "./pay_lightning_invoice.js"
+import { CreateLightningInvoiceSchema } from "./create_lightning_invoice.js"
+
+const ItemKeySchema = z.object({
+    idempotencyKey: z.string().optional().openapi({
+        description: 'Same key space as the Idempotency-Key header of the single-item route',
+    }),
+})
+
+export const BatchItemSchema = z.discriminatedUnion('type', [
+    TransferSchema.merge(ItemKeySchema).extend({ type: z.literal('transfer') }),
+    TokenTransferSchema.merge(ItemKeySchema).extend({ type: z.literal('tokenTransfer') }),
+    PayLightningInvoiceSchema.merge(ItemKeySchema).extend({ type: z.literal('payLightningInvoice') }),
+    CreateLightningInvoiceSchema.merge(ItemKeySchema).extend({ type: z.literal('createLightningInvoice') }),
+])
+
+export const BatchSchema = z.object({
+    items: z.array(BatchItemSchema).min(1).max(500),
+    stopOnError: z.boolean().optional().default(false).openapi({
+        description: 'Skip the remaining items after the first failure',
+    }),
+})
+
+export const BatchItemOutputSchema = z.object({
+    index: z.number(),
+    type: z.string(),
+    ok: z.boolean(),
+    status: z.enum(['done', 'failed', 'skipped', 'cached']),
+    result: z.object({
+        id: z.string().optional(),
+        invoice: z.string().optional(),
+    }).optional(),
+    error: z.string().optional(),
+    durationMs: z.number(),
+})
+
+export const BatchOutputSchema = z.object({
+    results: z.array(BatchItemOutputSchema),
+    durationMs: z.number(),
+})
+
+export const batchRoute = createRoute({
+    method: 'post',
+    path: '/batch',
+    request: {
+        headers: SparkHeadersSchema,
+        body: {
+            content: {
+                'application/json': {
+                    schema: BatchSchema,
+                },
+            },
+        },
+    },
+    responses: {
+        200: {
+            content: {
+                'application/json': {
+                    schema: BatchOutputSchema,
+                },
+            },
+            description: 'Run transfers, token transfers, Lightning payments and invoice creations in order from one wallet session. Each item succeeds or fails on its own.',
+        },
+        400: {
+            content: {
+                'application/json': {
+                    schema: z.object({
+                        error: z.string(),
+                    }),
+                },
+            },
+            description: 'Error',
+        },
+    },
+    tags: ["Wallet"],
+})
@@ -33,6 +33,21 @@ export const ClaimAllStaticDepositsOutputSchema = z.object({
         description: 'Total amount credited to the wallet',
         example: 199000,
     }),
+    failed: z.array(z.object({
+        txHash: z.string(),
+        vout: z.number(),
+        error: z.string(),
+    })).openapi({
+        description: 'Deposits whose quote or claim failed',
+    }),
+    remaining: z.number().openapi({
+        description: 'Unclaimed deposits not attempted before the time limit',
+        example: 0,
+    }),
+    complete: z.boolean().openapi({
+        description: 'False if anything failed or remains; call again with a new idempotency key to continue',
+        example: true,
+    }),
 })
 
 export const claimAllStaticDepositsRoute = createRoute({
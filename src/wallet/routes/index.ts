@@ -10,6 +10,7 @@ export * from './deposit_utxos.js'
 export * from './claim_static_deposit.js'
 export * from './claim_all_static_deposits.js'
 export * from './coop_exit.js'
+export * from './batch.js'
 // batch_initialize merged into initialize.ts; nothing else to export
 
 
@@ -0,0 +1,195 @@
+import { performance } from 'node:perf_hooks';
+import { increment, observe, registerGauge } from "../metrics.js";
+import { parseRates, rateFor, type OpRates } from "../config.js";
+import type { WorkerOp } from "./types.js";
+
+// Answered with 429 and Retry-After; see index.ts.
+export class OverloadedError extends Error {
+  constructor(message: string, readonly retryAfterMs = 1000) {
+    super(message);
+    this.name = "OverloadedError";
+  }
+}
+
+export type Priority = "high" | "normal" | "low";
+
+const PRIORITIES: Priority[] = ["high", "normal", "low"];
+
+// Payments first; wallet creation and background invoice checks last.
+const OP_PRIORITY: Partial<Record<WorkerOp, Priority>> = {
+  transfer: "high",
+  transferTokens: "high",
+  payLightningInvoice: "high",
+  coopExit: "high",
+  claimStaticDeposit: "high",
+  claimAllStaticDeposits: "high",
+  transferAll: "high",
+  batch: "high",
+  initialize: "low",
+  isOfferMet: "low",
+  watchOffer: "low",
+};
+
+// Share of the global limit each priority may fill, so that a flood of
+// low-priority work always leaves room for payments.
+const PRIORITY_SHARE: Record<Priority, number> = { high: 1, normal: 0.9, low: 0.5 };
+
+export function priorityOf(op: WorkerOp): Priority {
+  return OP_PRIORITY[op] ?? "normal";
+}
+
+type Waiter = {
+  op: WorkerOp;
+  priority: Priority;
+  enqueuedAt: number;
+  timer: NodeJS.Timeout;
+  admit: () => void;
+  reject: (e: Error) => void;
+};
+
+export type AdmissionOptions = {
+  maxInFlight: number;
+  // Per-operation concurrency; 0 means only the global limit applies.
+  opLimits: OpRates;
+  maxQueued: number;
+  maxWaitMs: number;
+};
+
+/**
+ * Bounds the worker operations in flight across the pool. Callers beyond the
+ * limits wait in one FIFO queue per priority and are admitted highest
+ * priority first. When the queue is full a newcomer displaces the most
+ * recent waiter of a lower priority, or is refused; waiters that are not
+ * admitted within `maxWaitMs` are refused too. Refusals are OverloadedError,
+ * so overload turns into quick 429s rather than a pile of timeouts.
+ */
+export class AdmissionController {
+  private inFlight = 0;
+  private inFlightByOp = new Map<WorkerOp, number>();
+  private queues: Record<Priority, Waiter[]> = { high: [], normal: [], low: [] };
+
+  constructor(private readonly options: AdmissionOptions) {}
+
+  get running(): number {
+    return this.inFlight;
+  }
+
+  queued(priority: Priority): number {
+    return this.queues[priority].length;
+  }
+
+  // Resolves with a release function once the operation may run.
+  acquire(op: WorkerOp): Promise<() => void> {
+    const priority = priorityOf(op);
+    const nothingAhead = PRIORITIES.slice(0, PRIORITIES.indexOf(priority) + 1).every((p) => this.queues[p].length === 0);
+    if (nothingAhead && this.canRun(op, priority)) {
+      this.start(op);
+      increment("sparkproxy_admission_total", { op, priority, result: "immediate" });
+      return Promise.resolve(this.releaser(op));
+    }
+    if (this.totalQueued() >= this.options.maxQueued && !this.shedLowerThan(priority)) {
+      increment("sparkproxy_admission_total", { op, priority, result: "rejected" });
+      return Promise.reject(new OverloadedError(`Server is busy: too many ${op} operations queued`));
+    }
+    return new Promise((resolve, reject) => {
+      const waiter: Waiter = {
+        op,
+        priority,
+        enqueuedAt: performance.now(),
+        timer: setTimeout(() => {
+          this.remove(waiter);
+          increment("sparkproxy_admission_total", { op, priority, result: "timeout" });
+          reject(new OverloadedError(`Server is busy: ${op} waited ${this.options.maxWaitMs}ms without starting`, 2000));
+        }, this.options.maxWaitMs),
+        admit: () => resolve(this.releaser(op)),
+        reject,
+      };
+      this.queues[priority].push(waiter);
+    });
+  }
+
+  private canRun(op: WorkerOp, priority: Priority): boolean {
+    if (this.inFlight >= Math.max(1, Math.floor(this.options.maxInFlight * PRIORITY_SHARE[priority]))) return false;
+    const opLimit = rateFor(this.options.opLimits, op);
+    return opLimit <= 0 || (this.inFlightByOp.get(op) ?? 0) < opLimit;
+  }
+
+  private start(op: WorkerOp) {
+    this.inFlight++;
+    this.inFlightByOp.set(op, (this.inFlightByOp.get(op) ?? 0) + 1);
+  }
+
+  private releaser(op: WorkerOp): () => void {
+    let released = false;
+    return () => {
+      if (released) return;
+      released = true;
+      this.inFlight--;
+      this.inFlightByOp.set(op, (this.inFlightByOp.get(op) ?? 1) - 1);
+      this.drain();
+    };
+  }
+
+  // Admits waiters in priority order; one whose operation is at its own
+  // limit does not hold up other operations behind it.
+  private drain() {
+    for (const priority of PRIORITIES) {
+      const queue = this.queues[priority];
+      for (let i = 0; i < queue.length; ) {
+        const waiter = queue[i];
+        if (!this.canRun(waiter.op, priority)) {
+          if (this.inFlight >= this.options.maxInFlight) return;
+          i++;
+          continue;
+        }
+        queue.splice(i, 1);
+        clearTimeout(waiter.timer);
+        this.start(waiter.op);
+        observe("sparkproxy_admission_wait_ms", { op: waiter.op, priority }, performance.now() - waiter.enqueuedAt);
+        increment("sparkproxy_admission_total", { op: waiter.op, priority, result: "queued" });
+        waiter.admit();
+      }
+    }
+  }
+
+  private shedLowerThan(priority: Priority): boolean {
+    for (const lower of [...PRIORITIES].reverse()) {
+      if (lower === priority) return false;
+      const waiter = this.queues[lower].pop();
+      if (!waiter) continue;
+      clearTimeout(waiter.timer);
+      increment("sparkproxy_admission_total", { op: waiter.op, priority: lower, result: "shed" });
+      waiter.reject(new OverloadedError(`Server is busy: ${waiter.op} was displaced by higher-priority work`));
+      return true;
+    }
+    return false;
+  }
+
+  private remove(waiter: Waiter) {
+    const queue = this.queues[waiter.priority];
+    const index = queue.indexOf(waiter);
+    if (index >= 0) queue.splice(index, 1);
+  }
+
+  private totalQueued(): number {
+    return PRIORITIES.reduce((total, p) => total + this.queues[p].length, 0);
+  }
+}
+
+export function createAdmissionController(poolSize: number): AdmissionController {
+  return new AdmissionController({
+    maxInFlight: Number(process.env.WORKER_MAX_IN_FLIGHT ?? poolSize * 32),
+    opLimits: parseRates(process.env.WORKER_OP_CONCURRENCY ?? "initialize=16", 0, "WORKER_OP_CONCURRENCY"),
+    maxQueued: Number(process.env.WORKER_QUEUE_MAX ?? 1000),
+    maxWaitMs: Number(process.env.WORKER_QUEUE_TIMEOUT_MS ?? 10000),
+  });
+}
+
+export function registerAdmissionGauges(admission: AdmissionController) {
+  registerGauge("sparkproxy_admission_in_flight", "Worker operations admitted and running", () => [
+    { labels: {}, value: admission.running },
+  ]);
+  registerGauge("sparkproxy_admission_queued", "Worker operations waiting for admission, by priority", () =>
+    PRIORITIES.map((priority) => ({ labels: { priority }, value: admission.queued(priority) })),
+  );
+}
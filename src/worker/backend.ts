@@ -0,0 +1,101 @@
+import type { SparkScanApi } from "../sparkscan.js";
+import type { Environment, NetworkName } from "./types.js";
+
+export type TokenBalance = {
+  availableToSendBalance: bigint;
+  tokenMetadata: {
+    tokenPublicKey: string;
+    tokenName: string;
+    tokenTicker: string;
+    decimals: number;
+    maxSupply: bigint;
+  };
+};
+
+export type WalletTransfer = {
+  id: string;
+  transferDirection: string;
+  senderIdentityPublicKey: string;
+  totalValue: number;
+  createdTime?: Date;
+};
+
+export type StaticDepositQuote = {
+  transactionId: string;
+  outputIndex: number;
+  creditAmountSats: number;
+  depositAmountSats?: number;
+  feeSats?: number;
+  signature: string;
+};
+
+/**
+ * The wallet operations the worker handlers use. `SparkWallet` provides all
+ * of them; the simulated backend implements them against its ledger.
+ */
+export interface BackendWallet {
+  getSparkAddress(): Promise<string>;
+  getBalance(): Promise<{ balance: bigint; tokenBalances: Map<string, TokenBalance> }>;
+  getTransfers(limit: number, offset: number): Promise<{ transfers: WalletTransfer[] }>;
+  transfer(args: { amountSats: number; receiverSparkAddress: string }): Promise<{ id: string }>;
+  transferTokens(args: { tokenIdentifier: string; tokenAmount: bigint; receiverSparkAddress: string }): Promise<string>;
+  payLightningInvoice(args: { invoice: string; maxFeeSats: number }): Promise<{ id: string }>;
+  createLightningInvoice(args: {
+    amountSats: number;
+    memo?: string;
+    expirySeconds?: number;
+    receiverIdentityPubkey?: string;
+  }): Promise<{ invoice: { encodedInvoice: string } }>;
+  getStaticDepositAddress(): Promise<string>;
+  getUtxosForDepositAddress(depositAddress: string, limit?: number, offset?: number, excludeClaimed?: boolean): Promise<unknown[]>;
+  getClaimStaticDepositQuote(txHash: string, vout: number): Promise<StaticDepositQuote>;
+  claimStaticDeposit(args: { transactionId: string; creditAmountSats: number; sspSignature: string; outputIndex: number }): Promise<unknown>;
+  getWithdrawalFeeQuote(args: { amountSats: number; withdrawalAddress: string }): Promise<unknown>;
+  withdraw(args: {
+    onchainAddress: string;
+    exitSpeed: any;
+    amountSats: number;
+    feeQuote: any;
+    deductFeeFromWithdrawalAmount: boolean;
+  }): Promise<unknown>;
+  on(event: "transfer:claimed" | "stream:connected", listener: (...args: any[]) => void): unknown;
+  off(event: "transfer:claimed" | "stream:connected", listener: (...args: any[]) => void): unknown;
+  cleanupConnections(): Promise<void>;
+}
+
+export type InitializeOptions = {
+  // A new wallet is created when omitted.
+  mnemonic?: string;
+  network: NetworkName;
+  environment: Environment;
+};
+
+export interface SparkBackend {
+  readonly name: string;
+  initialize(options: InitializeOptions): Promise<{ mnemonic: string; wallet: BackendWallet }>;
+  encodeSparkAddress(identityPublicKey: string, network: NetworkName): string;
+  readonly sparkscan: SparkScanApi;
+}
+
+export type SparkBackendName = "sdk" | "simulated";
+
+export function sparkBackendName(): SparkBackendName {
+  const name = (process.env.SPARK_BACKEND ?? "sdk").toLowerCase();
+  if (name !== "sdk" && name !== "simulated") {
+    throw new Error(`Unknown SPARK_BACKEND: ${name}`);
+  }
+  return name;
+}
+
+/**
+ * Loads the backend selected by SPARK_BACKEND. Imported lazily so that the
+ * simulated backend never evaluates the Spark SDK.
+ */
+export async function loadSparkBackend(): Promise<SparkBackend> {
+  if (sparkBackendName() === "simulated") {
+    const { SimulatedBackend } = await import("../sim/backend.js");
+    return new SimulatedBackend();
+  }
+  const { SdkBackend } = await import("./sdk-backend.js");
+  return new SdkBackend();
+}
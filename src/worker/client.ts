@@ -1,11 +1,20 @@
-import { Worker } from 'node:worker_threads';
-import { randomUUID } from 'node:crypto';
-import { executionTimes } from "../utils.js";
+import { availableParallelism } from 'node:os';
+import { performance } from 'node:perf_hooks';
+import { increment, observe, registerGauge } from "../metrics.js";
+import { WorkerPool } from "./pool.js";
+import { getSparkScan } from "../sparkscan.js";
+import { addWorkerSpans, currentTrace, preciseNow, tracing } from "../tracing.js";
+import { walletKey } from "../utils.js";
+import { walletLanes } from "./lanes.js";
+import { createAdmissionController, registerAdmissionGauges } from "./admission.js";
+import { parseRates, rateFor } from "../config.js";
 import type {
   BalancePayload,
   BalanceResult,
   CreateLightningInvoicePayload,
   CreateLightningInvoiceResult,
+  CreateInvoiceWalletPayload,
+  CreateInvoiceWalletResult,
   CreateThirdPartyLightningInvoicePayload,
   CreateThirdPartyLightningInvoiceResult,
   InitializePayload,
@@ -30,15 +39,20 @@ import type {
   ClaimAllStaticDepositsResult,
   CoopExitPayload,
   CoopExitResult,
+  WatchOfferPayload,
+  WatchOfferResult,
+  UnwatchOfferPayload,
+  UnwatchOfferResult,
+  BatchPayload,
+  BatchResult,
   WorkerRequest,
-  WorkerResponse,
 } from "./types.js";
+import type { SessionCacheStats } from "./sessions.js";
 
 function mergeTimings(timings?: Record<string, number>) {
   if (!timings) return;
   for (const [name, duration] of Object.entries(timings)) {
-    if (!executionTimes[name]) executionTimes[name] = [];
-    executionTimes[name].push(duration);
+    observe("sparkproxy_operation_duration_ms", { operation: name }, duration);
   }
 }
 
@@ -49,58 +63,127 @@ function resolveWorkerUrl(): URL {
   return new URL(workerRelative, import.meta.url);
 }
 
-async function callWorker<TReqPayload, TRes>(op: WorkerRequest["op"], payload: TReqPayload, timeoutMs = 25000): Promise<TRes> {
-  const id = randomUUID();
-  const worker = new Worker(resolveWorkerUrl(), { name: "spark" });
-  try {
-    const result = await new Promise<WorkerResponse<TRes>>((resolve, reject) => {
-      const onMessage = (data: WorkerResponse<TRes>) => {
-        if (data.id === id) {
-          resolve(data);
-        }
-      };
-      const onError = (e: Error) => {
-        reject(e);
-      };
-      worker.on('message', onMessage);
-      worker.on('error', onError);
-      worker.postMessage({ id, op, payload } as WorkerRequest);
-
-      const timeout = setTimeout(() => {
-        reject(new Error("Worker timeout"));
-      }, timeoutMs);
-
-      worker.on('exit', () => clearTimeout(timeout));
-    });
-
-    mergeTimings(result.timings);
-    if (!result.ok) {
-      const err = result.error || { name: "Error", message: "Unknown worker error" };
-      const error = new Error(`${err.name}: ${err.message}`);
-      (error as any).stack = err.stack;
-      throw error;
-    }
-    return result.result as TRes;
-  } finally {
-    await worker.terminate();
+function resolvePoolSize(): number {
+  const configured = Number(process.env.SPARK_WORKER_POOL_SIZE);
+  if (Number.isInteger(configured) && configured > 0) return configured;
+  return Math.min(Math.max(availableParallelism(), 2), 8);
+}
+
+// Workers look up SparkScan through this thread (the simulator's ledger
+// when simulated), so it has to be listening before they start.
+getSparkScan();
+
+const sweepTimeoutMs = Number(process.env.SPARK_SWEEP_TIMEOUT_MS ?? 60000);
+
+// "25000" or "payLightningInvoice=90000,*=25000"; sweeps use SPARK_SWEEP_TIMEOUT_MS.
+const workerTimeouts = parseRates(process.env.WORKER_TIMEOUT_MS, 25000, "WORKER_TIMEOUT_MS");
+
+// Batches get the sweep limit unless WORKER_TIMEOUT_MS names "batch".
+const batchTimeoutMs = workerTimeouts.byOp.get("batch") ?? sweepTimeoutMs;
+
+// Sweeps and batches stop starting new transfers, claims or items well
+// before the call times out, so the work already done is reported instead
+// of lost.
+function sweepDeadline(timeoutMs: number): number {
+  return Date.now() + Math.max(timeoutMs / 2, timeoutMs - 15000);
+}
+
+export const workerPool = new WorkerPool(resolveWorkerUrl(), resolvePoolSize());
+
+const admission = createAdmissionController(workerPool.size);
+registerAdmissionGauges(admission);
+
+/**
+ * For operations that spend from the wallet: waits for the wallet's earlier
+ * spending operations to finish first (see WalletLanes). `call` runs once
+ * it is this operation's turn, so deadlines are computed after the wait.
+ */
+function serialized<TPayload extends WalletPayload, TRes>(op: WorkerRequest["op"], payload: TPayload, call: () => Promise<TRes>): Promise<TRes> {
+  return walletLanes.run(walletOf(payload)!, op, call);
+}
+
+type WalletPayload = { mnemonic: string; network: string; environment: string };
+
+function walletOf(payload: unknown): string | undefined {
+  const p = payload as Partial<WalletPayload> | null;
+  return p?.mnemonic ? walletKey(p.mnemonic, p.network ?? "", p.environment ?? "") : undefined;
+}
+
+async function callWorker<TReqPayload, TRes>(op: WorkerRequest["op"], payload: TReqPayload, timeoutMs = rateFor(workerTimeouts, op)): Promise<TRes> {
+  // Throws OverloadedError rather than queueing without bound.
+  const release = await admission.acquire(op);
+  const start = performance.now();
+  const sentAt = preciseNow();
+  const result = await workerPool.call<TRes>(op, payload, timeoutMs, {
+    context: { requestId: currentTrace()?.requestId, trace: tracing() || undefined },
+    // Keeps a wallet on the worker that already holds its session.
+    affinity: walletOf(payload),
+  }).catch((e) => {
+    increment("sparkproxy_worker_call_errors_total", { op });
+    addWorkerSpans(op, sentAt);
+    throw e;
+  }).finally(release);
+  observe("sparkproxy_worker_call_duration_ms", { op }, performance.now() - start);
+  if (result.receivedAt !== undefined) {
+    observe("sparkproxy_worker_queue_wait_ms", { op }, Math.max(0, result.receivedAt - sentAt));
+  }
+  mergeTimings(result.timings);
+  addWorkerSpans(op, sentAt, result);
+  if (!result.ok) {
+    increment("sparkproxy_worker_call_errors_total", { op });
+    const err = result.error || { name: "Error", message: "Unknown worker error" };
+    const error = new Error(`${err.name}: ${err.message}`);
+    (error as any).stack = err.stack;
+    throw error;
   }
+  return result.result as TRes;
 }
 
 export const workerClient = {
   initialize: (payload: InitializePayload, timeoutMs?: number) => callWorker<InitializePayload, InitializeResult>("initialize", payload, timeoutMs),
   balance: (payload: BalancePayload, timeoutMs?: number) => callWorker<BalancePayload, BalanceResult>("balance", payload, timeoutMs),
-  transfer: (payload: TransferPayload, timeoutMs?: number) => callWorker<TransferPayload, TransferResult>("transfer", payload, timeoutMs),
-  transferTokens: (payload: TransferTokensPayload, timeoutMs?: number) => callWorker<TransferTokensPayload, TransferTokensResult>("transferTokens", payload, timeoutMs),
-  payLightningInvoice: (payload: PayLightningInvoicePayload, timeoutMs?: number) => callWorker<PayLightningInvoicePayload, PayLightningInvoiceResult>("payLightningInvoice", payload, timeoutMs),
+  transfer: (payload: TransferPayload, timeoutMs?: number) => serialized("transfer", payload, () => callWorker<TransferPayload, TransferResult>("transfer", payload, timeoutMs)),
+  transferTokens: (payload: TransferTokensPayload, timeoutMs?: number) => serialized("transferTokens", payload, () => callWorker<TransferTokensPayload, TransferTokensResult>("transferTokens", payload, timeoutMs)),
+  payLightningInvoice: (payload: PayLightningInvoicePayload, timeoutMs?: number) => serialized("payLightningInvoice", payload, () => callWorker<PayLightningInvoicePayload, PayLightningInvoiceResult>("payLightningInvoice", payload, timeoutMs)),
   createLightningInvoice: (payload: CreateLightningInvoicePayload, timeoutMs?: number) => callWorker<CreateLightningInvoicePayload, CreateLightningInvoiceResult>("createLightningInvoice", payload, timeoutMs),
+  createInvoiceWallet: (payload: CreateInvoiceWalletPayload, timeoutMs?: number) => callWorker<CreateInvoiceWalletPayload, CreateInvoiceWalletResult>("createInvoiceWallet", payload, timeoutMs),
   createThirdPartyLightningInvoice: (payload: CreateThirdPartyLightningInvoicePayload, timeoutMs?: number) => callWorker<CreateThirdPartyLightningInvoicePayload, CreateThirdPartyLightningInvoiceResult>("createThirdPartyLightningInvoice", payload, timeoutMs),
   isOfferMet: (payload: IsOfferMetPayload, timeoutMs?: number) => callWorker<IsOfferMetPayload, IsOfferMetResult>("isOfferMet", payload, timeoutMs),
-  transferAll: (payload: TransferAllPayload, timeoutMs?: number) => callWorker<TransferAllPayload, TransferAllResult>("transferAll", payload, timeoutMs),
+  transferAll: (payload: TransferAllPayload, timeoutMs = sweepTimeoutMs) => serialized("transferAll", payload, () => callWorker<TransferAllPayload, TransferAllResult>("transferAll", { ...payload, deadline: sweepDeadline(timeoutMs) }, timeoutMs)),
   getStaticDepositAddress: (payload: GetStaticDepositAddressPayload, timeoutMs?: number) => callWorker<GetStaticDepositAddressPayload, GetStaticDepositAddressResult>("getStaticDepositAddress", payload, timeoutMs),
   getDepositUtxos: (payload: GetDepositUtxosPayload, timeoutMs?: number) => callWorker<GetDepositUtxosPayload, GetDepositUtxosResult>("getDepositUtxos", payload, timeoutMs),
-  claimStaticDeposit: (payload: ClaimStaticDepositPayload, timeoutMs?: number) => callWorker<ClaimStaticDepositPayload, ClaimStaticDepositResult>("claimStaticDeposit", payload, timeoutMs),
-  claimAllStaticDeposits: (payload: ClaimAllStaticDepositsPayload, timeoutMs?: number) => callWorker<ClaimAllStaticDepositsPayload, ClaimAllStaticDepositsResult>("claimAllStaticDeposits", payload, timeoutMs),
-  coopExit: (payload: CoopExitPayload, timeoutMs?: number) => callWorker<CoopExitPayload, CoopExitResult>("coopExit", payload, timeoutMs),
+  claimStaticDeposit: (payload: ClaimStaticDepositPayload, timeoutMs?: number) => serialized("claimStaticDeposit", payload, () => callWorker<ClaimStaticDepositPayload, ClaimStaticDepositResult>("claimStaticDeposit", payload, timeoutMs)),
+  claimAllStaticDeposits: (payload: ClaimAllStaticDepositsPayload, timeoutMs = sweepTimeoutMs) => serialized("claimAllStaticDeposits", payload, () => callWorker<ClaimAllStaticDepositsPayload, ClaimAllStaticDepositsResult>("claimAllStaticDeposits", { ...payload, deadline: sweepDeadline(timeoutMs) }, timeoutMs)),
+  coopExit: (payload: CoopExitPayload, timeoutMs?: number) => serialized("coopExit", payload, () => callWorker<CoopExitPayload, CoopExitResult>("coopExit", payload, timeoutMs)),
+  watchOffer: (payload: WatchOfferPayload, timeoutMs?: number) => callWorker<WatchOfferPayload, WatchOfferResult>("watchOffer", payload, timeoutMs),
+  batch: (payload: BatchPayload, timeoutMs = batchTimeoutMs) => serialized("batch", payload, () => callWorker<BatchPayload, BatchResult>("batch", { ...payload, deadline: sweepDeadline(timeoutMs) }, timeoutMs)),
+  // The watch lives in whichever worker accepted it, so the unwatch goes to all of them.
+  unwatchOffer: async (payload: UnwatchOfferPayload, timeoutMs = 5000): Promise<UnwatchOfferResult> => {
+    await workerPool.broadcast<UnwatchOfferResult>("unwatchOffer", payload, timeoutMs);
+    return { ok: true };
+  },
+  sessionStats: async (timeoutMs = 5000): Promise<SessionCacheStats> => {
+    const responses = await workerPool.broadcast<SessionCacheStats>("sessionStats", null, timeoutMs);
+    const total: SessionCacheStats = { size: 0, hits: 0, misses: 0, evictions: 0, pinned: 0 };
+    for (const { result } of responses) {
+      if (!result) continue;
+      total.size += result.size;
+      total.hits += result.hits;
+      total.misses += result.misses;
+      total.evictions += result.evictions;
+      total.pinned += result.pinned;
+    }
+    return total;
+  },
 };
 
-
+registerGauge("sparkproxy_worker_pool_size", "Number of Spark worker threads", () => [
+  { labels: {}, value: workerPool.size },
+]);
+registerGauge("sparkproxy_worker_pool_in_flight", "Worker operations currently in flight", () => [
+  { labels: {}, value: workerPool.inFlight },
+]);
+registerGauge("sparkproxy_wallet_session_cache", "Wallet session cache size, sessions pinned by invoice watches, and cumulative hits/misses/evictions across workers", async () => {
+  const stats = await workerClient.sessionStats();
+  return Object.entries(stats).map(([stat, value]) => ({ labels: { stat }, value }));
+});
@@ -0,0 +1,94 @@
+import { performance } from 'node:perf_hooks';
+import { increment, observe, registerGauge } from "../metrics.js";
+import { OverloadedError } from "./admission.js";
+
+export class WalletBusyError extends OverloadedError {
+  constructor(message: string) {
+    super(message);
+    this.name = "WalletBusyError";
+  }
+}
+
+type Lane = {
+  tail: Promise<void>;
+  depth: number;
+};
+
+/**
+ * Runs operations for the same wallet one at a time, in arrival order,
+ * while different wallets proceed in parallel. Spending operations that
+ * overlap on one wallet would otherwise pick the same leaves and fail or
+ * retry inside the SDK.
+ *
+ * A caller is rejected with WalletBusyError if `maxDepth` operations are
+ * already queued for the wallet, or if it waits longer than `maxWaitMs`
+ * for its turn; either way the operations behind it keep their order.
+ */
+export class WalletLanes {
+  private lanes = new Map<string, Lane>();
+
+  constructor(private readonly maxDepth: number, private readonly maxWaitMs: number) {}
+
+  async run<T>(key: string, op: string, fn: () => Promise<T>): Promise<T> {
+    let lane = this.lanes.get(key);
+    if (!lane) {
+      lane = { tail: Promise.resolve(), depth: 0 };
+      this.lanes.set(key, lane);
+    }
+    if (lane.depth >= this.maxDepth) {
+      increment("sparkproxy_wallet_lane_rejections_total", { op, reason: "full" });
+      throw new WalletBusyError(`Too many operations queued for this wallet (${lane.depth})`);
+    }
+
+    const previous = lane.tail;
+    let release!: () => void;
+    const done = new Promise<void>((resolve) => { release = resolve; });
+    // The next caller waits for both, so a caller that gives up keeps the order.
+    lane.tail = previous.then(() => done);
+    lane.depth++;
+
+    const start = performance.now();
+    try {
+      let timer: NodeJS.Timeout | undefined;
+      const waited = await Promise.race([
+        previous.then(() => true),
+        new Promise<boolean>((resolve) => { timer = setTimeout(() => resolve(false), this.maxWaitMs); }),
+      ]);
+      clearTimeout(timer);
+      observe("sparkproxy_wallet_lane_wait_ms", { op }, performance.now() - start);
+      if (!waited) {
+        increment("sparkproxy_wallet_lane_rejections_total", { op, reason: "timeout" });
+        throw new WalletBusyError(`Timed out after ${this.maxWaitMs}ms waiting for earlier operations on this wallet`);
+      }
+      return await fn();
+    } finally {
+      release();
+      lane.depth--;
+      if (lane.depth === 0 && this.lanes.get(key) === lane) this.lanes.delete(key);
+    }
+  }
+
+  // Wallets with queued operations, deepest first.
+  depths(limit: number): Array<{ key: string; depth: number }> {
+    return Array.from(this.lanes, ([key, lane]) => ({ key, depth: lane.depth }))
+      .sort((a, b) => b.depth - a.depth)
+      .slice(0, limit);
+  }
+
+  get size(): number {
+    return this.lanes.size;
+  }
+}
+
+export const walletLanes = new WalletLanes(
+  Number(process.env.WALLET_LANE_MAX_DEPTH ?? 100),
+  Number(process.env.WALLET_LANE_TIMEOUT_MS ?? 60000),
+);
+
+// Only the busiest wallets are reported, by a prefix of their walletKey(), to bound cardinality.
+registerGauge("sparkproxy_wallet_lane_depth", "Operations queued or running per wallet, for the 10 busiest wallets", () =>
+  walletLanes.depths(10).map(({ key, depth }) => ({ labels: { wallet: key.slice(0, 12) }, value: depth })),
+);
+registerGauge("sparkproxy_wallet_lanes_active", "Wallets with operations queued or running", () => [
+  { labels: {}, value: walletLanes.size },
+]);
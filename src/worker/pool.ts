@@ -0,0 +1,174 @@
+import { Worker } from 'node:worker_threads';
+import { EventEmitter } from 'node:events';
+import { randomUUID } from 'node:crypto';
+import type { CancelPayload, WorkerEvent, WorkerOp, WorkerRequest, WorkerResponse } from "./types.js";
+
+type PoolSlot = {
+  index: number;
+  worker: Worker;
+  threadId: number;
+  inFlight: number;
+};
+
+// Tracing fields forwarded with a request; see tracing.ts.
+export type CallContext = Pick<WorkerRequest, "requestId" | "trace">;
+
+export type CallOptions = {
+  context?: CallContext;
+  // Calls with the same affinity key always go to the same worker.
+  affinity?: string;
+};
+
+// FNV-1a; only needs to spread keys evenly, not resist collisions.
+function hash32(value: string): number {
+  let h = 0x811c9dc5;
+  for (let i = 0; i < value.length; i++) {
+    h ^= value.charCodeAt(i);
+    h = Math.imul(h, 0x01000193);
+  }
+  return h >>> 0;
+}
+
+type PendingCall = {
+  slot: PoolSlot;
+  timer: NodeJS.Timeout;
+  resolve: (data: WorkerResponse<any>) => void;
+  reject: (e: Error) => void;
+};
+
+/**
+ * Fixed-size pool of long-lived Spark workers.
+ *
+ * Each worker evaluates the Spark SDK once and then serves many requests
+ * concurrently; responses are matched back to callers by request `id`.
+ * Crashed workers are replaced in the same slot and their in-flight calls
+ * are rejected.
+ *
+ * Calls with an affinity key (a wallet) are routed by rendezvous hashing,
+ * so a wallet's operations share one worker and its cached session, and
+ * only 1/n of wallets move if the pool size changes. Other calls go to the
+ * least busy worker.
+ *
+ * Emits "event" for unsolicited WorkerEvent messages and "workerExit" with
+ * the thread id of a worker that died, so that state held inside it (such
+ * as offer watches) can be re-established.
+ */
+export class WorkerPool extends EventEmitter {
+  private slots: PoolSlot[] = [];
+  private pending = new Map<string, PendingCall>();
+  private closed = false;
+
+  constructor(private readonly url: URL, readonly size: number) {
+    super();
+    if (!Number.isInteger(size) || size < 1) {
+      throw new Error(`Invalid worker pool size: ${size}`);
+    }
+    for (let i = 0; i < size; i++) {
+      this.slots.push(this.spawn(i));
+    }
+  }
+
+  private spawn(index: number): PoolSlot {
+    const worker = new Worker(this.url, { name: `spark-${index}` });
+    const slot: PoolSlot = { index, worker, threadId: worker.threadId, inFlight: 0 };
+    worker.on('message', (data: WorkerResponse | WorkerEvent) => this.onMessage(data));
+    worker.on('error', (e: Error) => this.onWorkerExit(slot, e));
+    worker.on('exit', (code: number) => this.onWorkerExit(slot, new Error(`Worker exited with code ${code}`)));
+    return slot;
+  }
+
+  private onMessage(data: WorkerResponse | WorkerEvent) {
+    if ("event" in data) {
+      this.emit("event", data);
+      return;
+    }
+    const call = this.pending.get(data.id);
+    // Responses for calls that already timed out are dropped here.
+    if (!call) return;
+    this.settle(data.id, call);
+    call.resolve(data);
+  }
+
+  private onWorkerExit(slot: PoolSlot, e: Error) {
+    // 'error' is followed by 'exit'; only handle the first one per slot.
+    if (this.slots[slot.index] !== slot) return;
+    for (const [id, call] of this.pending) {
+      if (call.slot === slot) {
+        this.settle(id, call);
+        call.reject(e);
+      }
+    }
+    this.emit("workerExit", slot.threadId);
+    if (this.closed) return;
+    console.warn(`Spark worker ${slot.index} died, respawning:`, e.message);
+    this.slots[slot.index] = this.spawn(slot.index);
+  }
+
+  private settle(id: string, call: PendingCall) {
+    clearTimeout(call.timer);
+    call.slot.inFlight--;
+    this.pending.delete(id);
+  }
+
+  private leastBusy(): PoolSlot {
+    let best = this.slots[0];
+    for (const slot of this.slots) {
+      if (slot.inFlight < best.inFlight) best = slot;
+    }
+    return best;
+  }
+
+  private slotFor(affinity: string): PoolSlot {
+    let best = this.slots[0];
+    let bestScore = -1;
+    for (const slot of this.slots) {
+      const score = hash32(`${slot.index}:${affinity}`);
+      if (score > bestScore) {
+        best = slot;
+        bestScore = score;
+      }
+    }
+    return best;
+  }
+
+  call<TRes>(op: WorkerOp, payload: unknown, timeoutMs: number, options: CallOptions = {}): Promise<WorkerResponse<TRes>> {
+    const slot = options.affinity !== undefined ? this.slotFor(options.affinity) : this.leastBusy();
+    return this.dispatch<TRes>(slot, op, payload, timeoutMs, options.context);
+  }
+
+  /**
+   * Sends the same request to every worker, e.g. to collect per-worker stats.
+   */
+  broadcast<TRes>(op: WorkerOp, payload: unknown, timeoutMs: number): Promise<Array<WorkerResponse<TRes>>> {
+    return Promise.all(this.slots.map((slot) => this.dispatch<TRes>(slot, op, payload, timeoutMs)));
+  }
+
+  private dispatch<TRes>(slot: PoolSlot, op: WorkerOp, payload: unknown, timeoutMs: number, context?: CallContext): Promise<WorkerResponse<TRes>> {
+    if (this.closed) {
+      return Promise.reject(new Error("Worker pool is closed"));
+    }
+    const id = randomUUID();
+    return new Promise<WorkerResponse<TRes>>((resolve, reject) => {
+      const timer = setTimeout(() => {
+        const call = this.pending.get(id);
+        if (!call) return;
+        this.settle(id, call);
+        // Lets the worker skip whatever it has not started yet, such as the SDK call after a slow wallet load.
+        slot.worker.postMessage({ id: randomUUID(), op: "cancel", payload: { id } satisfies CancelPayload } as WorkerRequest);
+        reject(new Error("Worker timeout"));
+      }, timeoutMs);
+      this.pending.set(id, { slot, timer, resolve, reject });
+      slot.inFlight++;
+      slot.worker.postMessage({ id, op, payload, ...context } as WorkerRequest);
+    });
+  }
+
+  get inFlight(): number {
+    return this.pending.size;
+  }
+
+  async close(): Promise<void> {
+    this.closed = true;
+    await Promise.all(this.slots.map((slot) => slot.worker.terminate()));
+  }
+}
@@ -0,0 +1,35 @@
+import { Network, SparkWallet, encodeSparkAddress, SparkSdkLogger } from "@buildonspark/spark-sdk";
+import { LoggingLevel } from "@lightsparkdev/core";
+import { devSparkConfig } from "../utils.js";
+import { ChannelSparkScan } from "../sparkscan.js";
+import type { BackendWallet, InitializeOptions, SparkBackend } from "./backend.js";
+import type { NetworkName } from "./types.js";
+
+/**
+ * The real Spark network, through the Spark SDK and the SparkScan API (via
+ * the main thread's shared client).
+ */
+export class SdkBackend implements SparkBackend {
+  readonly name = "sdk";
+  readonly sparkscan = new ChannelSparkScan();
+
+  async initialize(options: InitializeOptions): Promise<{ mnemonic: string; wallet: BackendWallet }> {
+    if (options.mnemonic) {
+      SparkSdkLogger.setAllEnabled(true);
+      SparkSdkLogger.setAllLevels(LoggingLevel.Trace);
+    }
+    const { mnemonic, wallet } = await SparkWallet.initialize({
+      ...(options.mnemonic ? { mnemonicOrSeed: options.mnemonic } : {}),
+      options: {
+        ...(options.environment === "dev" ? devSparkConfig : {}),
+        network: options.network as keyof typeof Network,
+        optimizationOptions: { multiplicity: 2 },
+      },
+    });
+    return { mnemonic: options.mnemonic ?? mnemonic!, wallet: wallet as unknown as BackendWallet };
+  }
+
+  encodeSparkAddress(identityPublicKey: string, network: NetworkName): string {
+    return encodeSparkAddress({ identityPublicKey, network: network as keyof typeof Network });
+  }
+}
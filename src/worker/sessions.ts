@@ -0,0 +1,141 @@
+import type { BackendWallet } from "./backend.js";
+
+type Session = {
+  key: string;
+  ready: Promise<BackendWallet>;
+  wallet: BackendWallet | null;
+  refs: number;
+  pins: number;
+  lastUsed: number;
+};
+
+export type SessionCacheStats = {
+  size: number;
+  hits: number;
+  misses: number;
+  evictions: number;
+  pinned: number;
+};
+
+/**
+ * Keeps connected wallets alive between requests handled by this worker.
+ *
+ * Sessions are keyed by a hash of (mnemonic, network, environment), shared
+ * by concurrent callers while in use, and shut down once they have been idle
+ * for `ttlMs` or when the cache grows past `maxSize` (least recently used
+ * first). A `ttlMs` of 0 disables caching: wallets are closed on release.
+ * Pinned sessions, which invoice watches hold open until unwatched, do not
+ * count against `maxSize`, so watches cannot crowd out the idle wallets.
+ */
+export class WalletSessionCache {
+  private sessions = new Map<string, Session>();
+  private byWallet = new Map<BackendWallet, Session>();
+  private hits = 0;
+  private misses = 0;
+  private evictions = 0;
+  private pinned = 0;
+
+  constructor(private readonly ttlMs: number, private readonly maxSize: number) {
+    if (ttlMs > 0) {
+      setInterval(() => this.sweep(), Math.min(ttlMs, 30_000)).unref();
+    }
+  }
+
+  get enabled(): boolean {
+    return this.ttlMs > 0 && this.maxSize > 0;
+  }
+
+  async acquire(key: string, load: () => Promise<BackendWallet>): Promise<BackendWallet> {
+    if (!this.enabled) {
+      return load();
+    }
+    let session = this.sessions.get(key);
+    if (session) {
+      this.hits++;
+      // Re-insert to keep the map ordered from least to most recently used.
+      this.sessions.delete(key);
+      this.sessions.set(key, session);
+    } else {
+      this.misses++;
+      const created: Session = { key, ready: load(), wallet: null, refs: 0, pins: 0, lastUsed: Date.now() };
+      created.ready.then(
+        (wallet) => {
+          created.wallet = wallet;
+          this.byWallet.set(wallet, created);
+        },
+        () => {
+          if (this.sessions.get(key) === created) this.sessions.delete(key);
+        }
+      );
+      this.sessions.set(key, created);
+      session = created;
+      this.evictOverflow();
+    }
+    session.refs++;
+    try {
+      return await session.ready;
+    } catch (e) {
+      session.refs--;
+      throw e;
+    }
+  }
+
+  async release(wallet: BackendWallet): Promise<void> {
+    const session = this.byWallet.get(wallet);
+    if (!session) {
+      // Not cached (caching disabled or session already evicted).
+      await wallet.cleanupConnections();
+      return;
+    }
+    session.refs--;
+    session.lastUsed = Date.now();
+    if (session.refs === 0 && this.sessions.get(session.key) !== session) {
+      // Evicted while in use; close it now that the last caller is done.
+      await this.close(session);
+    }
+  }
+
+  // For an acquired wallet that stays in use indefinitely; undone by unpin().
+  pin(wallet: BackendWallet) {
+    const session = this.byWallet.get(wallet);
+    if (session && session.pins++ === 0) this.pinned++;
+  }
+
+  unpin(wallet: BackendWallet) {
+    const session = this.byWallet.get(wallet);
+    if (session && session.pins > 0 && --session.pins === 0) this.pinned--;
+  }
+
+  stats(): SessionCacheStats {
+    return { size: this.sessions.size, hits: this.hits, misses: this.misses, evictions: this.evictions, pinned: this.pinned };
+  }
+
+  private evictOverflow() {
+    for (const session of this.sessions.values()) {
+      // Pinned sessions are in use, so they are never evicted here either.
+      if (this.sessions.size - this.pinned <= this.maxSize) break;
+      if (session.refs === 0 && session.wallet) this.evict(session);
+    }
+  }
+
+  private sweep() {
+    const cutoff = Date.now() - this.ttlMs;
+    for (const session of Array.from(this.sessions.values())) {
+      if (session.refs === 0 && session.wallet && session.lastUsed < cutoff) this.evict(session);
+    }
+  }
+
+  private evict(session: Session) {
+    this.sessions.delete(session.key);
+    this.evictions++;
+    if (session.refs === 0) {
+      this.close(session).catch(() => {});
+    }
+  }
+
+  private async close(session: Session) {
+    if (!session.wallet) return;
+    this.byWallet.delete(session.wallet);
+    await session.wallet.cleanupConnections();
+  }
+}
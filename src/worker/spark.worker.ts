@@ -1,18 +1,26 @@
-import { parentPort } from 'node:worker_threads';
+import { parentPort, threadId } from 'node:worker_threads';
 import { performance } from 'node:perf_hooks'
-import { type Bech32mTokenIdentifier, Network, SparkWallet, encodeSparkAddress, SparkSdkLogger } from "@buildonspark/spark-sdk";
-import { LoggingLevel } from "@lightsparkdev/core";
+import { AsyncLocalStorage } from 'node:async_hooks';
 import type {
   BalancePayload,
   BalanceResult,
   CreateLightningInvoicePayload,
   CreateLightningInvoiceResult,
+  CreateInvoiceWalletPayload,
+  CreateInvoiceWalletResult,
   CreateThirdPartyLightningInvoicePayload,
   CreateThirdPartyLightningInvoiceResult,
   InitializePayload,
   InitializeResult,
   IsOfferMetPayload,
   IsOfferMetResult,
+  MatchCursor,
+  MatchResume,
+  WatchOfferPayload,
+  WatchOfferResult,
+  UnwatchOfferPayload,
+  UnwatchOfferResult,
+  WorkerEvent,
   PayLightningInvoicePayload,
   PayLightningInvoiceResult,
   TransferAllPayload,
@@ -33,64 +41,133 @@ import type {
   CoopExitResult,
   DepositUtxo,
   ClaimedDeposit,
+  FailedClaim,
+  SweptBalance,
   ExitSpeed,
+  NetworkName,
+  BatchItem,
+  BatchItemResult,
+  BatchPayload,
+  BatchResult,
+  WorkerError,
+  CancelPayload,
+  TraceSpan,
   WorkerRequest,
   WorkerResponse,
 } from "./types.js";
 
-import { devSparkConfig } from "../utils.js";
+import { walletKey } from "../utils.js";
+import { preciseNow } from "../tracing.js";
+import { WalletSessionCache } from "./sessions.js";
+import { type BackendWallet, loadSparkBackend } from "./backend.js";
 
 type Timings = Record<string, number>;
 
+type RequestContext = {
+  // Collected only when the caller is tracing the request.
+  spans?: TraceSpan[];
+  // Aborted when the caller gives up on the request (see the "cancel" op).
+  signal: AbortSignal;
+};
+
+const requestContext = new AsyncLocalStorage<RequestContext>();
+const inFlight = new Map<string, AbortController>();
+
+function cancelled(): boolean {
+  return requestContext.getStore()?.signal.aborted ?? false;
+}
+
+// Called before each step that would change the wallet, so a request the
+// caller has timed out on does not go on to move funds.
+function throwIfCancelled() {
+  if (!cancelled()) return;
+  const e = new Error("The caller timed out before this step started");
+  e.name = "CancelledError";
+  throw e;
+}
+
 async function measure<T>(name: string, fn: () => Promise<T>, timings: Timings): Promise<T> {
   const start = performance.now();
-  const result = await fn();
-  const end = performance.now();
-  timings[name] = (timings[name] || 0) + (end - start);
-  return result;
-}
-
-async function loadWalletWithOptions(mnemonic: string, network: keyof typeof Network, environment: "dev" | "prod", timings: Timings) {
-  SparkSdkLogger.setAllEnabled(true);
-  SparkSdkLogger.setAllLevels(LoggingLevel.Trace);
-
-  const { wallet } = await measure("loadWallet", async () =>
-    SparkWallet.initialize({
-      mnemonicOrSeed: mnemonic,
-      options: { ...(environment === "dev" ? devSparkConfig : {}), network, optimizationOptions: { multiplicity: 2 } },
-    })
-  , timings);
-
-  await new Promise((resolve) => {
-    wallet.on("stream:connected", () => resolve(true));
-    setTimeout(() => resolve(true), 5000);
+  const startedAt = preciseNow();
+  try {
+    return await fn();
+  } finally {
+    const duration = performance.now() - start;
+    timings[name] = (timings[name] || 0) + duration;
+    requestContext.getStore()?.spans?.push({ name, start: startedAt, durationMs: duration });
+  }
+}
+
+// The real Spark SDK, or the simulator when SPARK_BACKEND=simulated.
+const backend = await loadSparkBackend();
+
+const sessions = new WalletSessionCache(
+  Number(process.env.SPARK_SESSION_TTL_MS ?? 5 * 60 * 1000),
+  Number(process.env.SPARK_SESSION_MAX ?? 200),
+);
+
+async function loadWalletWithOptions(mnemonic: string, network: NetworkName, environment: "dev" | "prod", timings: Timings) {
+  const wallet = await sessions.acquire(walletKey(mnemonic, network, environment), async () => {
+    const { wallet } = await measure("loadWallet", () => backend.initialize({ mnemonic, network, environment }), timings);
+
+    await measure("streamConnected", () => new Promise((resolve) => {
+      wallet.on("stream:connected", () => resolve(true));
+      setTimeout(() => resolve(true), 5000);
+    }), timings);
+    return wallet;
   });
+  if (cancelled()) {
+    // The handler never sees this wallet, so it cannot release it.
+    await sessions.release(wallet).catch(() => {});
+    throwIfCancelled();
+  }
   return wallet;
 }
 
+const sweepConcurrency = Math.max(1, Number(process.env.SPARK_SWEEP_CONCURRENCY ?? 4));
+
+/**
+ * Runs fn over items in order with at most `limit` in flight, and stops
+ * starting new items once `deadline` (epoch ms) has passed so the caller
+ * can answer before its timeout. Returns how many items were started;
+ * those are always a prefix of `items`.
+ */
+async function forEachConcurrent<T>(items: T[], limit: number, deadline: number | undefined, fn: (item: T) => Promise<void>): Promise<number> {
+  let next = 0;
+  const run = async () => {
+    while (next < items.length && (deadline === undefined || Date.now() < deadline) && !cancelled()) {
+      await fn(items[next++]);
+    }
+  };
+  await Promise.all(Array.from({ length: Math.min(limit, items.length) }, run));
+  return next;
+}
+
 function ok<T>(id: string, result: T, timings: Timings): WorkerResponse<T> {
   return { id, ok: true, result, timings };
 }
 
-function err(id: string, e: unknown, timings: Timings): WorkerResponse<never> {
+function toWorkerError(e: unknown): WorkerError {
   if (e instanceof Error) {
-    return { id, ok: false, error: { name: e.name, message: e.message, stack: e.stack }, timings };
+    return { name: e.name, message: e.message, stack: e.stack };
   }
-  return { id, ok: false, error: { name: "Error", message: String(e) }, timings };
+  return { name: "Error", message: String(e) };
+}
+
+function err(id: string, e: unknown, timings: Timings): WorkerResponse<never> {
+  return { id, ok: false, error: toWorkerError(e), timings };
 }
 
 async function handleInitialize(id: string, payload: InitializePayload): Promise<WorkerResponse<InitializeResult>> {
   const timings: Timings = {};
   try {
     const { mnemonic, wallet } = await measure("initialize", () =>
-      SparkWallet.initialize({
-        options: { ...(payload.environment === "dev" ? devSparkConfig : {}), network: payload.network as keyof typeof Network, optimizationOptions: { multiplicity: 2 } },
-      }),
+      backend.initialize({ network: payload.network, environment: payload.environment }),
       timings
     );
     const address = await measure("getSparkAddress", () => wallet.getSparkAddress(), timings);
     await measure("cleanupConnections", () => wallet.cleanupConnections(), timings);
-    return ok(id, { mnemonic: mnemonic!, address }, timings);
+    return ok(id, { mnemonic, address }, timings);
   } catch (e) {
     console.error(e);
     return err(id, e, timings);
@@ -99,13 +176,13 @@ async function handleInitialize(id: string, payload: InitializePayload): Promise
 
 async function handleBalance(id: string, payload: BalancePayload): Promise<WorkerResponse<BalanceResult>> {
   const timings: Timings = {};
-  let wallet: SparkWallet | null = null;
+  let wallet: BackendWallet | null = null;
   try {
-    wallet = await loadWalletWithOptions(payload.mnemonic, payload.network as keyof typeof Network, payload.environment, timings);
+    wallet = await loadWalletWithOptions(payload.mnemonic, payload.network, payload.environment, timings);
     const { balance, tokenBalances } = await measure("getBalance", () => wallet!.getBalance(), timings);
-    const address = await measure("getSparkAddress", () => wallet!.getSparkAddress(), timings);
+    const address = payload.address ?? await measure("getSparkAddress", () => wallet!.getSparkAddress(), timings);
     const result: BalanceResult = {
-      address,
+      address: address as BalanceResult["address"],
       balance: Number(balance),
       tokenBalances: Array.from(tokenBalances.entries()).map(([tokenIdentifier, tokenBalance]) => ({
         balance: Number(tokenBalance.availableToSendBalance),
@@ -124,15 +201,15 @@ async function handleBalance(id: string, payload: BalancePayload): Promise<Worke
     console.error(e);
     return err(id, e, timings);
   } finally {
-    if (wallet) await measure("cleanupConnections", () => wallet!.cleanupConnections(), timings).catch(() => {});
+    if (wallet) await measure("releaseWallet", () => sessions.release(wallet!), timings).catch(() => {});
   }
 }
 
 async function handleTransfer(id: string, payload: TransferPayload): Promise<WorkerResponse<TransferResult>> {
   const timings: Timings = {};
-  let wallet: SparkWallet | null = null;
+  let wallet: BackendWallet | null = null;
   try {
-    wallet = await loadWalletWithOptions(payload.mnemonic, payload.network as keyof typeof Network, payload.environment, timings);
+    wallet = await loadWalletWithOptions(payload.mnemonic, payload.network, payload.environment, timings);
     const { id: txid } = await measure("transfer", () => wallet!.transfer({
       amountSats: payload.amountSats,
       receiverSparkAddress: payload.receiverSparkAddress,
@@ -142,15 +219,15 @@ async function handleTransfer(id: string, payload: TransferPayload): Promise<Wor
     console.error(e);
     return err(id, e, timings);
   } finally {
-    if (wallet) await measure("cleanupConnections", () => wallet!.cleanupConnections(), timings).catch(() => {});
+    if (wallet) await measure("releaseWallet", () => sessions.release(wallet!), timings).catch(() => {});
   }
 }
 
 async function handleTransferTokens(id: string, payload: TransferTokensPayload): Promise<WorkerResponse<TransferTokensResult>> {
   const timings: Timings = {};
-  let wallet: SparkWallet | null = null;
+  let wallet: BackendWallet | null = null;
   try {
-    wallet = await loadWalletWithOptions(payload.mnemonic, payload.network as keyof typeof Network, payload.environment, timings);
+    wallet = await loadWalletWithOptions(payload.mnemonic, payload.network, payload.environment, timings);
     const txid = await measure(
       "transferTokens",
       () => wallet!.transferTokens({
@@ -165,15 +242,15 @@ async function handleTransferTokens(id: string, payload: TransferTokensPayload):
     console.error(e);
     return err(id, e, timings);
   } finally {
-    if (wallet) await measure("cleanupConnections", () => wallet!.cleanupConnections(), timings).catch(() => {});
+    if (wallet) await measure("releaseWallet", () => sessions.release(wallet!), timings).catch(() => {});
   }
 }
 
 async function handlePayLightningInvoice(id: string, payload: PayLightningInvoicePayload): Promise<WorkerResponse<PayLightningInvoiceResult>> {
   const timings: Timings = {};
-  let wallet: SparkWallet | null = null;
+  let wallet: BackendWallet | null = null;
   try {
-    wallet = await loadWalletWithOptions(payload.mnemonic, payload.network as keyof typeof Network, payload.environment, timings);
+    wallet = await loadWalletWithOptions(payload.mnemonic, payload.network, payload.environment, timings);
     const { id: txid } = await measure("payLightningInvoice", () => wallet!.payLightningInvoice({
       invoice: payload.invoice,
       maxFeeSats: payload.maxFeeSats,
@@ -183,15 +260,15 @@ async function handlePayLightningInvoice(id: string, payload: PayLightningInvoic
     console.error(e);
     return err(id, e, timings);
   } finally {
-    if (wallet) await measure("cleanupConnections", () => wallet!.cleanupConnections(), timings).catch(() => {});
+    if (wallet) await measure("releaseWallet", () => sessions.release(wallet!), timings).catch(() => {});
   }
 }
 
 async function handleCreateLightningInvoice(id: string, payload: CreateLightningInvoicePayload): Promise<WorkerResponse<CreateLightningInvoiceResult>> {
   const timings: Timings = {};
-  let wallet: SparkWallet | null = null;
+  let wallet: BackendWallet | null = null;
   try {
-    wallet = await loadWalletWithOptions(payload.mnemonic, payload.network as keyof typeof Network, payload.environment, timings);
+    wallet = await loadWalletWithOptions(payload.mnemonic, payload.network, payload.environment, timings);
     const { invoice } = await measure("createLightningInvoice", () => wallet!.createLightningInvoice({
       amountSats: payload.amountSats,
       memo: payload.memo,
@@ -201,6 +278,39 @@ async function handleCreateLightningInvoice(id: string, payload: CreateLightning
   } catch (e) {
     console.error(e);
     return err(id, e, timings);
+  } finally {
+    if (wallet) await measure("releaseWallet", () => sessions.release(wallet!), timings).catch(() => {});
+  }
+}
+
+/**
+ * Wallet creation and the invoice in one bootstrap: a new wallet would
+ * otherwise be initialized once to get its mnemonic and again, waiting for
+ * its event stream, to issue the invoice. Neither step needs the stream,
+ * so the session is not cached; whoever watches the wallet loads it.
+ */
+async function handleCreateInvoiceWallet(id: string, payload: CreateInvoiceWalletPayload): Promise<WorkerResponse<CreateInvoiceWalletResult>> {
+  const timings: Timings = {};
+  let wallet: BackendWallet | null = null;
+  try {
+    const created = await measure("initialize", () =>
+      backend.initialize({ network: payload.network, environment: payload.environment }),
+      timings
+    );
+    wallet = created.wallet;
+    const amountSats = payload.amountSats;
+    const [address, invoice] = await Promise.all([
+      measure("getSparkAddress", () => wallet!.getSparkAddress(), timings),
+      amountSats === undefined ? null : measure("createLightningInvoice", () => wallet!.createLightningInvoice({
+        amountSats,
+        memo: payload.memo,
+        expirySeconds: payload.expirySeconds,
+      }), timings),
+    ]);
+    return ok(id, { mnemonic: created.mnemonic, address, invoice: invoice?.invoice.encodedInvoice ?? null }, timings);
+  } catch (e) {
+    console.error(e);
+    return err(id, e, timings);
   } finally {
     if (wallet) await measure("cleanupConnections", () => wallet!.cleanupConnections(), timings).catch(() => {});
   }
@@ -208,13 +318,11 @@ async function handleCreateLightningInvoice(id: string, payload: CreateLightning
 
 async function handleCreateThirdPartyLightningInvoice(id: string, payload: CreateThirdPartyLightningInvoicePayload): Promise<WorkerResponse<CreateThirdPartyLightningInvoiceResult>> {
   const timings: Timings = {};
-  let wallet: SparkWallet | null = null;
+  let wallet: BackendWallet | null = null;
   try {
     // Initialize a temporary wallet just to create the invoice for the third party
     const { wallet: tempWallet } = await measure("initialize", () =>
-      SparkWallet.initialize({
-        options: { ...(payload.environment === "dev" ? devSparkConfig : {}), network: payload.network as keyof typeof Network, optimizationOptions: { multiplicity: 2 } },
-      }),
+      backend.initialize({ network: payload.network, environment: payload.environment }),
       timings
     );
     wallet = tempWallet;
@@ -234,110 +342,328 @@ async function handleCreateThirdPartyLightningInvoice(id: string, payload: Creat
   }
 }
 
+const MATCH_PAGE_SIZE = 50;
+const MATCH_MAX_PAGES = 20;
+// Spark operators and this host may disagree slightly about the time.
+const MATCH_CLOCK_SKEW_MS = 60_000;
+
+function emptyCursor(): MatchCursor {
+  return { transferId: null, transactionId: null, receivedSats: 0, receivedTokens: {}, senders: {} };
+}
+
+function noteSender(cursor: MatchCursor, asset: string, sender: string | null) {
+  if (!(asset in cursor.senders)) cursor.senders[asset] = sender;
+  else if (cursor.senders[asset] !== sender) cursor.senders[asset] = null;
+}
+
+/**
+ * Pages through a newest-first history until it reaches `stopId` (the
+ * newest entry of the previous read) or an entry older than `since`.
+ * Returns the unseen entries and the id to stop at next time. A read that
+ * hits the page limit first also returns where to resume: the entries
+ * below the last one read are still unseen, so the stop id stays put.
+ */
+async function readSince<T>(
+  name: string,
+  fetchPage: (limit: number, offset: number) => Promise<T[]>,
+  entryId: (entry: T) => string | undefined,
+  entryTime: (entry: T) => number | undefined,
+  stopId: string | null,
+  since: number | undefined,
+  resume: MatchResume | undefined,
+  timings: Timings,
+): Promise<{ entries: T[]; stopId: string | null; resume?: MatchResume }> {
+  const entries: T[] = [];
+  const seen = new Set<string>();
+  let newestId: string | null = resume?.newestId ?? null;
+  // The oldest entry read, and how many entries up to and including it.
+  let last: { id: string; offset: number; count: number } | null = null;
+  let exhausted = false;
+  // Newer entries push the resume point down, never up, so it is at or
+  // below its last offset; the entries before it were counted already.
+  let skipping = resume !== undefined;
+  let offset = resume?.offset ?? 0;
+  for (let page = 0; page < MATCH_MAX_PAGES; page++) {
+    const batch = await measure(name, () => fetchPage(MATCH_PAGE_SIZE, offset), timings);
+    for (const [i, entry] of batch.entries()) {
+      const id = entryId(entry);
+      if (skipping) {
+        if (id === resume!.id) skipping = false;
+        continue;
+      }
+      const time = entryTime(entry);
+      if ((id !== undefined && id === stopId) || (since !== undefined && time !== undefined && time < since)) {
+        return { entries, stopId: newestId ?? stopId };
+      }
+      if (id !== undefined) {
+        // Entries arriving between pages shift the offsets.
+        if (seen.has(id)) continue;
+        seen.add(id);
+        newestId ??= id;
+        last = { id, offset: offset + i, count: entries.length + 1 };
+      }
+      entries.push(entry);
+    }
+    offset += batch.length;
+    if (batch.length < MATCH_PAGE_SIZE) {
+      exhausted = true;
+      break;
+    }
+  }
+  if (skipping) {
+    // The resume point is gone from the history, so the entries below it cannot be found.
+    console.warn(`${name}: resume point ${resume!.id} not found; older entries are not counted`);
+    return { entries, stopId: newestId ?? stopId };
+  }
+  if (exhausted) {
+    return { entries, stopId: newestId ?? stopId };
+  }
+  if (!last) {
+    return resume ? { entries, stopId, resume } : { entries, stopId: newestId ?? stopId };
+  }
+  // Entries without an id after the last one are read again next time.
+  return { entries: entries.slice(0, last.count), stopId, resume: { id: last.id, offset: last.offset, newestId: newestId! } };
+}
+
+/**
+ * Adds the incoming payments made since the cursor to its running totals
+ * and reports whether any offer is covered by payments inside the
+ * invoice's time window. The cursor is returned for the caller to store.
+ */
+async function checkOffers(wallet: BackendWallet, payload: IsOfferMetPayload, timings: Timings): Promise<IsOfferMetResult> {
+  const cursor: MatchCursor = structuredClone(payload.cursor ?? emptyCursor());
+  const since = payload.since === undefined ? undefined : payload.since - MATCH_CLOCK_SKEW_MS;
+
+  // Nothing is worth reading until the balance covers an offer.
+  const balance = await measure("getBalance", () => wallet.getBalance(), timings);
+  const funded = payload.offers.filter((offer) => offer.asset === "BITCOIN"
+    ? balance.balance >= offer.amount
+    : (balance.tokenBalances.get(offer.tokenIdentifier)?.availableToSendBalance ?? 0n) >= offer.amount);
+  if (funded.length === 0) {
+    return { paid: false, sending_address: null, cursor };
+  }
+
+  if (funded.some((offer) => offer.asset === "BITCOIN")) {
+    const { entries, stopId, resume } = await readSince(
+      "getTransfers",
+      (limit, offset) => wallet.getTransfers(limit, offset).then((result) => result.transfers),
+      (transfer) => transfer.id,
+      (transfer) => transfer.createdTime?.getTime(),
+      cursor.transferId,
+      since,
+      cursor.transferResume,
+      timings,
+    );
+    for (const transfer of entries) {
+      if (transfer.transferDirection !== "INCOMING") continue;
+      cursor.receivedSats += Number(transfer.totalValue);
+      noteSender(cursor, "BITCOIN", backend.encodeSparkAddress(transfer.senderIdentityPublicKey, payload.network));
+    }
+    cursor.transferId = stopId;
+    cursor.transferResume = resume;
+  }
+
+  if (funded.some((offer) => offer.asset === "TOKEN")) {
+    const address = await measure("getSparkAddress", () => wallet.getSparkAddress(), timings);
+    const { entries, stopId, resume } = await readSince(
+      "sparkscan",
+      (limit, offset) => backend.sparkscan.addressTransactions(address, payload.network, limit, offset),
+      (tx) => tx.id,
+      (tx) => (tx.createdAt ? Date.parse(tx.createdAt) : undefined),
+      cursor.transactionId,
+      since,
+      cursor.transactionResume,
+      timings,
+    );
+    for (const tx of entries) {
+      const tokenIdentifier = tx.tokenMetadata?.tokenIdentifier;
+      if (tx.type !== "token_transfer" || tx.direction !== "incoming" || !tokenIdentifier) continue;
+      if (tx.tokenAmount === undefined) {
+        // Crediting the balance instead would count it again for every such entry.
+        console.warn(`Skipping token transaction ${tx.id} without an amount`);
+        continue;
+      }
+      cursor.receivedTokens[tokenIdentifier] = (cursor.receivedTokens[tokenIdentifier] ?? 0) + Number(tx.tokenAmount);
+      noteSender(cursor, tokenIdentifier, tx.counterparty?.identifier ?? null);
+    }
+    cursor.transactionId = stopId;
+    cursor.transactionResume = resume;
+  }
+
+  for (const offer of funded) {
+    const asset = offer.asset === "BITCOIN" ? "BITCOIN" : offer.tokenIdentifier;
+    const received = offer.asset === "BITCOIN" ? cursor.receivedSats : cursor.receivedTokens[offer.tokenIdentifier] ?? 0;
+    if (received >= offer.amount) {
+      return { paid: true, sending_address: cursor.senders[asset] ?? null, cursor };
+    }
+  }
+  return { paid: false, sending_address: null, cursor };
+}
+
 async function handleIsOfferMet(id: string, payload: IsOfferMetPayload): Promise<WorkerResponse<IsOfferMetResult>> {
   const timings: Timings = {};
-  let wallet: SparkWallet | null = null;
+  let wallet: BackendWallet | null = null;
   try {
-    wallet = await loadWalletWithOptions(payload.mnemonic, payload.network as keyof typeof Network, payload.environment, timings);
-    const balance = await measure("getBalance", () => wallet!.getBalance(), timings);
-    for (const offer of payload.offers) {
-      if (offer.asset === "BITCOIN") {
-        if (balance.balance >= offer.amount) {
-          const result = await measure("getTransfers", () => wallet!.getTransfers(10, 0), timings);
-          if (result.transfers.length > 0) {
-            for (const transfer of result.transfers) {
-              if (transfer.transferDirection === "INCOMING") {
-                return ok(id, {
-                  paid: true,
-                  sending_address: encodeSparkAddress({
-                    identityPublicKey: transfer.senderIdentityPublicKey,
-                    network: payload.network as keyof typeof Network,
-                  }),
-                }, timings);
-              }
-            }
-          }
-          return ok(id, { paid: true, sending_address: null }, timings);
+    wallet = await loadWalletWithOptions(payload.mnemonic, payload.network, payload.environment, timings);
+    return ok(id, await checkOffers(wallet, payload, timings), timings);
+  } catch (e) {
+    console.error(e);
+    return err(id, e, timings);
+  } finally {
+    if (wallet) await measure("releaseWallet", () => sessions.release(wallet!), timings).catch(() => {});
+  }
+}
+
+type OfferWatch = {
+  wallet: BackendWallet;
+  onTransfer: () => void;
+};
+
+// Watched wallets keep their session (and its stream) open until unwatched,
+// pinned so that they are not counted against SPARK_SESSION_MAX.
+const watches = new Map<string, OfferWatch>();
+
+async function unwatchOffer(watchId: string) {
+  const watch = watches.get(watchId);
+  if (!watch) return;
+  watches.delete(watchId);
+  watch.wallet.off("transfer:claimed", watch.onTransfer);
+  sessions.unpin(watch.wallet);
+  await sessions.release(watch.wallet);
+}
+
+async function handleWatchOffer(id: string, payload: WatchOfferPayload): Promise<WorkerResponse<WatchOfferResult>> {
+  const timings: Timings = {};
+  try {
+    await unwatchOffer(payload.watchId);
+    const wallet = await loadWalletWithOptions(payload.mnemonic, payload.network, payload.environment, timings);
+    sessions.pin(wallet);
+
+    let checking = false;
+    let recheck = false;
+    let cursor = payload.cursor;
+    const watch: OfferWatch = {
+      wallet,
+      onTransfer: async () => {
+        // Coalesce bursts of transfer events into sequential re-checks.
+        if (checking) {
+          recheck = true;
+          return;
         }
-      } else if (offer.asset === "TOKEN") {
-        const tokenBalance = balance.tokenBalances.get(offer.tokenIdentifier);
-        if (tokenBalance && tokenBalance.availableToSendBalance >= offer.amount) {
-          const address = await measure("getSparkAddress", () => wallet!.getSparkAddress(), timings);
-          const resp = await measure("sparkscan", () => fetch(`https://api.sparkscan.io/v1/address/${address}/transactions?network=${payload.network}&limit=25&offset=0`, { headers: { accept: "application/json" } }), timings);
-          const transactions = (await resp.json()).data;
-          if (transactions && transactions.length > 0) {
-            for (const tx of transactions) {
-              if (tx.type === "token_transfer" && tx.direction === "incoming" && tx.tokenMetadata?.tokenIdentifier === offer.tokenIdentifier) {
-                return ok(id, { paid: true, sending_address: tx.counterparty?.identifier ?? null }, timings);
-              }
+        checking = true;
+        try {
+          do {
+            recheck = false;
+            const status = await checkOffers(wallet, { ...payload, cursor }, {});
+            cursor = status.cursor;
+            if (status.paid && watches.get(payload.watchId) === watch) {
+              parentPort!.postMessage({ event: "offerMet", watchId: payload.watchId, result: status } as WorkerEvent);
             }
-          }
-          return ok(id, { paid: true, sending_address: null }, timings);
+          } while (recheck);
+        } catch (e) {
+          console.warn(`Offer check failed for watch ${payload.watchId}:`, e);
+        } finally {
+          checking = false;
         }
-      }
+      },
+    };
+    // Subscribe before the initial check so a payment landing in between is not missed.
+    wallet.on("transfer:claimed", watch.onTransfer);
+    watches.set(payload.watchId, watch);
+
+    try {
+      const status = await measure("checkOffers", () => checkOffers(wallet, { ...payload, cursor }, timings), timings);
+      cursor = status.cursor;
+      return ok(id, { threadId, status }, timings);
+    } catch (e) {
+      await unwatchOffer(payload.watchId).catch(() => {});
+      throw e;
     }
-    return ok(id, { paid: false, sending_address: null }, timings);
   } catch (e) {
     console.error(e);
     return err(id, e, timings);
-  } finally {
-    if (wallet) await measure("cleanupConnections", () => wallet!.cleanupConnections(), timings).catch(() => {});
+  }
+}
+
+async function handleUnwatchOffer(id: string, payload: UnwatchOfferPayload): Promise<WorkerResponse<UnwatchOfferResult>> {
+  const timings: Timings = {};
+  try {
+    await measure("unwatchOffer", () => unwatchOffer(payload.watchId), timings);
+    return ok(id, { ok: true }, timings);
+  } catch (e) {
+    console.error(e);
+    return err(id, e, timings);
   }
 }
 
 async function handleTransferAll(id: string, payload: TransferAllPayload): Promise<WorkerResponse<TransferAllResult>> {
   const timings: Timings = {};
-  let wallet: SparkWallet | null = null;
+  let wallet: BackendWallet | null = null;
   try {
-    wallet = await loadWalletWithOptions(payload.mnemonic, payload.network as keyof typeof Network, payload.environment, timings);
+    wallet = await loadWalletWithOptions(payload.mnemonic, payload.network, payload.environment, timings);
     const balance = await measure("getBalance", () => wallet!.getBalance(), timings);
+    // Sats and each token live in separate outputs, so they can be sent concurrently.
+    const transfers: SweptBalance[] = [];
     if (balance.balance > 0) {
-      await measure("transfer", () => wallet!.transfer({
-        amountSats: Number(balance.balance),
-        receiverSparkAddress: payload.receiverSparkAddress,
-      }), timings);
+      transfers.push({ asset: "BITCOIN", amount: Number(balance.balance) });
     }
-    const tokenEntries = Array.from(balance.tokenBalances.entries());
-    for (const [tokenIdentifier, tokenBalance] of tokenEntries) {
-      await measure(
-        "transferTokens",
-        () => wallet!.transferTokens({
-          tokenIdentifier: tokenIdentifier as Bech32mTokenIdentifier,
-          tokenAmount: tokenBalance.availableToSendBalance,
-          receiverSparkAddress: payload.receiverSparkAddress,
-        }),
-        timings
-      );
+    for (const [tokenIdentifier, tokenBalance] of balance.tokenBalances.entries()) {
+      if (tokenBalance.availableToSendBalance > 0n) {
+        transfers.push({ asset: "TOKEN", tokenIdentifier, amount: Number(tokenBalance.availableToSendBalance) });
+      }
     }
-    return ok(id, { ok: true }, timings);
+    const started = await forEachConcurrent(transfers, sweepConcurrency, payload.deadline, async (transfer) => {
+      try {
+        if (transfer.asset === "BITCOIN") {
+          const { id } = await measure("transfer", () => wallet!.transfer({
+            amountSats: transfer.amount,
+            receiverSparkAddress: payload.receiverSparkAddress,
+          }), timings);
+          transfer.id = id;
+        } else {
+          const tokenBalance = balance.tokenBalances.get(transfer.tokenIdentifier!)!;
+          const txid = await measure("transferTokens", () => wallet!.transferTokens({
+            tokenIdentifier: transfer.tokenIdentifier!,
+            tokenAmount: tokenBalance.availableToSendBalance,
+            receiverSparkAddress: payload.receiverSparkAddress,
+          }), timings);
+          transfer.id = String(txid);
+        }
+      } catch (e) {
+        console.error(e);
+        transfer.error = toWorkerError(e);
+      }
+    });
+    const attempted = transfers.slice(0, started);
+    return ok(id, { transfers: attempted, complete: started === transfers.length && attempted.every((t) => !t.error) }, timings);
   } catch (e) {
     console.error(e);
     return err(id, e, timings);
   } finally {
-    if (wallet) await measure("cleanupConnections", () => wallet!.cleanupConnections(), timings).catch(() => {});
+    if (wallet) await measure("releaseWallet", () => sessions.release(wallet!), timings).catch(() => {});
   }
 }
 
 async function handleGetStaticDepositAddress(id: string, payload: GetStaticDepositAddressPayload): Promise<WorkerResponse<GetStaticDepositAddressResult>> {
   const timings: Timings = {};
-  let wallet: SparkWallet | null = null;
+  let wallet: BackendWallet | null = null;
   try {
-    wallet = await loadWalletWithOptions(payload.mnemonic, payload.network as keyof typeof Network, payload.environment, timings);
+    wallet = await loadWalletWithOptions(payload.mnemonic, payload.network, payload.environment, timings);
     const depositAddress = await measure("getStaticDepositAddress", () => wallet!.getStaticDepositAddress(), timings);
     return ok(id, { depositAddress: depositAddress as string }, timings);
   } catch (e) {
     console.error(e);
     return err(id, e, timings);
   } finally {
-    if (wallet) await measure("cleanupConnections", () => wallet!.cleanupConnections(), timings).catch(() => {});
+    if (wallet) await measure("releaseWallet", () => sessions.release(wallet!), timings).catch(() => {});
   }
 }
 
 async function handleGetDepositUtxos(id: string, payload: GetDepositUtxosPayload): Promise<WorkerResponse<GetDepositUtxosResult>> {
   const timings: Timings = {};
-  let wallet: SparkWallet | null = null;
+  let wallet: BackendWallet | null = null;
   try {
-    wallet = await loadWalletWithOptions(payload.mnemonic, payload.network as keyof typeof Network, payload.environment, timings);
+    wallet = await loadWalletWithOptions(payload.mnemonic, payload.network, payload.environment, timings);
     // includeClaimed defaults to true to show all UTXOs; SDK uses excludeClaimed as 4th param
     const excludeClaimed = payload.includeClaimed === false;
     const rawUtxos = await measure("getUtxosForDepositAddress", () => wallet!.getUtxosForDepositAddress(payload.depositAddress, undefined, undefined, excludeClaimed), timings) as any[];
@@ -353,15 +679,15 @@ async function handleGetDepositUtxos(id: string, payload: GetDepositUtxosPayload
     console.error(e);
     return err(id, e, timings);
   } finally {
-    if (wallet) await measure("cleanupConnections", () => wallet!.cleanupConnections(), timings).catch(() => {});
+    if (wallet) await measure("releaseWallet", () => sessions.release(wallet!), timings).catch(() => {});
   }
 }
 
 async function handleClaimStaticDeposit(id: string, payload: ClaimStaticDepositPayload): Promise<WorkerResponse<ClaimStaticDepositResult>> {
   const timings: Timings = {};
-  let wallet: SparkWallet | null = null;
+  let wallet: BackendWallet | null = null;
   try {
-    wallet = await loadWalletWithOptions(payload.mnemonic, payload.network as keyof typeof Network, payload.environment, timings);
+    wallet = await loadWalletWithOptions(payload.mnemonic, payload.network, payload.environment, timings);
     const quote = await measure("getClaimStaticDepositQuote", () => wallet!.getClaimStaticDepositQuote(payload.txHash, payload.vout), timings) as any;
     await measure("claimStaticDeposit", () => wallet!.claimStaticDeposit({
       transactionId: quote.transactionId,
@@ -378,15 +704,15 @@ async function handleClaimStaticDeposit(id: string, payload: ClaimStaticDepositP
     console.error(e);
     return err(id, e, timings);
   } finally {
-    if (wallet) await measure("cleanupConnections", () => wallet!.cleanupConnections(), timings).catch(() => {});
+    if (wallet) await measure("releaseWallet", () => sessions.release(wallet!), timings).catch(() => {});
   }
 }
 
 async function handleClaimAllStaticDeposits(id: string, payload: ClaimAllStaticDepositsPayload): Promise<WorkerResponse<ClaimAllStaticDepositsResult>> {
   const timings: Timings = {};
-  let wallet: SparkWallet | null = null;
+  let wallet: BackendWallet | null = null;
   try {
-    wallet = await loadWalletWithOptions(payload.mnemonic, payload.network as keyof typeof Network, payload.environment, timings);
+    wallet = await loadWalletWithOptions(payload.mnemonic, payload.network, payload.environment, timings);
     
     // Get the static deposit address
     const depositAddress = await measure("getStaticDepositAddress", () => wallet!.getStaticDepositAddress(), timings) as string;
@@ -395,11 +721,11 @@ async function handleClaimAllStaticDeposits(id: string, payload: ClaimAllStaticD
     const rawUtxos = await measure("getUtxosForDepositAddress", () => wallet!.getUtxosForDepositAddress(depositAddress, undefined, undefined, true), timings) as any[];
     
     const claims: ClaimedDeposit[] = [];
+    const failed: FailedClaim[] = [];
     let totalClaimedSats = 0;
     
-    // Claim each unclaimed UTXO
-    for (const utxo of rawUtxos) {
-      
+    // Quote and claim up to SPARK_SWEEP_CONCURRENCY UTXOs at a time
+    const started = await forEachConcurrent(rawUtxos, sweepConcurrency, payload.deadline, async (utxo) => {
       const txHash = utxo.txHash ?? utxo.txid ?? (utxo as any).transactionHash;
       const vout = utxo.vout ?? (utxo as any).outputIndex ?? 0;
       
@@ -420,23 +746,25 @@ async function handleClaimAllStaticDeposits(id: string, payload: ClaimAllStaticD
       } catch (claimErr) {
         // Log but continue with other UTXOs
         console.warn(`Failed to claim UTXO ${txHash}:${vout}:`, claimErr);
+        failed.push({ txHash, vout, error: toWorkerError(claimErr) });
       }
-    }
+    });
     
-    return ok(id, { claims, totalClaimedSats }, timings);
+    const remaining = rawUtxos.length - started;
+    return ok(id, { claims, totalClaimedSats, failed, remaining, complete: remaining === 0 && failed.length === 0 }, timings);
   } catch (e) {
     console.error(e);
     return err(id, e, timings);
   } finally {
-    if (wallet) await measure("cleanupConnections", () => wallet!.cleanupConnections(), timings).catch(() => {});
+    if (wallet) await measure("releaseWallet", () => sessions.release(wallet!), timings).catch(() => {});
   }
 }
 
 async function handleCoopExit(id: string, payload: CoopExitPayload): Promise<WorkerResponse<CoopExitResult>> {
   const timings: Timings = {};
-  let wallet: SparkWallet | null = null;
+  let wallet: BackendWallet | null = null;
   try {
-    wallet = await loadWalletWithOptions(payload.mnemonic, payload.network as keyof typeof Network, payload.environment, timings);
+    wallet = await loadWalletWithOptions(payload.mnemonic, payload.network, payload.environment, timings);
     
     const exitSpeedInput = payload.exitSpeed ?? "fast";
     const deductFeeFromWithdrawalAmount = payload.deductFeeFromWithdrawalAmount ?? false;
@@ -476,7 +804,82 @@ async function handleCoopExit(id: string, payload: CoopExitPayload): Promise<Wor
     console.error(e);
     return err(id, e, timings);
   } finally {
-    if (wallet) await measure("cleanupConnections", () => wallet!.cleanupConnections(), timings).catch(() => {});
+    if (wallet) await measure("releaseWallet", () => sessions.release(wallet!), timings).catch(() => {});
+  }
+}
+
+async function runBatchItem(wallet: BackendWallet, item: BatchItem, timings: Timings) {
+  switch (item.type) {
+    case "transfer": {
+      const { id } = await measure("transfer", () => wallet.transfer({
+        amountSats: item.amountSats,
+        receiverSparkAddress: item.receiverSparkAddress,
+      }), timings);
+      return { id };
+    }
+    case "transferTokens": {
+      const id = await measure("transferTokens", () => wallet.transferTokens({
+        tokenIdentifier: item.tokenIdentifier,
+        tokenAmount: BigInt(item.tokenAmount),
+        receiverSparkAddress: item.receiverSparkAddress,
+      }), timings);
+      return { id: String(id) };
+    }
+    case "payLightningInvoice": {
+      const { id } = await measure("payLightningInvoice", () => wallet.payLightningInvoice({
+        invoice: item.invoice,
+        maxFeeSats: item.maxFeeSats,
+      }), timings);
+      return { id };
+    }
+    case "createLightningInvoice": {
+      const { invoice } = await measure("createLightningInvoice", () => wallet.createLightningInvoice({
+        amountSats: item.amountSats,
+        memo: item.memo,
+        expirySeconds: item.expirySeconds,
+      }), timings);
+      return { invoice: invoice.encodedInvoice };
+    }
+  }
+}
+
+// Runs the items in order against one wallet session, so a payout run pays
+// for wallet startup once rather than per item. Items fail independently.
+async function handleBatch(id: string, payload: BatchPayload): Promise<WorkerResponse<BatchResult>> {
+  const timings: Timings = {};
+  let wallet: BackendWallet | null = null;
+  try {
+    try {
+      wallet = await loadWalletWithOptions(payload.mnemonic, payload.network, payload.environment, timings);
+    } catch (e) {
+      console.error(e);
+      // Reported as a result so the caller knows that no item was attempted.
+      const results: BatchItemResult[] = payload.items.map(() => ({ status: "skipped", durationMs: 0 }));
+      return ok(id, { results, loadError: toWorkerError(e) }, timings);
+    }
+    const results: BatchItemResult[] = [];
+    let failed = false;
+    for (const item of payload.items) {
+      if ((failed && payload.stopOnError) || cancelled() || (payload.deadline !== undefined && Date.now() >= payload.deadline)) {
+        results.push({ status: "skipped", durationMs: 0 });
+        continue;
+      }
+      const start = performance.now();
+      try {
+        const result = await runBatchItem(wallet, item, timings);
+        results.push({ status: "done", result, durationMs: performance.now() - start });
+      } catch (e) {
+        console.error(e);
+        failed = true;
+        results.push({ status: "failed", error: toWorkerError(e), durationMs: performance.now() - start });
+      }
+    }
+    return ok(id, { results }, timings);
+  } catch (e) {
+    console.error(e);
+    return err(id, e, timings);
+  } finally {
+    if (wallet) await measure("releaseWallet", () => sessions.release(wallet!), timings).catch(() => {});
   }
 }
 
@@ -484,54 +887,85 @@ if (!parentPort) {
   throw new Error('Worker must be run as a worker thread');
 }
 
-parentPort.on('message', async (msg: WorkerRequest) => {
+parentPort.on('message', (msg: WorkerRequest) => {
+  if (msg.op === "cancel") {
+    inFlight.get((msg.payload as CancelPayload).id)?.abort();
+    return;
+  }
+  const receivedAt = preciseNow();
+  const controller = new AbortController();
+  const context: RequestContext = { spans: msg.trace ? [] : undefined, signal: controller.signal };
+  inFlight.set(msg.id, controller);
+  const reply = (response: WorkerResponse) => {
+    inFlight.delete(msg.id);
+    parentPort!.postMessage({ ...response, receivedAt, spans: context.spans });
+  };
+  requestContext.run(context, () => handleMessage(msg, reply));
+});
+
+async function handleMessage(msg: WorkerRequest, reply: (response: WorkerResponse) => void) {
   const { id, op, payload } = msg;
   switch (op) {
     case "initialize":
-      parentPort!.postMessage(await handleInitialize(id, payload as InitializePayload));
+      reply(await handleInitialize(id, payload as InitializePayload));
       break;
     case "balance":
-      parentPort!.postMessage(await handleBalance(id, payload as BalancePayload));
+      reply(await handleBalance(id, payload as BalancePayload));
       break;
     case "transfer":
-      parentPort!.postMessage(await handleTransfer(id, payload as TransferPayload));
+      reply(await handleTransfer(id, payload as TransferPayload));
       break;
     case "transferTokens":
-      parentPort!.postMessage(await handleTransferTokens(id, payload as TransferTokensPayload));
+      reply(await handleTransferTokens(id, payload as TransferTokensPayload));
       break;
     case "payLightningInvoice":
-      parentPort!.postMessage(await handlePayLightningInvoice(id, payload as PayLightningInvoicePayload));
+      reply(await handlePayLightningInvoice(id, payload as PayLightningInvoicePayload));
       break;
     case "createLightningInvoice":
-      parentPort!.postMessage(await handleCreateLightningInvoice(id, payload as CreateLightningInvoicePayload));
+      reply(await handleCreateLightningInvoice(id, payload as CreateLightningInvoicePayload));
+      break;
+    case "createInvoiceWallet":
+      reply(await handleCreateInvoiceWallet(id, payload as CreateInvoiceWalletPayload));
       break;
     case "createThirdPartyLightningInvoice":
-      parentPort!.postMessage(await handleCreateThirdPartyLightningInvoice(id, payload as CreateThirdPartyLightningInvoicePayload));
+      reply(await handleCreateThirdPartyLightningInvoice(id, payload as CreateThirdPartyLightningInvoicePayload));
       break;
     case "isOfferMet":
-      parentPort!.postMessage(await handleIsOfferMet(id, payload as IsOfferMetPayload));
+      reply(await handleIsOfferMet(id, payload as IsOfferMetPayload));
       break;
     case "transferAll":
-      parentPort!.postMessage(await handleTransferAll(id, payload as TransferAllPayload));
+      reply(await handleTransferAll(id, payload as TransferAllPayload));
       break;
     case "getStaticDepositAddress":
-      parentPort!.postMessage(await handleGetStaticDepositAddress(id, payload as GetStaticDepositAddressPayload));
+      reply(await handleGetStaticDepositAddress(id, payload as GetStaticDepositAddressPayload));
       break;
     case "getDepositUtxos":
-      parentPort!.postMessage(await handleGetDepositUtxos(id, payload as GetDepositUtxosPayload));
+      reply(await handleGetDepositUtxos(id, payload as GetDepositUtxosPayload));
       break;
     case "claimStaticDeposit":
-      parentPort!.postMessage(await handleClaimStaticDeposit(id, payload as ClaimStaticDepositPayload));
+      reply(await handleClaimStaticDeposit(id, payload as ClaimStaticDepositPayload));
       break;
     case "claimAllStaticDeposits":
-      parentPort!.postMessage(await handleClaimAllStaticDeposits(id, payload as ClaimAllStaticDepositsPayload));
+      reply(await handleClaimAllStaticDeposits(id, payload as ClaimAllStaticDepositsPayload));
       break;
     case "coopExit":
-      parentPort!.postMessage(await handleCoopExit(id, payload as CoopExitPayload));
+      reply(await handleCoopExit(id, payload as CoopExitPayload));
+      break;
+    case "watchOffer":
+      reply(await handleWatchOffer(id, payload as WatchOfferPayload));
+      break;
+    case "unwatchOffer":
+      reply(await handleUnwatchOffer(id, payload as UnwatchOfferPayload));
+      break;
+    case "batch":
+      reply(await handleBatch(id, payload as BatchPayload));
+      break;
+    case "sessionStats":
+      reply(ok(id, sessions.stats(), {}));
       break;
     default:
-      parentPort!.postMessage({ id, ok: false, error: { name: "BadRequest", message: `Unknown op: ${String(op)}` } as WorkerResponse["error"] });
+      reply({ id, ok: false, error: { name: "BadRequest", message: `Unknown op: ${String(op)}` } as WorkerResponse["error"] });
   }
-});
+}
 
 
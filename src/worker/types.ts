@@ -8,13 +8,20 @@ export type WorkerOp =
   | "payLightningInvoice"
   | "createLightningInvoice"
   | "createThirdPartyLightningInvoice"
+  | "createInvoiceWallet"
   | "isOfferMet"
   | "transferAll"
   | "getStaticDepositAddress"
   | "getDepositUtxos"
   | "claimStaticDeposit"
   | "claimAllStaticDeposits"
-  | "coopExit";
+  | "coopExit"
+  | "watchOffer"
+  | "unwatchOffer"
+  | "batch"
+  | "sessionStats"
+  // Sent by the pool when a call times out; payload is CancelPayload and there is no reply.
+  | "cancel";
 
 export type Environment = "dev" | "prod";
 export type NetworkName = "MAINNET" | "REGTEST" | "TESTNET" | "SIGNET" | "LOCAL";
@@ -27,6 +34,18 @@ export type WorkerRequest = {
   id: string;
   op: WorkerOp;
   payload: unknown;
+  // The HTTP request this call serves, if any; spans are only collected when `trace` is set.
+  requestId?: string;
+  trace?: boolean;
+};
+
+export type CancelPayload = { id: string };
+
+// Start times are epoch milliseconds (performance.timeOrigin + performance.now()).
+export type TraceSpan = {
+  name: string;
+  start: number;
+  durationMs: number;
 };
 
 export type WorkerError = { name: string; message: string; stack?: string };
@@ -37,6 +56,16 @@ export type WorkerResponse<T = unknown> = {
   result?: T;
   error?: WorkerError;
   timings?: Record<string, number>;
+  // When the worker picked the request up; the gap from dispatch is queueing.
+  receivedAt?: number;
+  spans?: TraceSpan[];
+};
+
+// Unsolicited messages pushed from a worker, e.g. by an offer watch.
+export type WorkerEvent = {
+  event: "offerMet";
+  watchId: string;
+  result: IsOfferMetResult;
 };
 
 export type InitializePayload = {
@@ -50,6 +79,8 @@ export type BalancePayload = {
   mnemonic: string;
   network: NetworkName;
   environment: Environment;
+  // The wallet's address if the caller already knows it; saves a lookup.
+  address?: SparkAddressFormat;
 };
 
 export type TokenInfo = {
@@ -112,6 +143,17 @@ export type CreateLightningInvoicePayload = {
   expirySeconds?: number;
 };
 
+// A new wallet and, when amountSats is set, a Lightning invoice to it, made in one session.
+export type CreateInvoiceWalletPayload = {
+  network: NetworkName;
+  environment: Environment;
+  amountSats?: number;
+  memo?: string;
+  expirySeconds?: number;
+};
+
+export type CreateInvoiceWalletResult = { mnemonic: string; address: string; invoice: string | null };
+
 export type CreateThirdPartyLightningInvoicePayload = {
   network: NetworkName;
   environment: Environment;
@@ -132,21 +174,81 @@ export type IsOfferMetPayload = {
   network: NetworkName;
   environment: Environment;
   offers: Offer[];
+  since?: number; // epoch ms; payments older than this (less some clock skew) are ignored
+  cursor?: MatchCursor;
+};
+
+/**
+ * What an invoice has been paid so far, and the newest Spark transfer and
+ * SparkScan token transaction already counted, so that the next check only
+ * reads newer entries. Stored on the invoice between scans.
+ */
+export type MatchCursor = {
+  transferId: string | null;
+  transactionId: string | null;
+  // Set while a check that hit the page limit has older entries left to read.
+  transferResume?: MatchResume;
+  transactionResume?: MatchResume;
+  receivedSats: number;
+  receivedTokens: Record<string, number>;
+  // Per asset ("BITCOIN" or token identifier): the sender of every counted
+  // payment, or null once payments came from more than one sender.
+  senders: Record<string, string | null>;
+};
+
+/**
+ * Entries from `newestId` down to `id`, which was `offset` entries from the
+ * newest when last read, are counted; the next check continues below `id`
+ * and then moves the stop id up to `newestId`.
+ */
+export type MatchResume = {
+  id: string;
+  offset: number;
+  newestId: string;
 };
 
 export type IsOfferMetResult = {
   paid: boolean;
   sending_address: string | null;
+  cursor?: MatchCursor;
 };
 
+export type WatchOfferPayload = IsOfferMetPayload & {
+  watchId: string;
+};
+
+export type WatchOfferResult = {
+  threadId: number;
+  status: IsOfferMetResult;
+};
+
+export type UnwatchOfferPayload = {
+  watchId: string;
+};
+
+export type UnwatchOfferResult = { ok: true };
+
 export type TransferAllPayload = {
   mnemonic: string;
   network: NetworkName;
   environment: Environment;
   receiverSparkAddress: SparkAddressFormat;
+  deadline?: number; // epoch ms; no new transfers are started after it
+};
+
+export type SweptBalance = {
+  asset: "BITCOIN" | "TOKEN";
+  tokenIdentifier?: string;
+  amount: number;
+  id?: string;
+  error?: WorkerError;
 };
 
-export type TransferAllResult = { ok: true };
+// Calling transferAll again resumes an incomplete sweep: it only sees what is left.
+export type TransferAllResult = {
+  transfers: SweptBalance[];
+  complete: boolean;
+};
 
 // Static Deposit Types
 
@@ -198,6 +300,7 @@ export type ClaimAllStaticDepositsPayload = {
   mnemonic: string;
   network: NetworkName;
   environment: Environment;
+  deadline?: number; // epoch ms; no new claims are started after it
 };
 
 export type ClaimedDeposit = {
@@ -208,9 +311,20 @@ export type ClaimedDeposit = {
   claimedAmountSats: number;
 };
 
+export type FailedClaim = {
+  txHash: string;
+  vout: number;
+  error: WorkerError;
+};
+
+// Unclaimed UTXOs not attempted before the deadline are counted in
+// `remaining`; calling again picks them up.
 export type ClaimAllStaticDepositsResult = {
   claims: ClaimedDeposit[];
   totalClaimedSats: number;
+  failed: FailedClaim[];
+  remaining: number;
+  complete: boolean;
 };
 
 // Coop Exit Types
@@ -236,4 +350,28 @@ export type CoopExitResult = {
   status: string;
 };
 
+// Batch Types
+
+export type BatchItem =
+  | { type: "transfer"; amountSats: number; receiverSparkAddress: SparkAddressFormat }
+  | { type: "transferTokens"; tokenIdentifier: Bech32mTokenIdentifier; tokenAmount: string; receiverSparkAddress: SparkAddressFormat }
+  | { type: "payLightningInvoice"; invoice: string; maxFeeSats: number }
+  | { type: "createLightningInvoice"; amountSats: number; memo?: string; expirySeconds?: number };
+
+export type BatchPayload = {
+  mnemonic: string;
+  network: NetworkName;
+  environment: Environment;
+  items: BatchItem[];
+  stopOnError?: boolean;
+  deadline?: number; // epoch ms; no new items are started after it
+};
+
+export type BatchItemResult =
+  | { status: "done"; result: TransferResult | TransferTokensResult | PayLightningInvoiceResult | CreateLightningInvoiceResult; durationMs: number }
+  | { status: "failed"; error: WorkerError; durationMs: number }
+  | { status: "skipped"; durationMs: 0 };
 
+// One entry per item, in order. `loadError` is set, and every item
+// skipped, when the wallet could not be loaded, so nothing ran.
+export type BatchResult = { results: BatchItemResult[]; loadError?: WorkerError };